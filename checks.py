@@ -2,6 +2,10 @@
 
 import discord
 from discord.ext import commands
+import logging
+import metrics
+
+logger = logging.getLogger(__name__)
 
 def _has_allowed_role(bot, user, guild) -> bool:
     # Single place for role logic, true if no restriction or user has an allowed role
@@ -15,12 +19,17 @@ def _has_allowed_role(bot, user, guild) -> bool:
 
 def interaction_has_allowed_role(interaction: discord.Interaction) -> bool:
     # Use for slash commands
-    return _has_allowed_role(interaction.client, interaction.user, interaction.guild)
+    passed = _has_allowed_role(interaction.client, interaction.user, interaction.guild)
+    if not passed:
+        metrics.role_check_failures.inc()
+    return passed
 
 async def check_allowed_roles(ctx: commands.Context) -> bool:
     # Used with @commands.check() for prefix commands, logs to console on failure
     passed = _has_allowed_role(ctx.bot, ctx.author, ctx.guild)
     if not passed:
+        metrics.role_check_failures.inc()
         channel = getattr(ctx.channel, "name", "?")
-        print(f"[DEBUG] Role check failed: {ctx.author} ({ctx.author.id}) tried !{ctx.command} in #{channel} but lacks an allowed role.")
+        logger.debug("Role check failed: %s (%s) tried !%s in #%s but lacks an allowed role.", ctx.author, ctx.author.id, ctx.command, channel,
+                     extra={"guild_id": getattr(ctx.guild, "id", None), "user_id": ctx.author.id})
     return passed
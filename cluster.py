@@ -0,0 +1,263 @@
+"""Cluster launcher. Runs the bot as several worker processes, each owning a range of shards.
+
+    python cluster.py --clusters 4 [--shards 16]
+
+Each worker is a normal `main.py` process started with SHARD_COUNT, SHARD_IDS and CLUSTER_ID set,
+so it keeps its own gateway connections, event loop and audio state. The supervisor restarts
+workers that exit, and merges the status each worker writes into cluster_status.json.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+import processes
+
+logger = logging.getLogger(__name__)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+STATUS_INTERVAL = 10
+
+
+# --- Worker side (used by main.py) ---
+
+def _status(bot):
+    audio = bot.get_cog("Audio")
+    players = getattr(audio, "players", {})
+    return {
+        "cluster_id": getattr(bot, "cluster_id", 0),
+        "pid": os.getpid(),
+        "updated": time.time(),
+        "ready": bot.is_ready(),
+        "shard_count": bot.shard_count,
+        "shard_ids": sorted(getattr(bot, "shards", {}) or ([bot.shard_id] if bot.shard_id is not None else [])),
+        "latencies": {str(shard_id): round(latency, 4) for shard_id, latency in getattr(bot, "latencies", [])},
+        "guilds": len(bot.guilds),
+        "voice_clients": len(bot.voice_clients),
+        "players": len(players),
+        "queued": sum(p.queue_length() for p in list(players.values())),
+        "uptime": time.time() - bot.start_time if getattr(bot, "start_time", None) else 0,
+    }
+
+
+async def report_status(bot, path, interval=STATUS_INTERVAL):
+    """Write this worker's status to `path` every `interval` seconds for the supervisor to merge."""
+    while True:
+        try:
+            data = json.dumps(_status(bot))
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning("Failed to write cluster status: %s", e)
+        await asyncio.sleep(interval)
+
+
+# --- Supervisor ---
+
+def recommended_shards(token):
+    """Ask Discord how many shards this bot should use."""
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordBot (woolwav cluster launcher)"},
+    )
+    with urllib.request.urlopen(request, timeout=15) as response:
+        return json.load(response)["shards"]
+
+
+def split_shards(shard_count, clusters):
+    """Split shard IDs into `clusters` contiguous ranges as evenly as possible."""
+    clusters = max(1, min(clusters, shard_count))
+    base, extra = divmod(shard_count, clusters)
+    ranges = []
+    start = 0
+    for i in range(clusters):
+        size = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+def split_process_limits(clusters):
+    """Per-worker ffmpeg caps that add up to the host-wide FFMPEG_MAX_PROCESSES/FFMPEG_MAX_BACKGROUND.
+
+    Each worker has its own scheduler, so without this every worker would get the whole cap.
+    """
+    defaults = processes.ProcessScheduler()
+    total = int(os.getenv("FFMPEG_MAX_PROCESSES") or 0) or defaults.max_processes
+    background = int(os.getenv("FFMPEG_MAX_BACKGROUND") or 0) or defaults.max_background
+    return {
+        "FFMPEG_MAX_PROCESSES": str(max(1, total // clusters)),
+        "FFMPEG_MAX_BACKGROUND": str(max(1, background // clusters)),
+    }
+
+
+class Worker:
+    """One main.py process and its restart bookkeeping."""
+
+    # Restart delay doubles after each quick crash, up to this many seconds
+    MAX_BACKOFF = 60
+    # A worker that ran at least this long is considered healthy again
+    STABLE_SECONDS = 120
+
+    def __init__(self, cluster_id, shard_ids, shard_count, status_path, metrics_port=None, env=None):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.status_path = status_path
+        self.metrics_port = metrics_port
+        self.env = env or {}
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.next_start = 0
+
+    def start(self):
+        # Don't report the previous process's status as this one's
+        try:
+            os.remove(self.status_path)
+        except OSError:
+            pass
+        env = dict(os.environ)
+        env.update({
+            "CLUSTER_ID": str(self.cluster_id),
+            "SHARD_COUNT": str(self.shard_count),
+            "SHARD_IDS": ",".join(map(str, self.shard_ids)),
+            "CLUSTER_STATUS_FILE": self.status_path,
+        })
+        env.update(self.env)
+        if self.metrics_port is not None:
+            env["METRICS_PORT"] = str(self.metrics_port)
+        self.process = subprocess.Popen([sys.executable, os.path.join(script_dir, "main.py")], env=env, cwd=script_dir)
+        self.started_at = time.monotonic()
+        logger.info("Started cluster %d (pid %d) with shards %d-%d", self.cluster_id, self.process.pid, self.shard_ids[0], self.shard_ids[-1])
+
+    def check(self):
+        """Restart the worker if it has exited and its backoff has passed."""
+        now = time.monotonic()
+        if self.process is None:
+            if now >= self.next_start:
+                self.start()
+            return
+        code = self.process.poll()
+        if code is None:
+            return
+        ran_for = now - self.started_at
+        self.restarts = 0 if ran_for >= self.STABLE_SECONDS else self.restarts + 1
+        delay = min(self.MAX_BACKOFF, 2 ** self.restarts) if self.restarts else 1
+        logger.warning("Cluster %d exited with code %s after %.0fs; restarting in %ds.", self.cluster_id, code, ran_for, delay)
+        self.process = None
+        self.next_start = now + delay
+
+    def stop(self, timeout=15):
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def status(self):
+        try:
+            with open(self.status_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        running = self.process is not None and self.process.poll() is None
+        # A worker that stops reporting is hung even if its process is alive
+        stale = not data or time.time() - data.get("updated", 0) > STATUS_INTERVAL * 3
+        data.update({
+            "cluster_id": self.cluster_id,
+            "running": running,
+            "healthy": running and not stale and data.get("ready", False),
+            "restarts": self.restarts,
+        })
+        return data
+
+
+def merge_status(workers):
+    clusters = [w.status() for w in workers]
+    return {
+        "updated": time.time(),
+        "clusters": clusters,
+        "healthy": sum(1 for c in clusters if c["healthy"]),
+        "guilds": sum(c.get("guilds", 0) for c in clusters),
+        "voice_clients": sum(c.get("voice_clients", 0) for c in clusters),
+        "players": sum(c.get("players", 0) for c in clusters),
+        "queued": sum(c.get("queued", 0) for c in clusters),
+    }
+
+
+def supervise(workers, status_path):
+    stopping = False
+
+    def _stop(_signum, _frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, _stop)
+    signal.signal(signal.SIGTERM, _stop)
+    last_report = 0
+    while not stopping:
+        for worker in workers:
+            worker.check()
+        if time.monotonic() - last_report >= STATUS_INTERVAL:
+            last_report = time.monotonic()
+            merged = merge_status(workers)
+            tmp_path = f"{status_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(merged, f, indent=4)
+            os.replace(tmp_path, status_path)
+            logger.info("%d/%d clusters healthy, %d guilds, %d voice connections, %d queued tracks",
+                        merged["healthy"], len(workers), merged["guilds"], merged["voice_clients"], merged["queued"])
+        time.sleep(1)
+    logger.info("Stopping clusters...")
+    for worker in workers:
+        worker.stop()
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Run Woolwav as several sharded worker processes.")
+    parser.add_argument("--clusters", type=int, default=os.cpu_count() or 1, help="worker processes (default: CPU count)")
+    parser.add_argument("--shards", type=int, help="total shards (default: Discord's recommendation)")
+    parser.add_argument("--metrics-port", type=int, help="first METRICS_PORT; cluster N uses this + N")
+    args = parser.parse_args()
+
+    shard_count = args.shards
+    if not shard_count:
+        shard_count = recommended_shards(os.getenv("DISCORD_TOKEN"))
+        logger.info("Discord recommends %d shards.", shard_count)
+    run_dir = os.path.join(script_dir, "cache", "cluster")
+    os.makedirs(run_dir, exist_ok=True)
+    shard_ranges = split_shards(shard_count, args.clusters)
+    limits = split_process_limits(len(shard_ranges))
+    logger.info("Each cluster may run %s ffmpeg processes (%s in the background).",
+                limits["FFMPEG_MAX_PROCESSES"], limits["FFMPEG_MAX_BACKGROUND"])
+    workers = [
+        Worker(
+            i, shard_ids, shard_count,
+            os.path.join(run_dir, f"cluster-{i}.json"),
+            args.metrics_port + i if args.metrics_port is not None else None,
+            limits,
+        )
+        for i, shard_ids in enumerate(shard_ranges)
+    ]
+    supervise(workers, os.path.join(script_dir, "cluster_status.json"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,31 @@
 """Audio commands cog for core audio playback features."""
 
 import discord
+import hashlib
 import os
 import asyncio
+import collections
+import contextvars
+import functools
+import logging
 import time
-import subprocess
-import json
+from concurrent.futures import ThreadPoolExecutor
 from discord import app_commands
 from discord.ext import commands
+import metrics
+import processes
 from checks import interaction_has_allowed_role
+from library import AudioLibrary, VALID_EXTENSIONS, normalize_folder
+from metadata import MetadataStore
+from sources import TrackSource
+import dsp
+import mixer
+from mixer import MixerSource
+from transcode import OpusCache
+from soundboard import ClipCache, ClipSource
+from player import FolderCursor, GuildPlayer
+
+logger = logging.getLogger(__name__)
 
 
 class ChooseTrackView(discord.ui.View):
@@ -57,51 +74,347 @@ class ChooseTrackButton(discord.ui.Button):
         view.stop()
 
 
+class AudioPageButton(discord.ui.DynamicItem[discord.ui.Button], template=r"audio:(?P<page>\d+):(?P<size>\d+):(?P<folder>.*)"):
+    """Page button for /audio. Folder, page and page size live in the custom_id, so buttons keep working across restarts."""
+
+    def __init__(self, folder, page, page_size, label, disabled=False):
+        self.folder = folder
+        self.page = page
+        self.page_size = page_size
+        token = folder if len(folder) <= 80 else "#" + hashlib.sha1(folder.encode()).hexdigest()[:16]
+        super().__init__(
+            discord.ui.Button(
+                label=label,
+                style=discord.ButtonStyle.secondary,
+                custom_id=f"audio:{page}:{page_size}:{token}",
+                disabled=disabled,
+            )
+        )
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        cog = interaction.client.get_cog("Audio")
+        folder = match["folder"]
+        if folder.startswith("#") and cog:
+            folder = cog.library.folder_by_digest(folder[1:]) or folder
+        return cls(folder, int(match["page"]), int(match["size"]), item.label)
+
+    async def callback(self, interaction: discord.Interaction):
+        if not interaction_has_allowed_role(interaction):
+            await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+            return
+        cog = interaction.client.get_cog("Audio")
+        page = cog.build_audio_page(self.folder, self.page, self.page_size) if cog else None
+        if page is None:
+            await interaction.response.edit_message(content="This folder is no longer available.", embed=None, view=None)
+            return
+        embed, view = page
+        await interaction.response.edit_message(embed=embed, view=view)
+
+
 class AudioCog(commands.Cog):
+    # Start decoding the next queued track this many seconds before the current one ends
+    PREFETCH_LEAD_SECONDS = 5
+    # How often idle and empty voice channels are checked for
+    IDLE_CHECK_SECONDS = 15
+    # Threads for work that may wait for a process slot; enough that the scheduler, not this pool, decides who goes first
+    DECODER_THREADS = 64
+
     def __init__(self, bot):
         self.bot = bot
-        self.audio_queues = {}
-        self.looping = {}
-        self.current_track = {}
-        self.skip_requested = {}
-        self.queue_cache = {}
+        self.players = {}
         self.audio_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "audio")
-        self.next_play_start_offset = {}
-        self.playback_start_time = {}
-        self.total_duration_seconds = {}
-        self.accumulated_pause_seconds = {}
-        self.pause_start_time = {}
-        self.start_offset_seconds = {}
-        self.skipto_in_progress = {}
-        print("Cog 'audio' loaded.")
+        self.library = AudioLibrary(self.audio_folder)
+        self._rescan_task = None
+        cache_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cache")
+        self.metadata = MetadataStore(
+            os.path.join(cache_folder, "metadata.db"),
+            self.audio_folder,
+            workers=getattr(bot, "metadata_workers", 4),
+        )
+        self._metadata_lock = asyncio.Lock()
+        self._loudness_lock = asyncio.Lock()
+        opus_cache_mb = getattr(bot, "opus_cache_mb", 0)
+        self.opus_cache = OpusCache(
+            os.path.join(cache_folder, "opus"),
+            self.audio_folder,
+            opus_cache_mb * 1024 * 1024,
+            workers=getattr(bot, "metadata_workers", 4),
+        ) if opus_cache_mb else None
+        self._opus_misses = set()  # relative paths played without a cached Opus file, transcoded first
+        sfx_cache_mb = getattr(bot, "sfx_cache_mb", 0)
+        self.sfx_folders = [f for f in map(normalize_folder, getattr(bot, "sfx_folders", ())) if f]
+        self.clips = ClipCache(self.audio_folder, sfx_cache_mb * 1024 * 1024, self.opus_cache) if sfx_cache_mb and self.sfx_folders else None
+        self._init_task = None
+        self._processing_task = None
+        self._process_now = asyncio.Event()
+        self._idle_task = None
+        self._idle_since = {}  # guild ID -> monotonic time playback stopped
+        self._empty_since = {}  # guild ID -> monotonic time the voice channel emptied
+        self._recent = collections.OrderedDict()  # guild ID -> snapshot of an evicted player, least recent first
+        self._decoder_pool = ThreadPoolExecutor(max_workers=self.DECODER_THREADS, thread_name_prefix="decoder")
+        # Set once the library has been indexed; until then lookups would find nothing
+        self.library_ready = asyncio.Event()
+        logger.debug("Cog 'audio' loaded.")
         self.__cog_name__ = "Audio"
 
-    def get_queue(self, guild_id):
-        if guild_id not in self.audio_queues:
-            self.audio_queues[guild_id] = asyncio.Queue()
-            self.skip_requested[guild_id] = False
-            self.queue_cache[guild_id] = []
-        if guild_id not in self.looping:
-            self.looping[guild_id] = False
-        return self.audio_queues[guild_id]
+    async def cog_load(self):
+        self.bot.add_dynamic_items(AudioPageButton)
+        metrics.queue_depth.callback = lambda: {(gid,): p.queue_length() for gid, p in list(self.players.items())}
+        if self.clips:
+            metrics.sfx_cache_bytes.callback = lambda: {(): self.clips.nbytes}
+        # Indexing and probing can take a while on large libraries, so they don't hold up login
+        self._init_task = asyncio.create_task(self._initialize())
+        self._idle_task = asyncio.create_task(self._idle_sweep())
+
+    async def _initialize(self):
+        """Build the library index, then load and warm track metadata, once the bot is connected."""
+        await self.bot.wait_until_ready()
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self.library.build)
+        except Exception as e:
+            # Carry on with an empty index; the periodic rescan or /refresh can fill it later
+            logger.exception("Audio library indexing failed: %s", e)
+        indexed = time.perf_counter()
+        self.library_ready.set()
+        if self.library.start_watching():
+            logger.info("Indexed %d audio tracks; watching for changes.", self.library.track_count)
+        else:
+            logger.info("Indexed %d audio tracks; watchdog not installed, relying on rescans.", self.library.track_count)
+        self._rescan_task = asyncio.create_task(self._periodic_rescan())
+        await asyncio.to_thread(self.metadata.load)
+        if self.opus_cache:
+            await asyncio.to_thread(self.opus_cache.load)
+        logger.info("Startup (background): library index %.2fs, metadata load %.2fs", indexed - started, time.perf_counter() - indexed)
+        # In cluster mode every worker shares metadata.db, so one of them probing the library is enough
+        if getattr(self.bot, "cluster_id", 0) == 0:
+            await self.warm_metadata()
+        self._processing_task = asyncio.create_task(self._process_library())
+
+    async def _check_library_ready(self, interaction):
+        """Ask the user to retry if the library is still being indexed after startup. Returns whether it's ready."""
+        if self.library_ready.is_set():
+            return True
+        await interaction.response.send_message("The audio library is still loading; please try again in a moment.", ephemeral=True)
+        return False
+
+    async def cog_unload(self):
+        self.bot.remove_dynamic_items(AudioPageButton)
+        metrics.queue_depth.callback = None
+        metrics.sfx_cache_bytes.callback = None
+        if self._init_task:
+            self._init_task.cancel()
+        if self._processing_task:
+            self._processing_task.cancel()
+        if self._idle_task:
+            self._idle_task.cancel()
+        self.library.stop_watching()
+        if self._rescan_task:
+            self._rescan_task.cancel()
+        for player in self.players.values():
+            player.close()
+        self._decoder_pool.shutdown(wait=False)
+        self.metadata.close()
+        if self.opus_cache:
+            self.opus_cache.close()
+        if self.clips:
+            self.clips.clear()
+
+    async def warm_metadata(self, force=False):
+        """Probe every track in the library that isn't cached yet (or all of them, with force). Returns the count probed."""
+        async with self._metadata_lock:
+            paths = list(self.library.files_under(""))
+            started = time.monotonic()
+            probed = await asyncio.to_thread(self.metadata.warm, paths, force)
+            logger.info("Metadata warm-up probed %d/%d tracks in %.1fs.", probed, len(paths), time.monotonic() - started)
+            return probed
+
+    async def analyze_loudness(self, force=False):
+        """Measure the loudness of tracks that haven't been analyzed yet (or all, with force). Returns the count analyzed."""
+        if getattr(self.bot, "loudness_target", None) is None:
+            return 0
+        async with self._loudness_lock:
+            paths = list(self.library.files_under(""))
+            started = time.monotonic()
+            analyzed = await asyncio.to_thread(self.metadata.analyze, paths, force)
+            if analyzed:
+                logger.info("Loudness analysis measured %d/%d tracks in %.1fs.", analyzed, len(paths), time.monotonic() - started)
+            return analyzed
+
+    async def ingest_opus(self, paths, fill=True):
+        """Transcode tracks into the Opus cache at their current normalization gain. Returns the count transcoded.
+
+        Tracks whose loudness isn't known yet (when normalizing) are left for a later pass. With
+        fill, transcoding stops once the cache is full instead of evicting to make room.
+        """
+        target = getattr(self.bot, "loudness_target", None)
+
+        def gain_for(rel):
+            if target is None:
+                return 0
+            loudness = self.metadata.get_loudness(rel)
+            return loudness.gain(target) if loudness else None
+
+        started = time.monotonic()
+        transcoded = await asyncio.to_thread(self.opus_cache.ingest, paths, gain_for, fill)
+        if transcoded:
+            logger.info("Transcoded %d tracks to Opus in %.1fs.", transcoded, time.monotonic() - started)
+        return transcoded
+
+    async def preload_sfx(self):
+        """Load sound effects into memory until the clip cache is full. Returns the count loaded."""
+        paths = self.sfx_paths()
+        started = time.monotonic()
+        await asyncio.to_thread(self.clips.prune, paths)
+        # Skip tracks known to be too long for a clip rather than transcoding them on every pass
+        short = [rel for rel in paths if (self.metadata.get_duration(rel) or 0) <= ClipCache.MAX_CLIP_SECONDS]
+        loaded = await asyncio.to_thread(self.clips.preload, short, lambda rel: self.normalization_gain(self.resolve_audio_path(rel)))
+        if loaded:
+            logger.info("Loaded %d sound effects (%.1f MB) in %.1fs.", loaded, self.clips.nbytes / 1e6, time.monotonic() - started)
+        return loaded
+
+    def sfx_paths(self):
+        """Relative paths of every track in the sound effect folders."""
+        return [rel for folder in self.sfx_folders for rel in self.library.files_under(folder)]
+
+    async def _process_library(self):
+        """Loudness analysis and Opus transcoding of new tracks, repeated after each rescan interval or /refresh.
+
+        These decode whole files and can take hours on a first run, so they run apart from the rescan.
+        Other cluster workers share the results and only reload them.
+        """
+        interval = getattr(self.bot, "library_rescan_seconds", 300)
+        while True:
+            try:
+                # Every worker keeps its own clips in memory; they're small, so they go first
+                if self.clips:
+                    await self.preload_sfx()
+                if getattr(self.bot, "cluster_id", 0) == 0:
+                    await self.analyze_loudness()
+                    if self.opus_cache:
+                        # Tracks people actually played first, then the rest of the library while there's room
+                        misses, self._opus_misses = self._opus_misses, set()
+                        await self.ingest_opus(misses, fill=False)
+                        await self.ingest_opus(self.library.files_under(""))
+                        await asyncio.to_thread(self.opus_cache.prune, self.library.files_under(""))
+                else:
+                    await asyncio.to_thread(self.metadata.load_loudness)
+                    if self.opus_cache:
+                        await asyncio.to_thread(self.opus_cache.load)
+            except Exception as e:
+                logger.exception("Library processing failed: %s", e)
+            self._process_now.clear()
+            try:
+                await asyncio.wait_for(self._process_now.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _periodic_rescan(self):
+        # Fallback for missed or unsupported file system events (e.g. network storage)
+        interval = getattr(self.bot, "library_rescan_seconds", 300)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.library.build)
+            except Exception as e:
+                logger.warning("Audio library rescan failed: %s", e)
+
+    def get_player(self, guild_id):
+        player = self.players.get(guild_id)
+        if player is None:
+            player = self.players[guild_id] = GuildPlayer(guild_id, self.bot.loop)
+            snapshot = self._recent.pop(guild_id, None)
+            if snapshot is not None:
+                player.restore(snapshot)
+        return player
+
+    # --- Idle disconnect and eviction ---
+
+    async def _idle_sweep(self):
+        """Leave voice channels that have been idle or empty too long, and evict their state."""
+        while True:
+            await asyncio.sleep(self.IDLE_CHECK_SECONDS)
+            try:
+                await self._check_idle()
+            except Exception as e:
+                logger.exception("Idle check failed: %s", e)
+
+    async def _check_idle(self):
+        idle_timeout = getattr(self.bot, "idle_disconnect_seconds", 300)
+        empty_timeout = getattr(self.bot, "empty_channel_seconds", 60)
+        now = time.monotonic()
+        voice_clients = {vc.guild.id: vc for vc in self.bot.voice_clients if getattr(vc, "guild", None)}
+        for guild_id in set(self.players) | set(voice_clients):
+            voice_client = voice_clients.get(guild_id)
+            if voice_client is None:
+                # No connection to keep; drop the state once nothing is running on the player
+                player = self.players.get(guild_id)
+                if player is not None and not player.queue and not player.busy:
+                    await self.evict(guild_id)
+                continue
+            # Paused counts as idle, so a paused and forgotten session still disconnects
+            if voice_client.is_playing():
+                self._idle_since.pop(guild_id, None)
+            else:
+                self._idle_since.setdefault(guild_id, now)
+            listeners = [m for m in getattr(voice_client.channel, "members", []) if not m.bot]
+            if listeners:
+                self._empty_since.pop(guild_id, None)
+            else:
+                self._empty_since.setdefault(guild_id, now)
+            if idle_timeout and now - self._idle_since.get(guild_id, now) >= idle_timeout:
+                await self.evict(guild_id, reason=f"after {self._describe(idle_timeout)} of inactivity")
+            elif empty_timeout and now - self._empty_since.get(guild_id, now) >= empty_timeout:
+                await self.evict(guild_id, reason="since everyone else left")
+
+    @staticmethod
+    def _describe(seconds):
+        minutes = round(seconds / 60)
+        if seconds < 60:
+            return f"{int(seconds)} seconds"
+        return f"{minutes} minute{'s' if minutes != 1 else ''}"
+
+    async def evict(self, guild_id, reason=None, disconnect=True):
+        """Disconnect from the guild's voice channel (if asked) and drop all of its playback state.
+
+        The player's settings are kept in a small LRU cache so a quick return restores them.
+        """
+        self._idle_since.pop(guild_id, None)
+        self._empty_since.pop(guild_id, None)
+        player = self.players.pop(guild_id, None)
+        if player is not None:
+            # Closing first drops the after callback that disconnecting triggers
+            player.close()
+            self._recent[guild_id] = player.snapshot()
+            self._recent.move_to_end(guild_id)
+            while len(self._recent) > getattr(self.bot, "recent_guild_cache", 500):
+                self._recent.popitem(last=False)
+            metrics.last_transition_gap.remove(guild=guild_id)
+        guild = self.bot.get_guild(guild_id)
+        voice_client = guild.voice_client if guild else None
+        if disconnect and voice_client is not None:
+            channel_name = getattr(voice_client.channel, "name", "the voice channel")
+            await voice_client.disconnect()
+            logger.info("Left voice %s", reason or "on request", extra={"guild_id": guild_id})
+            if reason and player is not None and player.channel is not None:
+                self._send(player.channel, f"Left **{channel_name}** {reason}.")
+        # Anything the closed player didn't get to clean up (e.g. a prefetch still spawning)
+        await asyncio.to_thread(processes.scheduler.kill_guild, guild_id)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        # Kicked, moved out by a moderator or disconnected: nothing left to play to
+        if member.id == self.bot.user.id and before.channel is not None and after.channel is None:
+            await self.evict(member.guild.id, disconnect=False)
 
     def resolve_audio_path(self, filename):
         return os.path.join(self.audio_folder, filename)
 
-    def get_audio_duration(self, file_path):
-        """Return duration in seconds (float) or None if unknown."""
-        try:
-            out = subprocess.run(
-                ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", file_path],
-                capture_output=True,
-                text=True,
-                timeout=10,
-            )
-            if out.returncode == 0 and out.stdout.strip():
-                return float(out.stdout.strip())
-        except (FileNotFoundError, subprocess.TimeoutExpired, ValueError):
-            pass
-        return None
+    def get_audio_duration(self, rel_path):
+        """Return duration in seconds (float) or None if unknown. Probes only if the track isn't cached."""
+        info = self.metadata.lookup(rel_path)
+        return info.duration if info else None
 
     @staticmethod
     def parse_timestamp(s):
@@ -143,134 +456,306 @@ class AudioCog(commands.Cog):
 
     def get_current_elapsed(self, guild_id):
         """Return current playback position in seconds (including start_offset), or None."""
-        if guild_id not in self.playback_start_time:
-            return None
-        start = self.playback_start_time[guild_id]
-        acc_pause = self.accumulated_pause_seconds.get(guild_id, 0)
-        pause_start = self.pause_start_time.get(guild_id)
-        if pause_start is not None:
-            elapsed = pause_start - start - acc_pause
-        else:
-            elapsed = time.monotonic() - start - acc_pause
-        offset = self.start_offset_seconds.get(guild_id, 0)
-        return offset + elapsed
-
-    def clear_timestamp_state(self, guild_id):
-        """Clear timestamp tracking for a guild."""
-        self.playback_start_time.pop(guild_id, None)
-        self.total_duration_seconds.pop(guild_id, None)
-        self.accumulated_pause_seconds.pop(guild_id, None)
-        self.pause_start_time.pop(guild_id, None)
-        self.start_offset_seconds.pop(guild_id, None)
-        self.next_play_start_offset.pop(guild_id, None)
-        self.skipto_in_progress.pop(guild_id, None)
-
-    def collect_audio_from_folder(self, folder_path):
-        audio_folder_real = os.path.realpath(self.audio_folder)
-        folder_real = os.path.realpath(folder_path)
-        if not folder_real.startswith(audio_folder_real):
-            return
-        valid_extensions = ('.mp3', '.wav', '.ogg', '.flac', '.m4a')
-        for root, _dirs, files in os.walk(folder_path):
-            for f in files:
-                if f.lower().endswith(valid_extensions):
-                    full = os.path.join(root, f)
-                    rel = os.path.relpath(full, self.audio_folder)
-                    yield rel.replace(os.sep, '/')
+        player = self.players.get(guild_id)
+        return player.elapsed() if player else None
+
+    def collect_audio_from_folder(self, folder):
+        """Yield relative paths (forward slashes) of all tracks in an indexed folder and its subfolders."""
+        rel = normalize_folder(folder)
+        if rel is None:
+            return iter(())
+        return self.library.files_under(rel)
 
     def find_audio_by_basename(self, basename, under_path=None):
         """Return list of relative paths (forward slashes) under audio_folder with this basename.
         If under_path is set (e.g. 'subfolder' or 'subfolder/nested'), only paths under that directory are returned.
         """
-        valid_extensions = ('.mp3', '.wav', '.ogg', '.flac', '.m4a')
-        if not basename.lower().endswith(valid_extensions):
+        if not basename.lower().endswith(VALID_EXTENSIONS):
             return []
-        path_prefix = None
-        if under_path:
-            path_prefix = under_path.replace("\\", "/").strip("/") + "/"
-        matches = []
-        for root, _dirs, files in os.walk(self.audio_folder):
-            for f in files:
-                if f.lower() == basename.lower():
-                    full = os.path.join(root, f)
-                    rel = os.path.relpath(full, self.audio_folder)
-                    rel_norm = rel.replace(os.sep, "/")
-                    if path_prefix is not None and not rel_norm.startswith(path_prefix):
-                        continue
-                    matches.append(rel_norm)
-        return matches
-
-    def _make_after_callback(self, channel, guild_id, voice_client):
-        """Return the after_playing callback used when a track ends (loop, skip, or next)."""
+        return self.library.find_by_basename(basename, under_path=under_path)
+
+    def _make_after_callback(self, channel, player, voice_client):
+        """Return the after_playing callback for a track about to start; runs on the voice thread."""
+        player.play_id += 1
+        play_id = player.play_id
+
         def after_playing(error):
-            if self.skipto_in_progress.pop(guild_id, False):
-                return
-            if error:
-                print(f"[ERROR] Playback error: {error}")
-            if self.skip_requested.get(guild_id):
-                print(f"[DEBUG] Skip was requested; ignoring current loop.")
-                self.skip_requested[guild_id] = False
-                asyncio.run_coroutine_threadsafe(
-                    self._safe_play_next(channel, guild_id), self.bot.loop
-                )
-                return
-            if self.looping.get(guild_id):
-                print(f"[DEBUG] Looping track: {self.current_track[guild_id]}")
-                self.start_offset_seconds[guild_id] = 0
-                self.playback_start_time[guild_id] = time.monotonic()
-                self.accumulated_pause_seconds[guild_id] = 0
-                self.pause_start_time[guild_id] = None
-                new_source = discord.FFmpegPCMAudio(self.current_track[guild_id], executable="ffmpeg")
-                if voice_client:
-                    voice_client.play(new_source, after=after_playing)
-                return
-            asyncio.run_coroutine_threadsafe(
-                self._safe_play_next(channel, guild_id), self.bot.loop
-            )
+            player.track_ended_at = time.perf_counter()
+            player.submit(self._after_track, player, channel, voice_client, error, play_id)
         return after_playing
 
+    async def _after_track(self, player, channel, voice_client, error, play_id):
+        # Decide what follows a finished track (loop, skip, or next)
+        if error:
+            metrics.playback_errors.inc()
+            logger.error("Playback error: %s", error, extra={"guild_id": player.guild_id, "track": player.current_track})
+        if play_id != player.play_id:
+            # Another track started between this one ending and now (e.g. from /play); it has its own callback
+            player.skip_requested = False
+            return
+        if voice_client and (voice_client.is_playing() or voice_client.is_paused()):
+            # A /sfx clip started on its own in the gap; _after_clip carries on from this track once it ends
+            return
+        if player.skip_requested:
+            logger.debug("Skip was requested; ignoring current loop.", extra={"guild_id": player.guild_id})
+            player.skip_requested = False
+            await self._play_next(player, channel)
+            return
+        if player.looping and player.current_track:
+            # Only reached when the track couldn't be replayed from its buffer (e.g. too long,
+            # or looping was enabled mid-track); the new source buffers itself for later repeats
+            self._open_in_task(player, player.current_track, 0, self._replay_opened, channel, voice_client)
+            return
+        await self._play_next(player, channel)
+
+    def _replay_opened(self, player, source, error, channel, voice_client):
+        """Start the repeat of a looping track once _open_in_task has opened it again."""
+        if source is None:
+            if isinstance(error, processes.ProcessLimitError):
+                self._send(channel, "The bot is too busy to keep looping this track right now.")
+            return
+        if not voice_client:
+            source.cleanup()
+            return
+        self._restart_loop(player)
+        voice_client.play(MixerSource(source, player.overlays, player.dsp), after=self._make_after_callback(channel, player, voice_client))
+
+    def _open_in_task(self, player, file_path, start_offset, done, *args):
+        """Open a track in a task of its own, then run done(player, source, error, *args) on the player's task.
+
+        Opening may wait up to PLAYBACK_WAIT_SECONDS for a process slot, and the player has to keep
+        handling commands meanwhile. Until done runs, player.opening is set so nothing else starts
+        playback; clearing it (e.g. /stop) drops the source once it's open. source is None if it
+        couldn't be opened, with error saying why.
+        """
+        async def _open():
+            task = asyncio.current_task()
+            source = error = None
+            try:
+                source = await self._in_decoder_thread(self._open_track, player, file_path, start_offset)
+            except processes.ProcessLimitError as e:
+                error = e
+            except Exception as e:
+                logger.error("Couldn't open track: %s", e, extra={"guild_id": player.guild_id, "track": file_path})
+                error = e
+            try:
+                await player.call(self._track_opened, player, task, source, error, done, args)
+            except asyncio.CancelledError:
+                # The player was closed while the track opened
+                if source is not None:
+                    source.cleanup()
+                raise
+            except Exception as e:
+                logger.exception("Starting an opened track failed: %s", e, extra={"guild_id": player.guild_id, "track": file_path})
+
+        player.opening = asyncio.create_task(_open())
+
+    def _track_opened(self, player, task, source, error, done, args):
+        if player.opening is not task:
+            # Stopped (or the player moved on) while it opened
+            if source is not None:
+                source.cleanup()
+            return None
+        player.opening = None
+        return done(player, source, error, *args)
+
+    def _in_decoder_thread(self, fn, *args):
+        """asyncio.to_thread() for work that may wait for a process slot (opening, seeking, probing for playback).
+
+        Such waits can last PLAYBACK_WAIT_SECONDS, and in the loop's default executor they'd hold up
+        everything else run with to_thread(), such as the kills behind /stop.
+        """
+        call = functools.partial(contextvars.copy_context().run, fn, *args)
+        return asyncio.get_running_loop().run_in_executor(self._decoder_pool, call)
+
+    def _open_track(self, player, file_path, start_offset=0, kind=processes.PLAYBACK):
+        """Create the playback source for a track, wired to this guild's loop setting and normalized loudness.
+
+        Blocking (it may wait for a process slot); run off the event loop, and off the player's task
+        (see _open_in_task). Prefetches pass kind=processes.PREFETCH so they wait for playback.
+        """
+        gain_db = self.normalization_gain(file_path)
+        opus_path = None
+        if self.opus_cache:
+            rel = os.path.relpath(file_path, self.audio_folder).replace(os.sep, "/")
+            opus_path = self.opus_cache.lookup(rel, gain_db)
+            if opus_path is None:
+                self._opus_misses.add(rel)
+        return TrackSource(
+            file_path,
+            start_offset=start_offset,
+            should_loop=lambda: player.looping and not player.skip_requested,
+            on_loop=lambda: player.submit(self._restart_loop, player),
+            guild_id=player.guild_id,
+            gain_db=gain_db,
+            opus_path=opus_path,
+            kind=kind,
+        )
+
+    def normalization_gain(self, file_path):
+        """Gain in dB that brings a track to the configured loudness; 0 if disabled or not analyzed yet."""
+        target = getattr(self.bot, "loudness_target", None)
+        if target is None:
+            return 0
+        rel = os.path.relpath(file_path, self.audio_folder).replace(os.sep, "/")
+        loudness = self.metadata.get_loudness(rel)
+        return loudness.gain(target) if loudness else 0
+
+    def _restart_loop(self, player):
+        """Reset timestamp state when a looped track starts over."""
+        logger.debug("Looping track", extra={"guild_id": player.guild_id, "track": player.current_track})
+        player.reset_clock()
+
     def play_next(self, channel, guild_id):
         """Queue consumer; sends status to channel"""
-        queue = self.get_queue(guild_id)
-        guild = self.bot.get_guild(guild_id)
-        voice_client = guild.voice_client if guild else None
-
-        async def _play():
-            if queue.empty():
-                self.current_track.pop(guild_id, None)
-                self.clear_timestamp_state(guild_id)
-                return
-            filename = await queue.get()
-            self.queue_cache[guild_id].pop(0)
-            file_path = self.resolve_audio_path(filename)
+        player = self.get_player(guild_id)
+        player.submit(self._play_next, player, channel)
+
+    async def _play_next(self, player, channel):
+        filename = player.pop_track()
+        if filename is None:
+            player.current_track = None
+            player.track_ended_at = None
+            player.clear_timestamps()
+            player.cancel_prefetch()
+            # Nothing left to mix them over
+            player.overlays.clear()
+            return
+        file_path = self.resolve_audio_path(filename)
+        start_offset = player.next_start_offset
+        player.next_start_offset = 0
+        source = player.take_prefetched(filename) if not start_offset else None
+        if source is None:
+            player.cancel_prefetch()
             if not os.path.exists(file_path):
-                await channel.send(f"Couldn't find `{filename}`; please check your spelling and try again.")
-                self.play_next(channel, guild_id)
+                self._send(channel, f"Couldn't find `{filename}`; please check your spelling and try again.")
+                await self._play_next(player, channel)
                 return
+            self._open_in_task(player, file_path, start_offset, self._next_opened, channel, filename, start_offset)
+            return
+        self._start_track(player, channel, filename, file_path, source, start_offset)
+
+    async def _next_opened(self, player, source, error, channel, filename, start_offset):
+        """Start the track _play_next had opened by _open_in_task, or report why it couldn't be."""
+        if source is None:
+            player.current_track = None
+            player.clear_timestamps()
+            if isinstance(error, processes.ProcessLimitError):
+                self._send(channel, f"Too many tracks are playing right now; couldn't start `{filename}`. Try again in a moment.")
+            else:
+                self._send(channel, f"Couldn't play `{filename}`; skipping it.")
+                await self._play_next(player, channel)
+            return
+        self._start_track(player, channel, filename, self.resolve_audio_path(filename), source, start_offset)
 
-            self.current_track[guild_id] = self.resolve_audio_path(filename)
-            start_offset = self.next_play_start_offset.pop(guild_id, 0)
-            duration = await asyncio.to_thread(self.get_audio_duration, file_path)
-            self.total_duration_seconds[guild_id] = duration
-            self.start_offset_seconds[guild_id] = start_offset
-            self.playback_start_time[guild_id] = time.monotonic()
-            self.accumulated_pause_seconds[guild_id] = 0
-            self.pause_start_time[guild_id] = None
+    def _start_track(self, player, channel, filename, file_path, source, start_offset):
+        guild = self.bot.get_guild(player.guild_id)
+        voice_client = guild.voice_client if guild else None
+        if voice_client and voice_client.is_playing():
+            # A /sfx clip started on its own while the track opened (without NumPy it can't be mixed in)
+            voice_client.stop()
+        player.current_track = file_path
+        player.total_duration = self.metadata.get_duration(filename)
+        player.reset_clock(start_offset)
 
-            before_options = f"-ss {int(start_offset)}" if start_offset else None
-            source = discord.FFmpegPCMAudio(file_path, executable="ffmpeg", before_options=before_options)
-            after_playing = self._make_after_callback(channel, guild_id, voice_client)
+        # Start audio before announcing it so the transition isn't held up by the REST call
+        if voice_client:
+            voice_client.play(MixerSource(source, player.overlays, player.dsp), after=self._make_after_callback(channel, player, voice_client))
+            metrics.tracks_started.inc()
+            if player.track_ended_at is not None:
+                gap = time.perf_counter() - player.track_ended_at
+                metrics.transition_gap.observe(gap)
+                metrics.last_transition_gap.set(gap, guild=player.guild_id)
+        else:
+            source.cleanup()
+        player.track_ended_at = None
+        logger.debug("Now playing", extra={"guild_id": player.guild_id, "track": filename})
+        if player.total_duration is None and voice_client:
+            # Probed once the track is playing, so it doesn't hold up the handoff; prefetch waits for it
+            asyncio.create_task(self._probe_duration(player, filename, player.play_id))
+        else:
+            self.schedule_prefetch(player)
+        self._send(channel, f"Now playing `{filename}`.")
 
-            print(f"[DEBUG] Now playing: {filename}")
-            await channel.send(f"Now playing `{filename}`.")
-            if voice_client:
-                voice_client.play(source, after=after_playing)
+    async def _probe_duration(self, player, filename, play_id):
+        """Probe the duration of a track that started without one cached, and hand it to the player."""
+        try:
+            duration = await self._in_decoder_thread(self.get_audio_duration, filename)
+        except processes.ProcessLimitError:
+            duration = None
+        player.submit(self._set_duration, player, play_id, duration)
+
+    def _set_duration(self, player, play_id, duration):
+        """Fill in the playing track's duration once probed, unless another track has started since."""
+        if play_id != player.play_id:
+            return
+        player.total_duration = duration
+        self.schedule_prefetch(player)
 
-        asyncio.create_task(_play())
+    def _send(self, channel, message):
+        """Send a status message without holding up the player."""
+        async def _send():
+            try:
+                await channel.send(message)
+            except discord.HTTPException as e:
+                logger.warning("Failed to send status message: %s", e, extra={"guild_id": getattr(getattr(channel, "guild", None), "id", None)})
+        asyncio.create_task(_send())
+
+    def schedule_prefetch(self, player):
+        """Make sure the next queued track will be prefetched before the current one ends."""
+        if player.prefetch_task and not player.prefetch_task.done():
+            return
+        if player.prefetched and player.prefetched[0] == player.peek_track():
+            return
+        player.prefetch_task = asyncio.create_task(self._prefetch(player))
+
+    async def _prefetch(self, player):
+        # Wait until the current track is close to ending; elapsed time is re-read after pauses and seeks
+        while True:
+            total = player.total_duration
+            elapsed = player.elapsed()
+            if total is None or elapsed is None:
+                break
+            remaining = total - elapsed
+            if remaining <= self.PREFETCH_LEAD_SECONDS and not player.looping:
+                break
+            await asyncio.sleep(max(remaining - self.PREFETCH_LEAD_SECONDS, 1))
+        filename = player.peek_track()
+        if filename is None:
+            return
 
-    async def _safe_play_next(self, channel, guild_id):
-        await asyncio.sleep(1)
-        self.play_next(channel, guild_id)
+        def _open():
+            source = self._open_track(player, self.resolve_audio_path(filename), kind=processes.PREFETCH)
+            source.prime()
+            return source
+
+        future = asyncio.ensure_future(self._in_decoder_thread(_open))
+        try:
+            source = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The decoder is still being opened in its thread; clean it up once it's ready
+            future.add_done_callback(lambda f: not f.cancelled() and f.exception() is None and f.result().cleanup())
+            raise
+        except Exception as e:
+            logger.warning("Prefetch failed: %s", e, extra={"guild_id": player.guild_id, "track": filename})
+            return
+        if player.peek_track() == filename:
+            player.prefetched = (filename, source)
+        else:
+            source.cleanup()
+
+    async def _enqueue(self, player, channel, voice_client, entries, start_offset=None):
+        """Add tracks to the queue and start playback if idle. Runs on the player's task."""
+        player.channel = channel
+        idle = not voice_client.is_playing() and player.opening is None
+        queue_was_empty = not player.queue and idle
+        player.queue.extend(entries)
+        if start_offset is not None and queue_was_empty:
+            player.next_start_offset = start_offset
+        if idle:
+            await self._play_next(player, channel)
+        else:
+            self.schedule_prefetch(player)
 
     async def _queue_single_track(self, guild, channel, user, path, start_at):
         """Connect to voice if needed, queue one track, start playback if idle. Returns (success, message)."""
@@ -283,17 +768,13 @@ class AudioCog(commands.Cog):
             await author_voice.channel.connect()
             voice_client = guild.voice_client
             just_connected = True
-        guild_id = guild.id
-        queue = self.get_queue(guild_id)
-        queue_was_empty = queue.empty() and not voice_client.is_playing()
-        await queue.put(path)
-        self.queue_cache[guild_id].append(path)
-        if start_at is not None and queue_was_empty:
+        start_offset = None
+        if start_at is not None:
             parsed = self.parse_timestamp(start_at)
             if parsed is not None and parsed >= 0:
-                self.next_play_start_offset[guild_id] = parsed
-        if not voice_client.is_playing():
-            self.play_next(channel, guild_id)
+                start_offset = parsed
+        player = self.get_player(guild.id)
+        await player.call(self._enqueue, player, channel, voice_client, [path], start_offset)
         if just_connected:
             msg = f"Joined {voice_client.channel.name}, queued track: `{path}`."
         else:
@@ -313,14 +794,15 @@ class AudioCog(commands.Cog):
         if not interaction.guild:
             await interaction.response.send_message("Hey, this command only works in servers! What are you doing?", ephemeral=True)
             return
+        if not await self._check_library_ready(interaction):
+            return
         guild_id = interaction.guild.id
-        print(f"[DEBUG] Play command received with filename: {filename!r}")
-        file_path = self.resolve_audio_path(filename)
-        valid_extensions = ('.mp3', '.wav', '.ogg', '.flac', '.m4a')
+        logger.debug("Play command received with filename: %r", filename)
 
         # Determine if single file or folder
         to_queue = []
-        if filename.lower().endswith(valid_extensions):
+        folder = None
+        if filename.lower().endswith(VALID_EXTENSIONS):
             # Resolve by basename; scope to path prefix if user provided one
             basename_only = os.path.basename(filename)
             has_path = "/" in filename or "\\" in filename
@@ -347,16 +829,14 @@ class AudioCog(commands.Cog):
                 )
                 return
         else:
-            if not os.path.isdir(file_path):
-                await interaction.response.send_message(f"Couldn't find folder or file `{filename}`. Use a supported audio file or a folder path under the audio folder.", ephemeral=True)
-                return
-            audio_folder_real = os.path.realpath(self.audio_folder)
-            folder_real = os.path.realpath(file_path)
-            if not folder_real.startswith(audio_folder_real):
+            folder = normalize_folder(filename)
+            if folder is None:
                 await interaction.response.send_message("That folder path is not valid.", ephemeral=True)
                 return
-            to_queue = list(self.collect_audio_from_folder(file_path))
-            if not to_queue:
+            if not self.library.folder_exists(folder):
+                await interaction.response.send_message(f"Couldn't find folder or file `{filename}`. Use a supported audio file or a folder path under the audio folder.", ephemeral=True)
+                return
+            if not self.library.has_tracks_under(folder):
                 await interaction.response.send_message(f"No audio files found in folder `{filename}`.", ephemeral=True)
                 return
 
@@ -367,41 +847,276 @@ class AudioCog(commands.Cog):
                 return
             # Only used when single file and queue empty and nothing playing (set below)
 
+        voice_client = interaction.guild.voice_client
+        author_voice = getattr(interaction.user, "voice", None)
+        if not voice_client and (not author_voice or not author_voice.channel):
+            await interaction.response.send_message("You must be in a voice channel to play audio.", ephemeral=True)
+            return
+
+        # Errors are all checked above: after a (public) defer, followups can't be made ephemeral
+        respond = interaction.response.send_message
+        if folder is not None:
+            # The folder goes into the queue as a cursor and its tracks are listed as playback
+            # reaches them; only the count is needed now, and that's taken off the event loop
+            await interaction.response.defer()
+            respond = interaction.followup.send
+            track_count = await asyncio.to_thread(self.library.count_under, folder)
+            to_queue = [FolderCursor(folder, self.collect_audio_from_folder(folder), track_count)]
+
         # Connect to voice client
         voice_client = interaction.guild.voice_client
         just_connected = False
         if not voice_client:
-            author_voice = getattr(interaction.user, "voice", None)
             if not author_voice or not author_voice.channel:
-                await interaction.response.send_message("You must be in a voice channel to play audio.", ephemeral=True)
+                await respond("You must be in a voice channel to play audio.")
                 return
             await author_voice.channel.connect()
             voice_client = interaction.guild.voice_client
             just_connected = True
 
-        queue = self.get_queue(guild_id)
-        queue_was_empty = queue.empty() and not voice_client.is_playing()
-        for entry in to_queue:
-            await queue.put(entry)
-            self.queue_cache[guild_id].append(entry)
-
-        if start_at is not None and len(to_queue) == 1 and queue_was_empty:
-            self.next_play_start_offset[guild_id] = self.parse_timestamp(start_at)
-
+        single = isinstance(to_queue[0], str)
         if just_connected:
-            if len(to_queue) == 1:
-                await interaction.response.send_message(f"Joined {voice_client.channel.name}, queued track: `{to_queue[0]}`.")
+            if single:
+                await respond(f"Joined {voice_client.channel.name}, queued track: `{to_queue[0]}`.")
             else:
-                await interaction.response.send_message(f"Joined {voice_client.channel.name}, queued **{len(to_queue)}** tracks from `{filename}`.")
+                await respond(f"Joined {voice_client.channel.name}, queued **{track_count}** tracks from `{filename}`.")
         else:
-            if len(to_queue) == 1:
-                await interaction.response.send_message(f"Queued the following track: `{to_queue[0]}`.")
+            if single:
+                await respond(f"Queued the following track: `{to_queue[0]}`.")
             else:
-                await interaction.response.send_message(f"Queued **{len(to_queue)}** tracks from `{filename}`.")
+                await respond(f"Queued **{track_count}** tracks from `{filename}`.")
+
+        # start_at only applies to a single file played into an empty queue
+        start_offset = self.parse_timestamp(start_at) if start_at is not None and single else None
+        player = self.get_player(guild_id)
+        await player.call(self._enqueue, player, interaction.channel, voice_client, to_queue, start_offset)
+
+    @play.autocomplete("filename")
+    async def play_filename_autocomplete(self, interaction: discord.Interaction, current: str):
+        # Tracks first, then folders (which queue every track inside them)
+        paths = self.library.search_tracks(current) + self.library.search_folders(current, limit=5)
+        return self._choices(paths[:25])
+
+    @app_commands.command(name="overlay", description="Play a track over the current one without interrupting it.")
+    @app_commands.describe(
+        filename="Filename with extension, e.g. airhorn.mp3 or sfx/airhorn.mp3",
+        volume="Volume of the overlay in percent (default 100). The current track is turned down while it plays.",
+    )
+    async def overlay(self, interaction: discord.Interaction, filename: str, volume: app_commands.Range[int, 0, 200] = 100):
+        if not interaction_has_allowed_role(interaction):
+            await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+            return
+        if not interaction.guild:
+            await interaction.response.send_message("Please use this command in a server.", ephemeral=True)
+            return
+        if not await self._check_library_ready(interaction):
+            return
+        if mixer.np is None:
+            await interaction.response.send_message("Overlays need NumPy; install it with `pip install numpy`.", ephemeral=True)
+            return
+        voice_client = interaction.guild.voice_client
+        if not voice_client or not (voice_client.is_playing() or voice_client.is_paused()):
+            await interaction.response.send_message("Nothing is playing to overlay. Use /play to start a track first.", ephemeral=True)
+            return
+        has_path = "/" in filename or "\\" in filename
+        under_path = os.path.dirname(filename).replace("\\", "/").strip("/") or None if has_path else None
+        matches = self.find_audio_by_basename(os.path.basename(filename), under_path=under_path)
+        if not matches:
+            await interaction.response.send_message(f"Couldn't find `{filename}`; please check your spelling and try again.", ephemeral=True)
+            return
+        if len(matches) > 1:
+            await interaction.response.send_message(
+                f"Found **{len(matches)}** tracks named `{os.path.basename(filename)}`; include its folder, e.g. `{matches[0]}`.",
+                ephemeral=True,
+            )
+            return
+        player = self.get_player(interaction.guild.id)
+        if len(player.overlays.names()) >= player.overlays.MAX_LAYERS:
+            await interaction.response.send_message("Too many overlays are already playing; wait for one to finish.", ephemeral=True)
+            return
+        # Opening waits for an ffmpeg slot and decodes the first frames, so the overlay starts cleanly
+        await interaction.response.defer()
+        try:
+            source = await self._in_decoder_thread(self._open_overlay, player, matches[0])
+        except processes.ProcessLimitError:
+            await interaction.followup.send("The bot is too busy to start an overlay right now; try again in a moment.", ephemeral=True)
+            return
+        if not player.overlays.add(source, volume / 100, matches[0]):
+            source.cleanup()
+            await interaction.followup.send("Too many overlays are already playing; wait for one to finish.", ephemeral=True)
+            return
+        await interaction.followup.send(f"Playing `{matches[0]}` over the current track.")
+
+    @overlay.autocomplete("filename")
+    async def overlay_filename_autocomplete(self, interaction: discord.Interaction, current: str):
+        return self._choices(self.library.search_tracks(current)[:25])
+
+    def _open_overlay(self, player, rel):
+        """Open and prime a PCM source for an overlay. Blocking; run off the event loop."""
+        file_path = self.resolve_audio_path(rel)
+        source = TrackSource(file_path, guild_id=player.guild_id, gain_db=self.normalization_gain(file_path))
+        source.prime()
+        return source
+
+    @app_commands.command(name="sfx", description="Play a sound effect right away, over the current track if one is playing.")
+    @app_commands.describe(name="Sound effect name, e.g. airhorn or airhorn.mp3")
+    async def sfx(self, interaction: discord.Interaction, name: str):
+        received = time.perf_counter()
+        if not interaction_has_allowed_role(interaction):
+            await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+            return
+        if not interaction.guild:
+            await interaction.response.send_message("Please use this command in a server.", ephemeral=True)
+            return
+        if not await self._check_library_ready(interaction):
+            return
+        if self.clips is None:
+            await interaction.response.send_message("Sound effects are turned off on this bot.", ephemeral=True)
+            return
+        matches = self.find_sfx(name)
+        if not matches:
+            await interaction.response.send_message(f"Couldn't find a sound effect called `{name}`.", ephemeral=True)
+            return
+        if len(matches) > 1:
+            await interaction.response.send_message(
+                f"Found **{len(matches)}** sound effects called `{name}`; include its folder, e.g. `{matches[0]}`.",
+                ephemeral=True,
+            )
+            return
+        rel = matches[0]
+        voice_client = interaction.guild.voice_client
+        if voice_client and voice_client.is_paused():
+            await interaction.response.send_message("Playback is paused; use /unpause to hear sound effects.", ephemeral=True)
+            return
+        if voice_client and voice_client.is_playing() and mixer.np is None:
+            await interaction.response.send_message("Sound effects over a track need NumPy; install it with `pip install numpy`.", ephemeral=True)
+            return
 
-        if not voice_client.is_playing():
-            self.play_next(interaction.channel, guild_id)
+        respond = interaction.response.send_message
+        gain_db = self.normalization_gain(self.resolve_audio_path(rel))
+        clip = self.clips.get(rel, gain_db)
+        if clip is None:
+            # Not preloaded (yet, or evicted); encode it now, ahead of background work
+            await interaction.response.defer()
+            respond = interaction.followup.send
+            try:
+                clip = await self._in_decoder_thread(self.clips.load, rel, gain_db, processes.PLAYBACK)
+            except processes.ProcessLimitError:
+                clip = None
+            if clip is None:
+                await respond(f"Couldn't load `{rel}`; sound effects must be under {ClipCache.MAX_CLIP_SECONDS} seconds.", ephemeral=True)
+                return
+        if not voice_client:
+            author_voice = getattr(interaction.user, "voice", None)
+            if not author_voice or not author_voice.channel:
+                await respond("You must be in a voice channel to play sound effects.", ephemeral=True)
+                return
+            await author_voice.channel.connect()
+            voice_client = interaction.guild.voice_client
+        player = self.get_player(interaction.guild.id)
+        if not await player.call(self._play_clip, player, interaction.channel, voice_client, rel, clip):
+            await respond("Too many sounds are already playing; wait for one to finish.", ephemeral=True)
+            return
+        metrics.sfx_latency.observe(time.perf_counter() - received)
+        await respond(f"Playing sound effect `{rel}`.")
 
+    @sfx.autocomplete("name")
+    async def sfx_name_autocomplete(self, interaction: discord.Interaction, current: str):
+        if self.clips is None:
+            return []
+        current = current.lower()
+        paths = [rel for rel in self.sfx_paths() if current in rel.lower()]
+        return self._choices(paths[:25])
+
+    def find_sfx(self, name):
+        """Sound effect paths matching a name, with or without its extension or folder."""
+        name = name.replace("\\", "/").strip("/").lower()
+        paths = self.sfx_paths()
+        exact = [rel for rel in paths if rel.lower() == name]
+        if exact:
+            return exact
+        return [
+            rel for rel in paths
+            if name in (os.path.basename(rel).lower(), os.path.splitext(os.path.basename(rel))[0].lower(), os.path.splitext(rel)[0].lower())
+        ]
+
+    def _play_clip(self, player, channel, voice_client, rel, clip):
+        """Mix a clip over whatever is playing, or play it on its own. Returns False if too many overlays are playing."""
+        if voice_client.is_playing() or (player.opening is not None and mixer.np is not None):
+            # While a track opens the clip waits in the overlays and plays over it
+            return player.overlays.add(ClipSource(clip, decode=True), 1.0, rel)
+
+        def after_clip(error):
+            player.submit(self._after_clip, player, channel, voice_client)
+
+        # Played on its own the packets go to Discord as they are, unless /volume or /eq needs them decoded
+        voice_client.play(MixerSource(ClipSource(clip), player.overlays, player.dsp), after=after_clip)
+        return True
+
+    async def _after_clip(self, player, channel, voice_client):
+        if voice_client.is_playing() or voice_client.is_paused() or player.opening is not None:
+            return
+        if player.current_track is not None:
+            # The track ended while the clip played on its own; loop it or move on now
+            await self._after_track(player, channel, voice_client, None, player.play_id)
+        elif player.queue:
+            # Tracks queued while a clip played on its own start once it ends
+            await self._play_next(player, channel)
+
+    @app_commands.command(name="volume", description="Show or set the playback volume. Takes effect immediately.")
+    @app_commands.describe(percent="Volume in percent (100 is normal). Leave out to show the current volume.")
+    async def volume(self, interaction: discord.Interaction, percent: app_commands.Range[int, 0, 200] = None):
+        if not interaction_has_allowed_role(interaction):
+            await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+            return
+        if not interaction.guild:
+            await interaction.response.send_message("Please use this command in a server.", ephemeral=True)
+            return
+        player = self.get_player(interaction.guild.id)
+        if percent is None:
+            await interaction.response.send_message(f"Volume is **{round(player.dsp.volume * 100)}%**.", ephemeral=True)
+            return
+        if dsp.np is None:
+            await interaction.response.send_message("Changing the volume needs NumPy; install it with `pip install numpy`.", ephemeral=True)
+            return
+        player.dsp.set_volume(percent / 100)
+        await interaction.response.send_message(f"Volume set to **{percent}%**.")
+
+    @app_commands.command(name="eq", description="Show or set the bass, mid and treble EQ. Takes effect immediately.")
+    @app_commands.describe(
+        bass="Bass boost or cut in dB, from -12 to 12 (shelf below 120 Hz).",
+        mid="Mid boost or cut in dB, from -12 to 12 (around 1 kHz).",
+        treble="Treble boost or cut in dB, from -12 to 12 (shelf above 6 kHz).",
+        reset="Set every band back to 0 dB.",
+    )
+    async def eq(
+        self,
+        interaction: discord.Interaction,
+        bass: app_commands.Range[float, -12, 12] = None,
+        mid: app_commands.Range[float, -12, 12] = None,
+        treble: app_commands.Range[float, -12, 12] = None,
+        reset: bool = False,
+    ):
+        if not interaction_has_allowed_role(interaction):
+            await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+            return
+        if not interaction.guild:
+            await interaction.response.send_message("Please use this command in a server.", ephemeral=True)
+            return
+        player = self.get_player(interaction.guild.id)
+        changed = reset or any(gain is not None for gain in (bass, mid, treble))
+        if changed and dsp.np is None:
+            await interaction.response.send_message("The EQ needs NumPy; install it with `pip install numpy`.", ephemeral=True)
+            return
+        if changed:
+            gains = {name: 0 for name in player.dsp.eq} if reset else {}
+            gains.update({name: gain for name, gain in (("bass", bass), ("mid", mid), ("treble", treble)) if gain is not None})
+            player.dsp.set_eq(**gains)
+        bands = ", ".join(f"{name} **{gain:+g} dB**" for name, gain in player.dsp.eq.items())
+        if changed:
+            await interaction.response.send_message(f"EQ set to {bands}.")
+        else:
+            await interaction.response.send_message(f"EQ is {bands}.", ephemeral=True)
 
     @app_commands.command(name="skip", description="Skip the currently playing track.")
     async def skip(self, interaction: discord.Interaction):
@@ -417,17 +1132,24 @@ class AudioCog(commands.Cog):
             await interaction.response.send_message("Not currently in a voice channel.")
             return
         if voice_client.is_playing():
-            self.skip_requested[guild_id] = True
-            voice_client.stop()
-            await asyncio.sleep(1)
-            queue = self.get_queue(guild_id)
-            if queue.empty():
-                await interaction.response.send_message("The end of the queue has been reached. Use /play (file) to continue audio playback.")
+            player = self.get_player(guild_id)
+            # The player may be busy starting a track or seeking; don't let the interaction time out
+            await interaction.response.defer()
+            queue_empty = await player.call(self._skip, player, voice_client)
+            if queue_empty:
+                await interaction.followup.send("The end of the queue has been reached. Use /play (file) to continue audio playback.")
             else:
-                await interaction.response.send_message("Skipped to the next track.")
+                await interaction.followup.send("Skipped to the next track.")
         else:
             await interaction.response.send_message("There's no audio playing to skip!")
 
+    def _skip(self, player, voice_client):
+        # Check before stopping; the next track is taken off the queue as soon as this one ends
+        queue_empty = not player.queue
+        player.skip_requested = True
+        voice_client.stop()
+        return queue_empty
+
     @app_commands.command(name="skipto", description="Skip to a timestamp in the currently playing track.")
     @app_commands.describe(
         timestamp="Time to skip to (e.g. 1:15, 1:15:30, or 75 for seconds).",
@@ -447,7 +1169,8 @@ class AudioCog(commands.Cog):
         if not (voice_client.is_playing() or voice_client.is_paused()):
             await interaction.response.send_message("No audio is currently playing to skip within.", ephemeral=True)
             return
-        if guild_id not in self.current_track:
+        player = self.get_player(guild_id)
+        if not player.current_track:
             await interaction.response.send_message("No track is currently focused.", ephemeral=True)
             return
 
@@ -459,7 +1182,7 @@ class AudioCog(commands.Cog):
             )
             return
 
-        total_duration = self.total_duration_seconds.get(guild_id)
+        total_duration = player.total_duration
         if total_duration is not None and parsed >= total_duration:
             await interaction.response.send_message(
                 "This timestamp exceeds the total runtime of the focused audio track.",
@@ -467,20 +1190,83 @@ class AudioCog(commands.Cog):
             )
             return
 
-        file_path = self.current_track[guild_id]
-        self.skipto_in_progress[guild_id] = True  # so after() from stop() doesn't advance queue
-        voice_client.stop()
-        self.start_offset_seconds[guild_id] = parsed
-        self.playback_start_time[guild_id] = time.monotonic()
-        self.accumulated_pause_seconds[guild_id] = 0
-        self.pause_start_time[guild_id] = None
+        await interaction.response.defer()
+        position = await self.seek_current(player, voice_client, parsed)
+        if position is None:
+            await interaction.followup.send("Nothing seekable is playing.")
+            return
+        await interaction.followup.send(f"Skipped to **{self.format_timestamp(position)}**.")
+
+    @app_commands.command(name="rewind", description="Rewind the currently playing track.")
+    @app_commands.describe(seconds="Optional; number of seconds to rewind (default 10).")
+    async def rewind(self, interaction: discord.Interaction, seconds: app_commands.Range[float, 0.001, None] = 10.0):
+        await self._seek_relative(interaction, -seconds)
+
+    @app_commands.command(name="forward", description="Fast-forward the currently playing track.")
+    @app_commands.describe(seconds="Optional; number of seconds to skip ahead (default 10).")
+    async def forward(self, interaction: discord.Interaction, seconds: app_commands.Range[float, 0.001, None] = 10.0):
+        await self._seek_relative(interaction, seconds)
 
-        before_options = f"-ss {int(parsed)}"
-        source = discord.FFmpegPCMAudio(file_path, executable="ffmpeg", before_options=before_options)
-        after_playing = self._make_after_callback(interaction.channel, guild_id, voice_client)
-        voice_client.play(source, after=after_playing)
+    async def _seek_relative(self, interaction, delta):
+        """Shared body of /rewind and /forward."""
+        if not interaction_has_allowed_role(interaction):
+            await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+            return
+        if not interaction.guild:
+            await interaction.response.send_message("This command only works in servers.", ephemeral=True)
+            return
+        guild_id = interaction.guild.id
+        voice_client = interaction.guild.voice_client
+        if not voice_client:
+            await interaction.response.send_message("Not currently in a voice channel.", ephemeral=True)
+            return
+        player = self.get_player(guild_id)
+        if not (voice_client.is_playing() or voice_client.is_paused()) or not player.current_track:
+            await interaction.response.send_message("No audio is currently playing to skip within.", ephemeral=True)
+            return
+        target = max(0, (player.elapsed() or 0) + delta)
+        total_duration = player.total_duration
+        if total_duration is not None and target >= total_duration:
+            await interaction.response.send_message(
+                "This would skip past the end of the focused audio track. Use /skip to play the next track.",
+                ephemeral=True,
+            )
+            return
+        await interaction.response.defer()
+        position = await self.seek_current(player, voice_client, target)
+        if position is None:
+            await interaction.followup.send("Nothing seekable is playing.")
+            return
+        verb = "Rewound" if delta < 0 else "Skipped ahead"
+        await interaction.followup.send(f"{verb} to **{self.format_timestamp(position)}**.")
+
+    async def seek_current(self, player, voice_client, seconds):
+        """Seek the playing track in place and re-anchor timestamp state.
+
+        The seek may wait for a process slot, so it runs outside the player's task; only the
+        bookkeeping afterwards goes through it. Returns the exact new position, or None if what's
+        playing isn't a track (e.g. a /sfx clip).
+        """
+        source = voice_client.source
+        source = getattr(source, "bed", source)  # the track under any overlays
+        if not isinstance(source, TrackSource):
+            return None
+        await self._in_decoder_thread(source.seek, seconds)
+        return await player.call(self._seeked, player, voice_client, source)
 
-        await interaction.response.send_message(f"Skipped to **{self.format_timestamp(parsed)}**.")
+    def _seeked(self, player, voice_client, source):
+        current = voice_client.source
+        if getattr(current, "bed", current) is not source:
+            # The track ended or was replaced while its decoder restarted
+            return None
+        position = source.position
+        player.reset_clock(position, paused=voice_client.is_paused())
+        # The current track's end moved, so the prefetch wait has to be recomputed
+        if player.prefetch_task and not player.prefetch_task.done() and player.prefetched is None:
+            player.prefetch_task.cancel()
+            player.prefetch_task = None
+        self.schedule_prefetch(player)
+        return position
 
     @app_commands.command(name="stop", description="Stop playing and clear the queue.")
     async def stop(self, interaction: discord.Interaction):
@@ -493,18 +1279,26 @@ class AudioCog(commands.Cog):
         guild_id = interaction.guild.id
         voice_client = interaction.guild.voice_client
         if voice_client:
-            voice_client.stop()
-            queue = self.get_queue(guild_id)
-            self.queue_cache[guild_id].clear()
-            self.looping[guild_id] = False
-            self.clear_timestamp_state(guild_id)
-            self.current_track.pop(guild_id, None)
-            while not queue.empty():
-                queue.get_nowait()
-            await interaction.response.send_message("Audio has been stopped and the queue has been erased.")
+            player = self.get_player(guild_id)
+            await interaction.response.defer()
+            leftover = await player.call(self._stop, player, voice_client)
+            await interaction.followup.send("Audio has been stopped and the queue has been erased.")
+            await asyncio.to_thread(processes.scheduler.kill, leftover)
         else:
             await interaction.response.send_message("Not currently in a voice channel.")
     
+    def _stop(self, player, voice_client):
+        player.queue.clear()
+        player.opening = None
+        player.looping = False
+        player.clear_timestamps()
+        player.current_track = None
+        player.cancel_prefetch()
+        player.overlays.clear()
+        voice_client.stop()
+        # Processes started before the stop; any later /play gets fresh ones that mustn't be killed
+        return processes.scheduler.guild_slots(player.guild_id)
+
     @app_commands.command(name="clearqueue", description="Clear the rest of the song queue.")
     async def clearqueue(self, interaction: discord.Interaction):
         if not interaction_has_allowed_role(interaction):
@@ -516,17 +1310,22 @@ class AudioCog(commands.Cog):
         guild_id = interaction.guild.id
         voice_client = interaction.guild.voice_client
         if voice_client:
-            queue = self.get_queue(guild_id)
-            self.queue_cache[guild_id].clear()
-            if not queue.empty():
-                while not queue.empty():
-                    queue.get_nowait()
-                await interaction.response.send_message("The queue has been cleared.")
+            player = self.get_player(guild_id)
+            await interaction.response.defer()
+            if await player.call(self._clear_queue, player):
+                await interaction.followup.send("The queue has been cleared.")
             else:
-                await interaction.response.send_message("The queue is already empty.")
+                await interaction.followup.send("The queue is already empty.")
         else:
             await interaction.response.send_message("Not currently in a voice channel to clear the queue.")
 
+    def _clear_queue(self, player):
+        # Returns whether there was anything to clear
+        had_entries = bool(player.queue)
+        player.queue.clear()
+        player.cancel_prefetch()
+        return had_entries
+
     @app_commands.command(name="loop", description="Toggle looping for the current track.")
     async def loop(self, interaction: discord.Interaction):
         if not interaction_has_allowed_role(interaction):
@@ -535,13 +1334,16 @@ class AudioCog(commands.Cog):
         if not interaction.guild:
             await interaction.response.send_message("Please use this command in a server.", ephemeral=True)
             return
-        guild_id = interaction.guild.id
-        if self.looping.get(guild_id, False):
-            self.looping[guild_id] = False
-            await interaction.response.send_message("Looping is now disabled.")
+        player = self.get_player(interaction.guild.id)
+        await interaction.response.defer()
+        if await player.call(self._toggle_loop, player):
+            await interaction.followup.send("Looping is now enabled.")
         else:
-            self.looping[guild_id] = True
-            await interaction.response.send_message("Looping is now enabled.")
+            await interaction.followup.send("Looping is now disabled.")
+
+    def _toggle_loop(self, player):
+        player.looping = not player.looping
+        return player.looping
 
     @app_commands.command(name="pause", description="Pause the currently playing track.")
     async def pause(self, interaction: discord.Interaction):
@@ -554,12 +1356,17 @@ class AudioCog(commands.Cog):
         guild_id = interaction.guild.id
         voice_client = interaction.guild.voice_client
         if voice_client and voice_client.is_playing():
-            voice_client.pause()
-            self.pause_start_time[guild_id] = time.monotonic()
-            await interaction.response.send_message("Audio is now paused.")
+            player = self.get_player(guild_id)
+            await interaction.response.defer()
+            await player.call(self._pause, player, voice_client)
+            await interaction.followup.send("Audio is now paused.")
         else:
             await interaction.response.send_message("No audio is currently playing that can be paused.")
 
+    def _pause(self, player, voice_client):
+        voice_client.pause()
+        player.pause_clock()
+
     @app_commands.command(name="unpause", description="Resume the paused track.")
     async def unpause(self, interaction: discord.Interaction):
         if not interaction_has_allowed_role(interaction):
@@ -571,22 +1378,25 @@ class AudioCog(commands.Cog):
         guild_id = interaction.guild.id
         voice_client = interaction.guild.voice_client
         if voice_client and voice_client.is_paused():
-            voice_client.resume()
-            if guild_id in self.pause_start_time and self.pause_start_time[guild_id] is not None:
-                self.accumulated_pause_seconds[guild_id] = self.accumulated_pause_seconds.get(guild_id, 0) + (time.monotonic() - self.pause_start_time[guild_id])
-                self.pause_start_time[guild_id] = None
-            await interaction.response.send_message("Continuing playback.")
+            player = self.get_player(guild_id)
+            await interaction.response.defer()
+            await player.call(self._resume, player, voice_client)
+            await interaction.followup.send("Continuing playback.")
         else:
             await interaction.response.send_message("Audio is not currently paused.")
 
+    def _resume(self, player, voice_client):
+        voice_client.resume()
+        player.resume_clock()
+
     @app_commands.command(name="queue", description="View the current queue and now playing.")
     async def queue(self, interaction: discord.Interaction):
         if not interaction.guild:
             await interaction.response.send_message("The queue is currently empty.", ephemeral=True)
             return
-        guild_id = interaction.guild.id
-        current = self.current_track.get(guild_id)
-        queue = self.queue_cache.get(guild_id, [])
+        player = self.players.get(interaction.guild.id)
+        current = player.current_track if player else None
+        queue = player.upcoming(20) if player else ()
 
         if not current and not queue:
             embed = discord.Embed(
@@ -601,8 +1411,8 @@ class AudioCog(commands.Cog):
 
         if current:
             current_filename = os.path.basename(current)
-            total_sec = self.total_duration_seconds.get(guild_id)
-            elapsed_sec = self.get_current_elapsed(guild_id)
+            total_sec = player.total_duration
+            elapsed_sec = player.elapsed()
             if total_sec is not None and elapsed_sec is not None:
                 # Clamp elapsed to total for display (e.g. past end while switching)
                 display_elapsed = min(int(elapsed_sec), int(total_sec))
@@ -613,17 +1423,42 @@ class AudioCog(commands.Cog):
 
         if queue:
             # Discord field value limit is 1024; show up to ~20 tracks or truncate
-            lines = [f"{i}. `{track}`" for i, track in enumerate(queue[:20], start=1)]
+            lines = []
+            for i, track in enumerate(queue, start=1):
+                duration = self.metadata.get_duration(track)
+                lines.append(f"{i}. `{track}` ({self.format_timestamp(duration)})" if duration is not None else f"{i}. `{track}`")
             queue_text = "\n".join(lines)
-            if len(queue) > 20:
-                queue_text += f"\n*...and {len(queue) - 20} more*"
+            queued = player.queue_length()
+            if queued > len(queue):
+                queue_text += f"\n*...and {queued - len(queue)} more*"
             embed.add_field(name="Up next", value=queue_text or "—", inline=False)
 
-        loop_status = "Looping is enabled." if self.looping.get(guild_id) else "Looping is disabled."
+        loop_status = "Looping is enabled." if player and player.looping else "Looping is disabled."
         embed.set_footer(text=loop_status)
 
         await interaction.response.send_message(embed=embed)
 
+    @app_commands.command(name="refresh", description="Rescan the audio folder and re-read track details.")
+    async def refresh(self, interaction: discord.Interaction):
+        if not interaction_has_allowed_role(interaction):
+            await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+            return
+        if self._metadata_lock.locked():
+            await interaction.response.send_message("A refresh is already running; please wait for it to finish.", ephemeral=True)
+            return
+        await interaction.response.defer()
+        try:
+            await asyncio.to_thread(self.library.build)
+            self.library_ready.set()
+            probed = await self.warm_metadata(force=True)
+            # New tracks only; re-measuring the whole library would take far longer than a refresh
+            self._process_now.set()
+        except Exception as e:
+            logger.exception("Library refresh failed: %s", e)
+            await interaction.followup.send("There was an error refreshing the audio library.", ephemeral=True)
+            return
+        await interaction.followup.send(f"Refreshed **{self.library.track_count}** tracks ({probed} read successfully).")
+
     @app_commands.command(name="audio", description="List available audio.")
     @app_commands.describe(subfolder="Optional subfolder path, e.g. 'wip', 'soundtrack', 'sfx', etc.")
     @app_commands.describe(results="Optional; customize the number of returned results per page.")
@@ -631,51 +1466,22 @@ class AudioCog(commands.Cog):
         if not interaction_has_allowed_role(interaction):
             await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
             return
+        if not await self._check_library_ready(interaction):
+            return
         try:
-            opt_dir = subfolder
-            search_folder = os.path.join(self.audio_folder, opt_dir) if opt_dir else self.audio_folder
-            audio_folder_real = os.path.realpath(self.audio_folder)
-            search_folder_real = os.path.realpath(search_folder)
-
-            if not os.path.isdir(search_folder):
-                await interaction.response.send_message("That folder couldn't be found. Please check your spelling and try again.", ephemeral=True)
-                return
-            if not search_folder_real.startswith(audio_folder_real):
+            opt_dir = normalize_folder(subfolder)
+            if opt_dir is None:
                 await interaction.response.send_message("That folder path is not valid.", ephemeral=True)
                 return
-
-            valid_extensions = ('.mp3', '.wav', '.ogg', '.flac', '.m4a')
-            folders = []
-            files = []
-            with os.scandir(search_folder) as entries:
-                for entry in entries:
-                    path = f"{opt_dir}/{entry.name}" if opt_dir else entry.name
-                    if entry.is_dir():
-                        folders.append(path)
-                    elif entry.is_file() and entry.name.lower().endswith(valid_extensions):
-                        files.append(path)
-
-            folders.sort()
-            files.sort()
-            # When inside a subfolder, show only names (no path prefix) for cleaner display
-            display = (lambda p: os.path.basename(p)) if opt_dir else (lambda p: p)
-            folder_line = ("📁 " + ", ".join(f"**{display(path)}**" for path in folders)) if folders else ""
-            file_entries = [f"`{display(path)}`" for path in files]
-            all_entries = ([folder_line] if folder_line else []) + file_entries
-
-            if not all_entries:
-                await interaction.response.send_message("No audio files or subfolders were found in this folder.")
+            listing = self.library.list_folder(opt_dir)
+            if listing is None:
+                await interaction.response.send_message("That folder couldn't be found. Please check your spelling and try again.", ephemeral=True)
                 return
 
             # If no provided results, load default results per page
             if results is None:
-                try:
-                    with open("./settings.json", "r") as f:
-                        settings = json.load(f)
-                    page_size = settings.get("results_default", 12)
-                except Exception as e:
-                    print(f"[WARN] Failed to load settings.json during audio command. Defaulting to 12: {e}")
-                    page_size = 12
+                guild_id = interaction.guild.id if interaction.guild else None
+                page_size = self.bot.settings.get("results_default", guild_id)
             else:
                 # User provided specific number, round if needed and set
                 if results >= 5 and results < 101:
@@ -685,60 +1491,76 @@ class AudioCog(commands.Cog):
                 else:
                     page_size = 100
 
-            pages = [all_entries[i:i+page_size] for i in range(0, len(all_entries), page_size)]
-            total_pages = len(pages)
-            current_page = 0
-            title_prefix = f'Available audio in "{opt_dir}"' if opt_dir else "Available audio"
-
-            def get_page_embed(page):
-                lines = [f"{1 + page * page_size + i}. {name}" for i, name in enumerate(pages[page])]
-                embed = discord.Embed(
-                    title=f"{title_prefix} (page {page+1}/{total_pages})",
-                    description="\n".join(lines),
-                    color=0x5865F2,
-                )
-                footer = "Use /audio (folder) to view a folder, /play (filename) to play"
-                if total_pages > 1:
-                    footer += " • Arrow reactions to change pages"
-                embed.set_footer(text=footer)
-                return embed
-
-            await interaction.response.send_message(embed=get_page_embed(current_page))
-            message = await interaction.original_response()
-
-            if total_pages == 1:
+            page = self.build_audio_page(opt_dir, 0, page_size)
+            if page is None:
+                await interaction.response.send_message("No audio files or subfolders were found in this folder.")
                 return
-
-            await message.add_reaction("⬅️")
-            await message.add_reaction("➡️")
-
-            def check(reaction, user):
-                return (
-                    user == interaction.user and reaction.message.id == message.id and str(reaction.emoji) in ["⬅️", "➡️"]
-                )
-
-            while True:
-                try:
-                    reaction, user = await self.bot.wait_for('reaction_add', timeout=60.0, check=check)
-                    if str(reaction.emoji) == "➡️":
-                        if current_page < total_pages - 1:
-                            current_page += 1
-                            await message.edit(embed=get_page_embed(current_page))
-                    elif str(reaction.emoji) == "⬅️":
-                        if current_page > 0:
-                            current_page -= 1
-                            await message.edit(embed=get_page_embed(current_page))
-                    await message.remove_reaction(reaction, user)
-                except asyncio.TimeoutError:
-                    await message.clear_reactions()
-                    break
+            embed, view = page
+            # Page turns are handled by AudioPageButton, so nothing has to wait here
+            if view is not None:
+                await interaction.response.send_message(embed=embed, view=view)
+            else:
+                await interaction.response.send_message(embed=embed)
 
         except Exception as e:
-            print(f"[ERROR] Error reading audio folder in audio command: {e}")
+            logger.exception("Error reading audio folder in audio command: %s", e)
             try:
                 await interaction.response.send_message("There was an error attempting to read the audio folder.", ephemeral=True)
             except Exception:
                 await interaction.followup.send("There was an error attempting to read the audio folder.", ephemeral=True)
-                
+
+    def build_audio_page(self, folder, page, page_size):
+        """Render one /audio page from the library index. Returns (embed, view or None), or None if the folder is missing or empty."""
+        listing = self.library.list_folder(folder)
+        if listing is None:
+            return None
+        subfolders, names = listing
+        page_size = max(page_size, 1)
+        # The folder line counts as the first entry, as before
+        has_folder_line = 1 if subfolders else 0
+        total_entries = has_folder_line + len(names)
+        if not total_entries:
+            return None
+        total_pages = -(-total_entries // page_size)
+        page = min(max(page, 0), total_pages - 1)
+        start = page * page_size
+        end = min(start + page_size, total_entries)
+        entries = []
+        if start == 0 and has_folder_line:
+            entries.append("📁 " + ", ".join(f"**{name}**" for name in subfolders))
+        entries.extend(f"`{name}`" for name in names[max(start - has_folder_line, 0):end - has_folder_line])
+
+        title_prefix = f'Available audio in "{folder}"' if folder else "Available audio"
+        lines = [f"{1 + start + i}. {name}" for i, name in enumerate(entries)]
+        embed = discord.Embed(
+            title=f"{title_prefix} (page {page+1}/{total_pages})",
+            description="\n".join(lines),
+            color=0x5865F2,
+        )
+        footer = "Use /audio (folder) to view a folder, /play (filename) to play"
+        if total_pages > 1:
+            footer += " • Use the buttons to change pages"
+        embed.set_footer(text=footer)
+        if total_pages == 1:
+            return embed, None
+        view = discord.ui.View(timeout=None)
+        view.add_item(AudioPageButton(folder, max(page - 1, 0), page_size, "⬅️", disabled=page == 0))
+        view.add_item(AudioPageButton(folder, min(page + 1, total_pages - 1), page_size, "➡️", disabled=page == total_pages - 1))
+        return embed, view
+
+    @audio.autocomplete("subfolder")
+    async def audio_subfolder_autocomplete(self, interaction: discord.Interaction, current: str):
+        return self._choices(self.library.search_folders(current))
+
+    @staticmethod
+    def _choices(paths):
+        # Discord caps choice names and values at 100 characters; longer paths can't be sent as values
+        choices = []
+        for path in paths:
+            if len(path) > 100:
+                continue
+            choices.append(app_commands.Choice(name=path, value=path))
+        return choices
+
 async def setup(bot):
     await bot.add_cog(AudioCog(bot))
@@ -1,19 +1,24 @@
 """Basic commands cog for info, help, leave, etc."""
 
 import discord
-import os
+import logging
 import time
-import json
 from discord import app_commands
 from discord.ext import commands
 from checks import check_allowed_roles, interaction_has_allowed_role
 
+logger = logging.getLogger(__name__)
+
 class CommandsCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        print("Cog 'commands' loaded.")
+        logger.debug("Cog 'commands' loaded.")
         self.__cog_name__ = "Core"
 
+    async def cog_unload(self):
+        # Write any pending setting changes before shutdown
+        await self.bot.settings.close()
+
     @app_commands.command(name="info", description="Display bot version and details.")
     async def info(self, interaction: discord.Interaction) -> None:
         if not interaction_has_allowed_role(interaction):
@@ -27,10 +32,8 @@ class CommandsCog(commands.Cog):
         uptime_secs = int(time.time() - start) if start else 0
         tracks = 0
         audio_cog = self.bot.get_cog("Audio")
-        if audio_cog and getattr(audio_cog, "audio_folder", None):
-            valid = (".mp3", ".wav", ".ogg", ".flac", ".m4a")
-            for _root, _dirs, files in os.walk(audio_cog.audio_folder):
-                tracks += sum(1 for f in files if f.lower().endswith(valid))
+        if audio_cog and getattr(audio_cog, "library", None):
+            tracks = audio_cog.library.track_count
         description = (
             f"**Version:** {version}\n"
             f"**Uptime:** {uptime_secs} seconds\n"
@@ -64,10 +67,17 @@ class CommandsCog(commands.Cog):
                 "/audio [subfolder] — List available audio; optional subfolder to browse\n"
                 "/skip — Skip to the next track\n"
                 "/skipto (timestamp) — Skip to a specific time in the current track\n"
+                "/rewind [seconds] — Rewind the current track (default 10 seconds)\n"
+                "/forward [seconds] — Skip ahead in the current track (default 10 seconds)\n"
                 "/queue — Show now playing and queue\n"
+                "/overlay (filename) — Play a track over the current one\n"
+                "/sfx (name) — Play a sound effect right away\n"
+                "/volume [percent] — Show or set the volume\n"
+                "/eq [bass] [mid] [treble] — Show or set the EQ, in dB\n"
                 "/loop — Toggle looping for the current track\n"
                 "/stop — Stop and clear the queue\n"
                 "/results (integer) — Edit the default number of returned results per page with /audio\n"
+                "/refresh — Rescan the audio folder and re-read track details\n"
                 "/clearqueue — Clear the queue\n"
                 "/pause — Pause playback\n"
                 "/unpause — Resume playback"
@@ -84,20 +94,13 @@ class CommandsCog(commands.Cog):
             await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
             return
         if number >= 5 and number < 101:
-            try:
-                with open("./settings.json", "r") as f:
-                    settings = json.load(f)
-                settings["results_default"] = number
-                with open("./settings.json", "w") as f:
-                    json.dump(settings, f, indent=4)
-                await interaction.response.send_message(
-                    f"Number of default results per page changed to {number}."
-                )
-            except Exception as e:
-                print(f"[WARN] Results default setting dump failed: {e}")
-                await interaction.response.send_message("Failed to save the setting; please try again later.", ephemeral=True)
-            except Exception as e:
-                print(f"[WARN] Results default setting dump failed: {e}")
+            # Per-server when used in a server; saved to settings.json in the background
+            guild_id = interaction.guild.id if interaction.guild else None
+            self.bot.settings.set("results_default", number, guild_id=guild_id)
+            where = " for this server" if guild_id is not None else ""
+            await interaction.response.send_message(
+                f"Number of default results per page changed to {number}{where}."
+            )
         else:
             await interaction.response.send_message(
                 "You can't change the returned results to a number less than 5 or greater than 100!",
@@ -114,7 +117,12 @@ class CommandsCog(commands.Cog):
             return
         voice_client = interaction.guild.voice_client if interaction.guild else None
         if voice_client:
-            await voice_client.disconnect()
+            audio_cog = self.bot.get_cog("Audio")
+            if audio_cog:
+                # Also drops the guild's queue and playback state
+                await audio_cog.evict(interaction.guild.id)
+            else:
+                await voice_client.disconnect()
             await interaction.response.send_message("Disconnected from voice channel.")
         else:
             await interaction.response.send_message("Not currently in a voice channel to leave.")
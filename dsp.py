@@ -0,0 +1,162 @@
+"""Per-guild volume, EQ and limiting of PCM frames, with NumPy."""
+
+import time
+import metrics
+from sources import FRAME_LENGTH
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional; without it /volume and /eq are unavailable
+    np = None
+
+SAMPLE_RATE = 48000
+
+# (name, filter type, centre/corner frequency in Hz) for each /eq band
+EQ_BANDS = (
+    ("bass", "lowshelf", 120),
+    ("mid", "peak", 1000),
+    ("treble", "highshelf", 6000),
+)
+
+
+def _biquad_response(kind, freq, gain_db, freqs, q=0.9):
+    """Magnitude response at `freqs` of an RBJ cookbook biquad (shelf or peak), evaluated in closed form."""
+    a = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * freq / SAMPLE_RATE
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    if kind == "peak":
+        b = [1 + alpha * a, -2 * cos_w0, 1 - alpha * a]
+        den = [1 + alpha / a, -2 * cos_w0, 1 - alpha / a]
+    else:
+        sign = 1 if kind == "lowshelf" else -1
+        root = 2 * np.sqrt(a) * alpha
+        b = [a * ((a + 1) - sign * (a - 1) * cos_w0 + root),
+             sign * 2 * a * ((a - 1) - sign * (a + 1) * cos_w0),
+             a * ((a + 1) - sign * (a - 1) * cos_w0 - root)]
+        den = [(a + 1) + sign * (a - 1) * cos_w0 + root,
+               -sign * 2 * ((a - 1) + sign * (a + 1) * cos_w0),
+               (a + 1) + sign * (a - 1) * cos_w0 - root]
+    z = np.exp(-1j * 2 * np.pi * freqs / SAMPLE_RATE)
+    return np.abs((b[0] + b[1] * z + b[2] * z ** 2) / (den[0] + den[1] * z + den[2] * z ** 2))
+
+
+class DSPChain:
+    """EQ, volume and a limiter applied to one guild's 20 ms frames.
+
+    The EQ is a linear-phase FIR matching the combined response of the bands, applied with
+    overlap-save FFT convolution, so a frame costs two FFTs per channel however many bands there
+    are. Changing the EQ or volume takes effect on the next frame without restarting ffmpeg: EQ
+    changes crossfade across one frame and volume ramps across it, so neither clicks. Turning the
+    EQ on or off crossfades with the dry signal; the filter delays the sound by TAPS // 2 samples
+    and the dry signal doesn't, so that frame briefly sounds phased rather than jumping. The limiter
+    scales a frame down just enough to fit in 16 bits and recovers over LIMITER_RELEASE_SECONDS.
+
+    set_volume()/set_eq() are called from the event loop and process() from the voice thread;
+    settings are swapped in as whole objects, so no lock is needed.
+    """
+
+    TAPS = 511  # FIR length (odd, so the delay is a whole number of samples: ~5 ms)
+    FFT_SIZE = 2048  # at least a frame (960 samples) plus TAPS - 1
+    LIMITER_RELEASE_SECONDS = 0.3
+
+    def __init__(self):
+        self.volume = 1.0
+        self.eq = {name: 0.0 for name, _, _ in EQ_BANDS}
+        self._gain = 1.0  # volume applied at the end of the last frame
+        self._spectrum = None  # FFT of the EQ filter, None when flat
+        self._fade_from = None  # (spectrum or None for dry,) to crossfade out on the next frame
+        self._history = None  # last TAPS - 1 input samples per channel, None if unknown
+        self._limit = 1.0
+
+    @property
+    def bypass(self):
+        """Whether frames can pass through untouched."""
+        return (self.volume == 1.0 and self._gain == 1.0 and self._spectrum is None
+                and self._fade_from is None and self._limit >= 1.0)
+
+    def feed(self, data):
+        """Note a frame of int16 PCM bytes that passed through untouched (None if not PCM).
+
+        Keeps the filter's history current while bypassed, so an EQ turned on next doesn't start
+        by convolving samples from whenever it was last on.
+        """
+        samples = np.frombuffer(data, dtype=np.int16).reshape(-1, 2) if data is not None else ()
+        self._history = samples[-(self.TAPS - 1):].astype(np.float32) if len(samples) >= self.TAPS - 1 else None
+
+    def set_volume(self, volume):
+        self.volume = max(0.0, volume)
+
+    def set_eq(self, **gains):
+        """Set band gains in dB (see EQ_BANDS); bands not given keep their gain."""
+        eq = dict(self.eq)
+        eq.update({name: float(gain) for name, gain in gains.items() if name in eq and gain is not None})
+        previous, self._spectrum = self._spectrum, self._design(eq)
+        if previous is not None or self._spectrum is not None:
+            self._fade_from = (previous,)
+        self.eq = eq
+
+    def _design(self, eq):
+        if not any(eq.values()):
+            return None
+        # Frequency-sample the band response, then window it into a linear-phase FIR
+        freqs = np.fft.rfftfreq(self.TAPS + 1, 1 / SAMPLE_RATE)
+        response = np.ones_like(freqs)
+        for name, kind, freq in EQ_BANDS:
+            if eq[name]:
+                response *= _biquad_response(kind, freq, eq[name], freqs)
+        impulse = np.roll(np.fft.irfft(response), self.TAPS // 2)[:self.TAPS] * np.hanning(self.TAPS)
+        return np.fft.rfft(impulse, self.FFT_SIZE, axis=0)[:, None]
+
+    def _convolve(self, block, spectrum):
+        """Filter the frame at the end of block (TAPS - 1 samples of history, then the frame)."""
+        out = np.fft.irfft(np.fft.rfft(block, self.FFT_SIZE, axis=0) * spectrum, self.FFT_SIZE, axis=0)
+        return out[self.TAPS - 1:len(block)]
+
+    def process(self, frame):
+        """Apply the chain to a float32 (samples, 2) frame and return int16 PCM bytes."""
+        started = time.perf_counter()
+        history = self._history
+        if history is None:
+            history = np.zeros((self.TAPS - 1, 2), dtype=np.float32)
+        spectrum, fade_from = self._spectrum, self._fade_from
+        if spectrum is not None or fade_from is not None:
+            block = np.concatenate((history, frame))
+            wet = self._convolve(block, spectrum) if spectrum is not None else frame
+            if fade_from is not None:
+                previous = fade_from[0]
+                old = self._convolve(block, previous) if previous is not None else frame
+                fade = np.linspace(0, 1, len(frame), dtype=np.float32)[:, None]
+                wet = old * (1 - fade) + wet * fade
+                self._fade_from = None
+        else:
+            wet = frame
+        # Kept even while flat (see feed()), so turning the EQ on doesn't convolve against silence
+        self._history = frame[-(self.TAPS - 1):].copy()
+        frame = wet
+
+        volume = self.volume
+        if volume != 1.0 or self._gain != 1.0:
+            frame = frame * np.linspace(self._gain, volume, len(frame), dtype=np.float32)[:, None]
+            self._gain = volume
+
+        peak = float(np.abs(frame).max()) if len(frame) else 0.0
+        fit = 32767 / peak if peak > 32767 else 1.0
+        release = FRAME_LENGTH / self.LIMITER_RELEASE_SECONDS
+        self._limit = fit if fit < self._limit else min(fit, self._limit + release)
+        if self._limit < 1.0:
+            frame = frame * self._limit
+        data = np.clip(frame, -32768, 32767).astype(np.int16).tobytes()
+        metrics.dsp_frame_seconds.observe(time.perf_counter() - started)
+        return data
+
+    def snapshot(self):
+        return {"volume": self.volume, "eq": dict(self.eq)}
+
+    def restore(self, snapshot):
+        self.set_volume(snapshot.get("volume", 1.0))
+        self._gain = self.volume
+        if np is not None and any(snapshot.get("eq", {}).values()):
+            self.set_eq(**snapshot["eq"])
+            self._fade_from = None
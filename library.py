@@ -0,0 +1,302 @@
+"""In-memory index of the audio folder. Lookups read the index instead of walking the disk."""
+
+import hashlib
+import os
+import posixpath
+import threading
+from search import SearchIndex
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    # watchdog is optional; without it the periodic rescan keeps the index current
+    Observer = None
+    FileSystemEventHandler = object
+
+VALID_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.flac', '.m4a')
+
+
+def normalize_folder(folder):
+    """Normalize a user-supplied folder path to the index form ('' for root). Returns None if it escapes the root."""
+    if not folder:
+        return ""
+    rel = posixpath.normpath(folder.replace("\\", "/").strip("/"))
+    if rel == ".":
+        return ""
+    if rel == ".." or rel.startswith("../") or rel.startswith("/"):
+        return None
+    return rel
+
+
+def _join(folder, name):
+    return f"{folder}/{name}" if folder else name
+
+
+class AudioLibrary:
+    """Basename, folder, search and track-count index over the audio folder.
+
+    Built once with build(), then kept current by file system events (if watchdog is installed)
+    and by periodic calls to build() as a fallback. Safe to read from any thread.
+    """
+
+    def __init__(self, audio_folder):
+        self.audio_folder = os.path.realpath(audio_folder)
+        self._lock = threading.RLock()
+        self._by_basename = {}  # lowercase basename -> set of relative paths
+        self._folders = {"": (set(), set())}  # relative folder -> (subfolder names, file names)
+        self._count = 0
+        self._track_search = SearchIndex()
+        self._folder_search = SearchIndex()
+        self._observer = None
+
+    @property
+    def track_count(self):
+        return self._count
+
+    def build(self):
+        """Walk the whole audio folder and replace the index. Blocking; run off the event loop."""
+        by_basename = {}
+        folders = {"": (set(), set())}
+        count = 0
+        for root, dirs, files in os.walk(self.audio_folder):
+            folder = self._relative(root)
+            if folder is None:
+                continue
+            subfolders, names = folders.setdefault(folder, (set(), set()))
+            for d in dirs:
+                subfolders.add(d)
+                folders.setdefault(_join(folder, d), (set(), set()))
+            for f in files:
+                if f.lower().endswith(VALID_EXTENSIONS):
+                    names.add(f)
+                    by_basename.setdefault(f.lower(), set()).add(_join(folder, f))
+                    count += 1
+        track_search = SearchIndex()
+        track_search.rebuild(p for paths in by_basename.values() for p in paths)
+        folder_search = SearchIndex()
+        folder_search.rebuild(f for f in folders if f)
+        with self._lock:
+            self._by_basename = by_basename
+            self._folders = folders
+            self._count = count
+            self._track_search = track_search
+            self._folder_search = folder_search
+
+    def _relative(self, path):
+        rel = os.path.relpath(path, self.audio_folder).replace(os.sep, "/")
+        if rel == ".":
+            return ""
+        if rel == ".." or rel.startswith("../"):
+            return None
+        return rel
+
+    # --- Incremental updates ---
+
+    def add_file(self, rel):
+        if not rel.lower().endswith(VALID_EXTENSIONS):
+            return
+        folder, name = posixpath.split(rel)
+        with self._lock:
+            self._add_folder_entry(folder)
+            names = self._folders[folder][1]
+            if name in names:
+                return
+            names.add(name)
+            self._by_basename.setdefault(name.lower(), set()).add(rel)
+            self._track_search.add(rel)
+            self._count += 1
+
+    def remove_file(self, rel):
+        folder, name = posixpath.split(rel)
+        with self._lock:
+            entry = self._folders.get(folder)
+            if not entry or name not in entry[1]:
+                return
+            entry[1].discard(name)
+            paths = self._by_basename.get(name.lower())
+            if paths:
+                paths.discard(rel)
+                if not paths:
+                    del self._by_basename[name.lower()]
+            self._track_search.remove(rel)
+            self._count -= 1
+
+    def add_folder(self, rel):
+        """Index a folder that appeared on disk, including anything already inside it."""
+        with self._lock:
+            self._add_folder_entry(rel)
+        for root, _dirs, files in os.walk(os.path.join(self.audio_folder, rel)):
+            folder = self._relative(root)
+            if folder is None:
+                continue
+            with self._lock:
+                self._add_folder_entry(folder)
+            for f in files:
+                self.add_file(_join(folder, f))
+
+    def remove_folder(self, rel):
+        with self._lock:
+            if rel not in self._folders:
+                return
+            for path in list(self.files_under(rel)):
+                self.remove_file(path)
+            prefix = rel + "/"
+            for folder in [k for k in self._folders if k == rel or k.startswith(prefix)]:
+                del self._folders[folder]
+                self._folder_search.remove(folder)
+            parent, name = posixpath.split(rel)
+            if parent in self._folders:
+                self._folders[parent][0].discard(name)
+
+    def _add_folder_entry(self, folder):
+        # Register folder and any missing parents; caller holds the lock
+        while folder not in self._folders:
+            self._folders[folder] = (set(), set())
+            self._folder_search.add(folder)
+            parent, name = posixpath.split(folder)
+            self._folders.setdefault(parent, (set(), set()))[0].add(name)
+            folder = parent
+
+    # --- Lookups ---
+
+    def find_by_basename(self, basename, under_path=None):
+        """Return sorted relative paths with this basename (case-insensitive), optionally only under under_path."""
+        with self._lock:
+            paths = self._by_basename.get(basename.lower())
+            if not paths:
+                return []
+            matches = list(paths)
+        if under_path:
+            prefix = under_path.replace("\\", "/").strip("/") + "/"
+            matches = [p for p in matches if p.startswith(prefix)]
+        return sorted(matches)
+
+    def folder_exists(self, folder):
+        return folder in self._folders
+
+    def folder_by_digest(self, digest):
+        """Return the folder whose SHA-1 hex digest starts with `digest`, or None. Used for long folder paths in custom IDs."""
+        with self._lock:
+            folders = list(self._folders)
+        for folder in folders:
+            if hashlib.sha1(folder.encode()).hexdigest().startswith(digest):
+                return folder
+        return None
+
+    def list_folder(self, folder):
+        """Return (sorted subfolder names, sorted file names) for a folder, or None if it isn't indexed."""
+        with self._lock:
+            entry = self._folders.get(folder)
+            if entry is None:
+                return None
+            return sorted(entry[0]), sorted(entry[1])
+
+    def count_under(self, folder):
+        """Return the number of tracks in folder and its subfolders, from the per-folder index (no per-file work)."""
+        count = 0
+        with self._lock:
+            stack = [folder]
+            while stack:
+                current = stack.pop()
+                entry = self._folders.get(current)
+                if entry is None:
+                    continue
+                subfolders, names = entry
+                count += len(names)
+                stack.extend(_join(current, sub) for sub in subfolders)
+        return count
+
+    def has_tracks_under(self, folder):
+        """Return whether folder or any of its subfolders holds a track; stops at the first folder that does."""
+        with self._lock:
+            stack = [folder]
+            while stack:
+                current = stack.pop()
+                entry = self._folders.get(current)
+                if entry is None:
+                    continue
+                subfolders, names = entry
+                if names:
+                    return True
+                stack.extend(_join(current, sub) for sub in subfolders)
+        return False
+
+    def files_under(self, folder):
+        """Yield relative paths of all tracks in folder and its subfolders, sorted per folder."""
+        listing = self.list_folder(folder)
+        if listing is None:
+            return
+        subfolders, names = listing
+        for name in names:
+            yield _join(folder, name)
+        for sub in subfolders:
+            yield from self.files_under(_join(folder, sub))
+
+    def search_tracks(self, query, limit=25):
+        """Return up to `limit` track paths ranked by prefix and fuzzy match."""
+        with self._lock:
+            return self._track_search.search(query, limit)
+
+    def search_folders(self, query, limit=25):
+        """Return up to `limit` folder paths ranked by prefix and fuzzy match."""
+        with self._lock:
+            return self._folder_search.search(query, limit)
+
+    # --- File watching ---
+
+    def start_watching(self):
+        """Start watching the audio folder for changes. Returns False if watchdog isn't installed."""
+        if Observer is None or self._observer is not None:
+            return self._observer is not None
+        observer = Observer()
+        observer.schedule(_LibraryEventHandler(self), self.audio_folder, recursive=True)
+        observer.daemon = True
+        observer.start()
+        self._observer = observer
+        return True
+
+    def stop_watching(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+
+class _LibraryEventHandler(FileSystemEventHandler):
+    """Translates watchdog events into index updates."""
+
+    def __init__(self, library):
+        super().__init__()
+        self.library = library
+
+    def _rel(self, path):
+        if isinstance(path, bytes):
+            path = os.fsdecode(path)
+        return self.library._relative(path)
+
+    def on_created(self, event):
+        rel = self._rel(event.src_path)
+        if rel is None or rel == "":
+            return
+        if event.is_directory:
+            self.library.add_folder(rel)
+        else:
+            self.library.add_file(rel)
+
+    def on_deleted(self, event):
+        rel = self._rel(event.src_path)
+        if rel is None or rel == "":
+            return
+        # Deleted paths can't be stat'd, so try both; each is a no-op if it doesn't apply
+        self.library.remove_folder(rel)
+        self.library.remove_file(rel)
+
+    def on_moved(self, event):
+        self.on_deleted(event)
+        rel = self._rel(event.dest_path)
+        if rel is None or rel == "":
+            return
+        if event.is_directory:
+            self.library.add_folder(rel)
+        else:
+            self.library.add_file(rel)
@@ -0,0 +1,130 @@
+"""Logging setup: records are queued by the calling thread and written to the console and a rotating
+file by a background listener thread, so log I/O never blocks the event loop."""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+
+# Guild and command of the interaction being handled; set per task by the command tree
+log_context = contextvars.ContextVar("log_context", default={})
+
+# Extra record attributes shown as key=value fields (and JSON keys)
+CONTEXT_FIELDS = ("guild_id", "command", "user_id", "track")
+
+_listener = None
+
+
+class ContextFilter(logging.Filter):
+    """Fills in guild_id/command from log_context unless the call passed them via extra=."""
+
+    def filter(self, record):
+        context = log_context.get()
+        for field in CONTEXT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field))
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """Formatter whose format string may use %(context)s for the record's key=value fields."""
+
+    def format(self, record):
+        fields = " ".join(f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS if getattr(record, field, None) is not None)
+        record.context = f" [{fields}]" if fields else ""
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        return json.dumps(data, default=str)
+
+
+class RotatingLogFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler that also rolls over every `interval` seconds (0 disables the time limit)."""
+
+    def __init__(self, filename, max_bytes=0, backup_count=0, interval=0):
+        super().__init__(filename, mode="a", maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+
+def parse_levels(spec):
+    """Parse "discord=WARNING,cogs.audio=DEBUG" into {logger name: level}."""
+    levels = {}
+    for item in (spec or "").split(","):
+        name, sep, level = item.partition("=")
+        if not sep or not name.strip():
+            continue
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(log_path, level="INFO", console_level="INFO", levels=None, max_bytes=10 * 1024 * 1024,
+                  backup_count=5, rotate_seconds=0, json_file=False):
+    """Route all logging through a queue to a console handler and a rotating file handler.
+
+    `levels` maps logger names to level names (e.g. {"discord": "WARNING"}).
+    Call once at startup; the listener is stopped (and the queue flushed) at exit.
+    """
+    global _listener
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    console = logging.StreamHandler()
+    console.setLevel(console_level)
+    console.setFormatter(TextFormatter("[%(levelname)s]%(context)s %(message)s"))
+
+    file_handler = RotatingLogFileHandler(log_path, max_bytes=max_bytes, backup_count=backup_count, interval=rotate_seconds)
+    file_format = "%(asctime)s %(levelname)-8s %(name)s%(context)s: %(message)s"
+    file_handler.setFormatter(JsonFormatter() if json_file else TextFormatter(file_format, "%Y-%m-%d %H:%M:%S"))
+
+    # Unbounded so logging never blocks the caller; the listener drains it continuously
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name, logger_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, console, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,35 +1,101 @@
 """Main bot file. Handles bot init, event handling, command loading, logging, etc."""
 
 # Required imports
+import time
+startup_began = time.perf_counter()
 import discord
+from discord import app_commands
 from discord.ext import commands
+import asyncio
+import hashlib
+import json
 import logging
 from dotenv import load_dotenv
 import os
-import time
+from settings import Settings
+from logconfig import log_context, parse_levels, setup_logging
+import cluster
+import metrics
+import processes
+import stalls
+
+startup_phases = [("imports", time.perf_counter() - startup_began)]
 
 # Bot version number
 VERSION = "2.5.0"
 
-# Print Discord.py version and file load location for debug
-print("Discord.py Version:", discord.__version__)
-print("Loaded from:", discord.__file__)
-print(f"Woolwav Version: {VERSION}")
-
 # Load .env file, import token and allowed roles (if any)
 load_dotenv()
 token = os.getenv('DISCORD_TOKEN')
 _allowed_roles_raw = (os.getenv("ALLOWED_ROLES") or "").strip()
 bot_allowed_roles = [name.strip() for name in _allowed_roles_raw.split(",") if name.strip()] if _allowed_roles_raw else []
+library_rescan_seconds = int(os.getenv("LIBRARY_RESCAN_SECONDS") or 300)
+metadata_workers = int(os.getenv("METADATA_WORKERS") or min(4, os.cpu_count() or 1))
+# Leave voice after this long without playback, or this long alone in the channel (0 disables)
+idle_disconnect_seconds = int(os.getenv("IDLE_DISCONNECT_SECONDS") or 300)
+empty_channel_seconds = int(os.getenv("EMPTY_CHANNEL_SECONDS") or 60)
+recent_guild_cache = int(os.getenv("RECENT_GUILD_CACHE") or 500)
+# Normalize tracks to this loudness in LUFS ("off" plays them as they are)
+_loudness_target_raw = (os.getenv("LOUDNESS_TARGET") or "-16").strip().lower()
+loudness_target = None if _loudness_target_raw == "off" else float(_loudness_target_raw)
+# Disk space for tracks pre-transcoded to Opus, which play without decoding (0 disables)
+opus_cache_mb = int(os.getenv("OPUS_CACHE_MB") or 2048)
+# Folders whose tracks /sfx plays, kept in memory up to SFX_CACHE_MB (0 disables /sfx)
+sfx_folders = [f.strip() for f in (os.getenv("SFX_FOLDERS") or "sfx").split(",") if f.strip()]
+sfx_cache_mb = int(os.getenv("SFX_CACHE_MB") or 64)
+# ffmpeg/ffprobe limits: total processes, background (metadata) processes, CPU priority and cores
+processes.scheduler.configure(
+    max_processes=int(os.getenv("FFMPEG_MAX_PROCESSES") or 0),
+    max_background=int(os.getenv("FFMPEG_MAX_BACKGROUND") or 0),
+    playback_nice=int(os.getenv("FFMPEG_NICE") or 0),
+    background_nice=int(os.getenv("FFMPEG_BACKGROUND_NICE") or 10),
+    cpus=processes.parse_cpus(os.getenv("FFMPEG_CPUS")),
+)
+metrics_port = (os.getenv("METRICS_PORT") or "").strip()
+metrics_host = (os.getenv("METRICS_HOST") or "127.0.0.1").strip()
+# Log event loop stalls longer than this (0 disables); LOOP_DEBUG=1 also reports blocking calls on the loop
+loop_stall_ms = int(os.getenv("LOOP_STALL_MS") or 250)
+loop_debug = (os.getenv("LOOP_DEBUG") or "").strip() == "1"
+
+# Sharding: SHARD_COUNT=auto (or a number) runs an AutoShardedBot; SHARD_IDS limits this process to
+# some of the shards. cluster.py sets these, plus CLUSTER_ID, for each worker process it starts.
+shard_count_raw = (os.getenv("SHARD_COUNT") or "").strip().lower()
+shard_ids_raw = (os.getenv("SHARD_IDS") or "").strip()
+shard_count = int(shard_count_raw) if shard_count_raw.isdigit() else None
+shard_ids = [int(s) for s in shard_ids_raw.split(",") if s.strip()] if shard_ids_raw else None
+cluster_id = int(os.getenv("CLUSTER_ID") or 0)
+cluster_status_file = (os.getenv("CLUSTER_STATUS_FILE") or "").strip()
 
 # Create log directory if it doesn't exist
 script_dir = os.path.dirname(os.path.abspath(__file__))
 log_dir = os.path.join(script_dir, "logs")
 os.makedirs(log_dir, exist_ok=True)  # create if missing
-log_path = os.path.join(log_dir, "discord.log")
+# Each cluster worker gets its own log so they don't overwrite each other
+log_path = os.path.join(log_dir, f"discord-{cluster_id}.log" if os.getenv("CLUSTER_ID") else "discord.log")
 
-# Set up logging
-handler = logging.FileHandler(filename=log_path, encoding="utf-8", mode="w")
+# Set up logging. Records are written by a background thread; the file rotates by size and age
+# and is appended to (not truncated) on restart. LOG_LEVELS sets levels per logger, e.g.
+# LOG_LEVELS=discord=WARNING,cogs.audio=DEBUG
+setup_logging(
+    log_path,
+    level=(os.getenv("LOG_LEVEL") or "INFO").strip().upper(),
+    console_level=(os.getenv("LOG_CONSOLE_LEVEL") or "INFO").strip().upper(),
+    levels=parse_levels(os.getenv("LOG_LEVELS")),
+    max_bytes=int(float(os.getenv("LOG_MAX_MB") or 10) * 1024 * 1024),
+    backup_count=int(os.getenv("LOG_BACKUPS") or 5),
+    rotate_seconds=int(float(os.getenv("LOG_ROTATE_HOURS") or 24) * 3600),
+    json_file=(os.getenv("LOG_FORMAT") or "").strip().lower() == "json",
+)
+logger = logging.getLogger("woolwav")
+
+# Log Discord.py version and file load location for debug
+logger.info("Discord.py Version: %s", discord.__version__)
+logger.info("Loaded from: %s", discord.__file__)
+logger.info("Woolwav Version: %s", VERSION)
+
+# Load settings once; reads are served from memory
+settings = Settings(os.path.join(script_dir, "settings.json"))
+settings.load()
 
 # Set up Discord.py intents
 intents = discord.Intents.default()
@@ -40,31 +106,136 @@ intents.members = True
 def _no_prefix(_bot, _message):
     return []
 
-bot = commands.Bot(command_prefix=_no_prefix, intents=intents, help_command=None)
+def _record_command(interaction, status):
+    # Latency from the interaction reaching the bot to its handler finishing (or failing)
+    started = interaction.extras.get("started")
+    if started is None or interaction.command is None:
+        return
+    elapsed = time.perf_counter() - started
+    metrics.command_latency.observe(elapsed, command=interaction.command.qualified_name, status=status)
+    if interaction.guild_id:
+        metrics.guild_command_seconds.inc(elapsed, guild=interaction.guild_id)
+        metrics.guild_commands.inc(guild=interaction.guild_id)
+
+class WoolwavTree(app_commands.CommandTree):
+    """Command tree that times every slash command for the metrics endpoint and tags its log records."""
+
+    async def interaction_check(self, interaction):
+        interaction.extras["started"] = time.perf_counter()
+        # The command's handler runs in this task, so its log records pick up these fields
+        log_context.set({
+            "guild_id": interaction.guild_id,
+            "command": interaction.command.qualified_name if interaction.command else None,
+            "user_id": interaction.user.id,
+        })
+        return True
+
+    async def on_error(self, interaction, error):
+        _record_command(interaction, "error")
+        await super().on_error(interaction, error)
+
+bot_options = dict(command_prefix=_no_prefix, intents=intents, help_command=None, tree_cls=WoolwavTree, http_trace=metrics.http_trace())
+if shard_count_raw:
+    if shard_ids and not shard_count:
+        raise SystemExit("SHARD_IDS requires a numeric SHARD_COUNT.")
+    bot = commands.AutoShardedBot(shard_count=shard_count, shard_ids=shard_ids, **bot_options)
+else:
+    bot = commands.Bot(**bot_options)
 tree = bot.tree
 bot.allowed_roles = bot_allowed_roles
+bot.library_rescan_seconds = library_rescan_seconds
+bot.metadata_workers = metadata_workers
+bot.idle_disconnect_seconds = idle_disconnect_seconds
+bot.empty_channel_seconds = empty_channel_seconds
+bot.recent_guild_cache = recent_guild_cache
+bot.loudness_target = loudness_target
+bot.opus_cache_mb = opus_cache_mb
+bot.sfx_folders = sfx_folders
+bot.sfx_cache_mb = sfx_cache_mb
+bot.settings = settings
+bot.cluster_id = cluster_id
 bot.version = VERSION
+bot.startup_phases = startup_phases
+
+# Hashes of the last synced command tree, so unchanged commands aren't re-synced on every boot
+command_hash_path = os.path.join(script_dir, "cache", "command_tree.json")
+
+def _command_tree_hash(guild=None):
+    payload = sorted(
+        (command.to_dict(bot.tree) for command in bot.tree.get_commands(guild=guild)),
+        key=lambda c: (c.get("type", 1), c["name"]),
+    )
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+async def sync_if_changed(guild=None):
+    """Sync the command tree (globally, or to one guild) only if it differs from the last sync. Returns whether it synced."""
+    key = f"{bot.application_id}:{guild.id if guild else 'global'}"
+    digest = _command_tree_hash(guild)
+    try:
+        with open(command_hash_path, "r", encoding="utf-8") as f:
+            synced = json.load(f)
+    except (OSError, ValueError):
+        synced = {}
+    if synced.get(key) == digest and os.getenv("FORCE_SYNC", "").strip() != "1":
+        return False
+    await bot.tree.sync(guild=guild)
+    synced[key] = digest
+    os.makedirs(os.path.dirname(command_hash_path), exist_ok=True)
+    with open(command_hash_path, "w", encoding="utf-8") as f:
+        json.dump(synced, f, indent=4)
+    return True
 
 # On ready event
 @bot.event
 async def on_ready():
     if not getattr(bot, "start_time", None):
         bot.start_time = time.time()
-    print(f'Logged in as {bot.user} (ID: {bot.user.id})')
+        startup_phases.append(("gateway ready", time.perf_counter() - bot.setup_finished))
+        report = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in startup_phases)
+        logger.info("Startup: %s (total %.2fs)", report, time.perf_counter() - startup_began)
+    logger.info("Logged in as %s (ID: %s)", bot.user, bot.user.id)
+    if bot.shard_count:
+        logger.info("Cluster %d: running shards %s of %d", cluster_id, sorted(getattr(bot, "shards", {}) or [bot.shard_id]), bot.shard_count)
+
+@bot.event
+async def on_app_command_completion(interaction, command):
+    _record_command(interaction, "ok")
 
 # Load cogs and sync slash commands
 @bot.event
 async def setup_hook():
+    phase_started = time.perf_counter()
+    bot.settings.start_watching()
+    bot.loop_lag_task = asyncio.create_task(metrics.monitor_loop_lag())
+    if loop_stall_ms > 0:
+        bot.stall_watchdog = stalls.StallWatchdog(loop_stall_ms / 1000, debug=loop_debug)
+        bot.stall_watchdog.start()
+        if loop_debug:
+            logger.info("LOOP_DEBUG is on; blocking calls made on the event loop will be logged.")
+    if metrics_port:
+        try:
+            bot.metrics_runner = await metrics.start_server(metrics_host, int(metrics_port))
+            logger.info("Serving metrics on http://%s:%s/metrics", metrics_host, metrics_port)
+        except (OSError, ValueError) as e:
+            logger.warning("Failed to start metrics endpoint (METRICS_PORT=%s): %s", metrics_port, e)
+    if cluster_status_file:
+        bot.cluster_status_task = asyncio.create_task(cluster.report_status(bot, cluster_status_file))
     await bot.load_extension("cogs.commands")
     await bot.load_extension("cogs.audio")
-    await bot.tree.sync()
-    test_server_id = os.getenv("TEST_SERVER", "").strip()
-    if test_server_id:
-        try:
-            await bot.tree.sync(guild=discord.Object(id=int(test_server_id)))
-            print(f"[DEBUG] Synced slash commands to test server ID {test_server_id}")
-        except Exception as e:
-            print(f"[WARN] Test server sync failed (TEST_SERVER={test_server_id}): {e}")
+    startup_phases.append(("cog load", time.perf_counter() - phase_started))
+    phase_started = time.perf_counter()
+    # Commands are global, so one cluster syncing them is enough
+    if cluster_id == 0:
+        synced = await sync_if_changed()
+        test_server_id = os.getenv("TEST_SERVER", "").strip()
+        if test_server_id:
+            try:
+                if await sync_if_changed(discord.Object(id=int(test_server_id))):
+                    logger.info("Synced slash commands to test server ID %s", test_server_id)
+            except Exception as e:
+                logger.warning("Test server sync failed (TEST_SERVER=%s): %s", test_server_id, e)
+        startup_phases.append(("sync" if synced else "sync (unchanged, skipped)", time.perf_counter() - phase_started))
+    bot.setup_finished = time.perf_counter()
 
-# Run bot
-bot.run(token, log_handler=handler, log_level=logging.DEBUG)
+# Run bot; logging is already configured above, so discord.py shouldn't add its own handler
+bot.run(token, log_handler=None)
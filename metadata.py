@@ -0,0 +1,289 @@
+"""Persistent track metadata (duration, codec, tags) and loudness, read with ffprobe/ffmpeg and cached in SQLite."""
+
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+import metrics
+import processes
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+TrackInfo = namedtuple("TrackInfo", ["duration", "codec", "sample_rate", "channels", "tags"])
+
+
+class Loudness(namedtuple("Loudness", ["integrated", "true_peak"])):
+    """EBU R128 integrated loudness (LUFS) and true peak (dBTP) of a track."""
+
+    # Quiet or silent tracks aren't boosted more than this
+    MAX_GAIN_DB = 12.0
+
+    def gain(self, target, peak_ceiling=-1.0):
+        """Gain in dB that brings the track to `target` LUFS without its true peak exceeding `peak_ceiling`."""
+        gain = min(target - self.integrated, self.MAX_GAIN_DB)
+        if self.true_peak != float("-inf"):
+            gain = min(gain, peak_ceiling - self.true_peak)
+        return gain
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    duration REAL,
+    codec TEXT,
+    sample_rate INTEGER,
+    channels INTEGER,
+    tags TEXT
+)
+"""
+
+_LOUDNESS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS loudness (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    integrated REAL NOT NULL,
+    true_peak REAL NOT NULL
+)
+"""
+
+# Values from the summary ebur128 prints once the whole file has been measured
+_SUMMARY_RE = {
+    "integrated": re.compile(r"\bI:\s+(-?[\d.]+|-inf) LUFS"),
+    "true_peak": re.compile(r"\bPeak:\s+(-?[\d.]+|-inf) dBFS"),
+}
+
+
+def probe(file_path, kind=processes.BACKGROUND):
+    """Run ffprobe on a file and return a TrackInfo, or None if it couldn't be read.
+
+    Background probes (the default) yield to playback for a process slot; pass
+    kind=processes.PLAYBACK when someone is waiting on the result.
+    """
+    try:
+        with metrics.ffprobe_latency.time():
+            out = processes.scheduler.run(
+                ["ffprobe", "-v", "error", "-show_entries",
+                 "format=duration:format_tags:stream=codec_name,sample_rate,channels",
+                 "-select_streams", "a:0", "-of", "json", file_path],
+                kind=kind,
+                timeout=10,
+            )
+        if out.returncode != 0 or not out.stdout.strip():
+            return None
+        data = json.loads(out.stdout)
+    except (FileNotFoundError, subprocess.TimeoutExpired, processes.ProcessLimitError, ValueError):
+        return None
+    fmt = data.get("format", {})
+    stream = (data.get("streams") or [{}])[0]
+    try:
+        duration = float(fmt["duration"]) if "duration" in fmt else None
+        sample_rate = int(stream["sample_rate"]) if "sample_rate" in stream else None
+    except ValueError:
+        duration, sample_rate = None, None
+    return TrackInfo(duration, stream.get("codec_name"), sample_rate, stream.get("channels"), fmt.get("tags") or {})
+
+
+def analyze_loudness(file_path):
+    """Measure a file's loudness with ffmpeg's ebur128 filter. Decodes the whole file; returns a Loudness or None."""
+    try:
+        out = processes.scheduler.run(
+            ["ffmpeg", "-hide_banner", "-nostats", "-i", file_path, "-map", "0:a:0",
+             "-af", "ebur128=peak=true", "-f", "null", "-"],
+            timeout=600,
+        )
+    except (FileNotFoundError, subprocess.TimeoutExpired, processes.ProcessLimitError):
+        return None
+    summary = out.stderr[out.stderr.rfind("Summary:"):] if "Summary:" in out.stderr else ""
+    if out.returncode != 0 or not summary:
+        return None
+    values = {}
+    for name, pattern in _SUMMARY_RE.items():
+        match = pattern.search(summary)
+        if match is None:
+            return None
+        values[name] = float(match.group(1))
+    if values["integrated"] == float("-inf"):
+        return None
+    return Loudness(**values)
+
+
+class MetadataStore:
+    """Track metadata keyed by relative path, invalidated by mtime and size.
+
+    All rows are held in memory after load(), so get() never touches disk or spawns a process.
+    lookup(), warm() and analyze() are blocking; run them off the event loop.
+    """
+
+    def __init__(self, db_path, audio_folder, workers=4):
+        self.db_path = db_path
+        self.audio_folder = audio_folder
+        self.workers = max(1, workers)
+        self._cache = {}  # relative path -> (mtime, size, TrackInfo)
+        self._loudness = {}  # relative path -> (mtime, size, Loudness)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._closed = threading.Event()  # stops a long analyze() pass at shutdown
+
+    def load(self):
+        """Open (or create) the database and read every row into memory."""
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute(_SCHEMA)
+        conn.execute(_LOUDNESS_SCHEMA)
+        conn.commit()
+        cache = {}
+        for path, mtime, size, duration, codec, sample_rate, channels, tags in conn.execute("SELECT * FROM tracks"):
+            cache[path] = (mtime, size, TrackInfo(duration, codec, sample_rate, channels, json.loads(tags or "{}")))
+        with self._lock:
+            self._conn = conn
+            self._cache = cache
+        self.load_loudness()
+
+    def load_loudness(self):
+        """(Re)read loudness rows, e.g. ones another process has analyzed since load()."""
+        with self._lock:
+            if self._conn is None:
+                return
+            rows = self._conn.execute("SELECT * FROM loudness").fetchall()
+            self._loudness = {path: (mtime, size, Loudness(integrated, true_peak)) for path, mtime, size, integrated, true_peak in rows}
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get(self, rel):
+        """Return cached TrackInfo without checking the file; None if never probed."""
+        entry = self._cache.get(rel)
+        return entry[2] if entry else None
+
+    def get_duration(self, rel):
+        info = self.get(rel)
+        return info.duration if info else None
+
+    def get_loudness(self, rel):
+        """Return cached Loudness for a track, or None if it hasn't been analyzed."""
+        entry = self._loudness.get(rel)
+        return entry[2] if entry else None
+
+    def lookup(self, rel):
+        """Return TrackInfo for a track, probing it only if it's new or changed since it was cached."""
+        stat = self._stat(rel)
+        if stat is None:
+            return None
+        entry = self._cache.get(rel)
+        if entry and entry[0] == stat[0] and entry[1] == stat[1]:
+            return entry[2]
+        info = probe(os.path.join(self.audio_folder, rel), kind=processes.PLAYBACK)
+        if info is not None:
+            self._store([(rel, stat[0], stat[1], info)])
+        return info
+
+    def warm(self, paths, force=False):
+        """Probe every stale (or, with force, every) path in parallel. Returns how many were probed."""
+        paths = list(paths)
+
+        def _probe_one(rel):
+            stat = self._stat(rel)
+            if stat is None:
+                return None
+            entry = self._cache.get(rel)
+            if not force and entry and entry[0] == stat[0] and entry[1] == stat[1]:
+                return None
+            info = probe(os.path.join(self.audio_folder, rel))
+            return (rel, stat[0], stat[1], info) if info is not None else None
+
+        probed = 0
+        batch = []
+        # Each worker thread blocks on its own ffprobe process, so this bounds concurrent probes
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ffprobe") as pool:
+            for row in pool.map(_probe_one, paths):
+                if row is None:
+                    continue
+                batch.append(row)
+                probed += 1
+                if len(batch) >= 100:
+                    self._store(batch)
+                    batch = []
+        if batch:
+            self._store(batch)
+        self.prune(paths)
+        return probed
+
+    def analyze(self, paths, force=False):
+        """Measure the loudness of every new or changed (or, with force, every) path in parallel. Returns how many were analyzed.
+
+        Each file is decoded in full, so this is much slower than warm(); it runs as background work.
+        """
+        def _analyze_one(rel):
+            if self._closed.is_set():
+                return None
+            stat = self._stat(rel)
+            if stat is None:
+                return None
+            entry = self._loudness.get(rel)
+            if not force and entry and entry[0] == stat[0] and entry[1] == stat[1]:
+                return None
+            loudness = analyze_loudness(os.path.join(self.audio_folder, rel))
+            return (rel, stat[0], stat[1], loudness) if loudness is not None else None
+
+        analyzed = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ebur128") as pool:
+            # Stored as each file finishes, since a full pass over a large library can take hours
+            for row in pool.map(_analyze_one, list(paths)):
+                if row is not None:
+                    self._store_loudness(row)
+                    analyzed += 1
+        return analyzed
+
+    def prune(self, keep):
+        """Drop cached rows for tracks that are no longer in the library."""
+        keep = set(keep)
+        with self._lock:
+            stale = [p for p in self._cache if p not in keep]
+            for p in stale:
+                del self._cache[p]
+            stale_loudness = [p for p in self._loudness if p not in keep]
+            for p in stale_loudness:
+                del self._loudness[p]
+            if self._conn is not None and (stale or stale_loudness):
+                self._conn.executemany("DELETE FROM tracks WHERE path = ?", [(p,) for p in stale])
+                self._conn.executemany("DELETE FROM loudness WHERE path = ?", [(p,) for p in stale_loudness])
+                self._conn.commit()
+
+    def _stat(self, rel):
+        try:
+            st = os.stat(os.path.join(self.audio_folder, rel))
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size
+
+    def _store(self, rows):
+        with self._lock:
+            for rel, mtime, size, info in rows:
+                self._cache[rel] = (mtime, size, info)
+            if self._conn is not None:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(rel, mtime, size, info.duration, info.codec, info.sample_rate, info.channels, json.dumps(info.tags))
+                     for rel, mtime, size, info in rows],
+                )
+                self._conn.commit()
+
+    def _store_loudness(self, row):
+        rel, mtime, size, loudness = row
+        with self._lock:
+            self._loudness[rel] = (mtime, size, loudness)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?, ?)",
+                    (rel, mtime, size, loudness.integrated, loudness.true_peak),
+                )
+                self._conn.commit()
@@ -0,0 +1,224 @@
+"""Counters, gauges and histograms exposed in Prometheus text format on a local HTTP endpoint."""
+
+import asyncio
+import bisect
+import logging
+import threading
+import time
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+_registry = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def remove(self, **labels):
+        """Drop a label set, e.g. for a guild that's no longer active."""
+        with self._lock:
+            self._values.pop(_label_key(self.labelnames, labels), None)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Gauge that is either set directly or computed at scrape time by a callback returning {labels tuple: value}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(self.labelnames, labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                logger.warning("Metric callback for %s failed: %s", self.name, e)
+                values = {}
+            with self._lock:
+                self._values = {tuple(str(part) for part in key): value for key, value in values.items()}
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        """Context manager that observes the elapsed wall time of its block."""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self._values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def render():
+    """Return every registered metric in Prometheus text exposition format."""
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Bot metrics ---
+
+command_latency = Histogram("woolwav_command_latency_seconds", "Time from receiving a slash command to its handler finishing.", ["command", "status"])
+guild_command_seconds = Counter("woolwav_guild_command_seconds_total", "Total time spent handling slash commands, per guild.", ["guild"])
+guild_commands = Counter("woolwav_guild_commands_total", "Slash commands handled, per guild.", ["guild"])
+role_check_failures = Counter("woolwav_role_check_failures_total", "Commands rejected because the user lacked an allowed role.")
+ffprobe_latency = Histogram("woolwav_ffprobe_seconds", "Time taken by each ffprobe run.")
+ffmpeg_first_frame = Histogram("woolwav_ffmpeg_first_frame_seconds", "Time from spawning ffmpeg to reading its first PCM frame.")
+opus_cache_lookups = Counter("woolwav_opus_cache_lookups_total", "Track starts served from the Opus cache (hit) or decoded by ffmpeg (miss).", ["result"])
+sfx_cache_lookups = Counter("woolwav_sfx_cache_lookups_total", "Sound effects played from memory (hit) or loaded on demand (miss).", ["result"])
+sfx_cache_bytes = Gauge("woolwav_sfx_cache_bytes", "Memory used by sound effects cached for /sfx.")
+sfx_latency = Histogram("woolwav_sfx_latency_seconds", "Time from receiving /sfx to its clip starting.", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+ffmpeg_active = Gauge("woolwav_ffmpeg_processes", "ffmpeg decoder processes currently running.")
+ffmpeg_processes = Gauge("woolwav_managed_processes", "ffmpeg/ffprobe processes holding a scheduler slot, by kind.", ["kind"])
+process_wait = Histogram("woolwav_process_slot_wait_seconds", "Time spent waiting for a process slot, by kind.", ["kind"])
+# Rendered before the CPU counter; its callback samples the processes and updates both
+ffmpeg_rss_bytes = Gauge("woolwav_guild_ffmpeg_rss_bytes", "Resident memory of each guild's running ffmpeg processes.", ["guild"])
+ffmpeg_cpu_seconds = Counter("woolwav_guild_ffmpeg_cpu_seconds_total", "CPU time used by each guild's ffmpeg processes.", ["guild"])
+dsp_frame_seconds = Histogram("woolwav_dsp_frame_seconds", "Time taken to apply a guild's volume, EQ and limiter to one 20 ms frame.", buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02))
+transition_gap = Histogram("woolwav_track_transition_gap_seconds", "Time from a track ending to the next one starting.", buckets=(0.005, 0.01, 0.02, 0.04, 0.1, 0.25, 0.5, 1, 2, 5))
+last_transition_gap = Gauge("woolwav_last_track_transition_gap_seconds", "Most recent track transition gap, per guild.", ["guild"])
+tracks_started = Counter("woolwav_tracks_started_total", "Tracks started from the queue.")
+queue_depth = Gauge("woolwav_queue_depth", "Tracks waiting in each guild's queue.", ["guild"])
+playback_errors = Counter("woolwav_playback_errors_total", "Tracks that ended with a playback error.")
+loop_lag = Histogram("woolwav_event_loop_lag_seconds", "How late the event loop woke a periodic timer.", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+loop_stalls = Counter("woolwav_event_loop_stalls_total", "Times the event loop was blocked past the stall threshold, by the command running.", ["command"])
+loop_stall_seconds = Histogram("woolwav_event_loop_stall_seconds", "How long each event loop stall lasted.", buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+blocking_calls = Counter("woolwav_event_loop_blocking_calls_total", "Known blocking calls made on the event loop thread (LOOP_DEBUG only).", ["call"])
+loop_lag_current = Gauge("woolwav_event_loop_lag_current_seconds", "Most recent event loop lag measurement.")
+rest_requests = Counter("woolwav_discord_rest_requests_total", "Discord REST requests made, by method and status.", ["method", "status"])
+rate_limits = Counter("woolwav_discord_rate_limits_total", "Discord REST responses that were rate limited (HTTP 429).", ["method"])
+
+
+async def monitor_loop_lag(interval=0.5):
+    """Measure how late the event loop runs a timer; runs until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        loop_lag.observe(lag)
+        loop_lag_current.set(lag)
+
+
+def http_trace():
+    """Return an aiohttp TraceConfig that counts Discord REST requests and rate limits; pass as http_trace to the bot."""
+    async def on_request_end(_session, _ctx, params):
+        status = params.response.status
+        rest_requests.inc(method=params.method, status=status)
+        if status == 429:
+            rate_limits.inc(method=params.method)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+async def start_server(host, port):
+    """Serve /metrics on host:port. Returns the runner so it can be cleaned up."""
+    async def handle(_request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
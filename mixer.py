@@ -0,0 +1,138 @@
+"""Mixing of overlay tracks (e.g. sound effects) on top of the playing track, with NumPy."""
+
+import threading
+import discord
+from sources import FRAME_SIZE, FRAME_LENGTH
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional; without it /overlay is unavailable and tracks play as before
+    np = None
+
+# Samples per channel in one 20 ms frame
+FRAME_SAMPLES = FRAME_SIZE // 4
+
+
+class Overlays:
+    """The overlays playing in one guild, mixed into each frame of whatever track is playing.
+
+    Held by the guild's player, so overlays carry on across track changes. add()/clear() are
+    called from the event loop and mix() from the voice thread.
+
+    While any overlay plays, the track is ducked to DUCK_GAIN (ramping over DUCK_SECONDS so it
+    doesn't click). The sum is left unclipped for the guild's DSP chain, whose limiter keeps it
+    in range.
+    """
+
+    MAX_LAYERS = 8
+    DUCK_GAIN = 0.4
+    DUCK_SECONDS = 0.12
+
+    def __init__(self):
+        self._layers = []  # [source, gain, name]
+        self._lock = threading.Lock()
+        self._duck = 1.0
+
+    @property
+    def idle(self):
+        """Whether frames can pass through untouched: no overlays and the track fully un-ducked."""
+        return not self._layers and self._duck >= 1.0
+
+    def names(self):
+        with self._lock:
+            return [name for _, _, name in self._layers]
+
+    def add(self, source, gain=1.0, name=None):
+        """Start mixing a PCM source in. Returns False (leaving the source to the caller) if MAX_LAYERS are playing."""
+        with self._lock:
+            if len(self._layers) >= self.MAX_LAYERS:
+                return False
+            self._layers.append([source, gain, name])
+            return True
+
+    def clear(self):
+        with self._lock:
+            layers, self._layers = self._layers, []
+        for source, _, _ in layers:
+            source.cleanup()
+
+    def mix(self, frame):
+        """Mix one frame of the overlays into a float32 (samples, 2) frame, in place."""
+        with self._lock:
+            layers = list(self._layers)
+        target = self.DUCK_GAIN if layers else 1.0
+        step = (1.0 - self.DUCK_GAIN) * FRAME_LENGTH / self.DUCK_SECONDS
+        duck = min(self._duck + step, target) if self._duck < target else max(self._duck - step, target)
+        if duck != 1.0 or self._duck != 1.0:
+            frame *= np.linspace(self._duck, duck, FRAME_SAMPLES, dtype=np.float32)[:, None]
+        self._duck = duck
+
+        finished = []
+        for layer in layers:
+            source, gain, _ = layer
+            data = source.read()
+            if len(data) < FRAME_SIZE:
+                finished.append(layer)
+                if not data:
+                    continue
+                data = data + b"\0" * (FRAME_SIZE - len(data))
+            frame += np.frombuffer(data, dtype=np.int16).reshape(-1, 2) * gain
+        if finished:
+            done = {id(layer) for layer in finished}
+            with self._lock:
+                self._layers = [layer for layer in self._layers if id(layer) not in done]
+            for source, _, _ in finished:
+                source.cleanup()
+
+
+class MixerSource(discord.AudioSource):
+    """Plays a track source with a guild's overlays mixed on top and its DSP chain applied.
+
+    is_opus() matches the track's for the whole stream, because discord.py only creates its
+    encoder when a source starts out as PCM. With no overlays and a neutral DSP chain the
+    track's frames pass straight through, so a track from the Opus cache is still sent without
+    re-encoding. Otherwise its packets are decoded to PCM, processed and encoded again here.
+    The source ends when the track does; overlays and DSP settings carry on to the next track.
+    """
+
+    def __init__(self, bed, overlays, dsp):
+        self.bed = bed
+        self.overlays = overlays
+        self.dsp = dsp
+        self._opus = bed.is_opus()
+        self._decoder = None
+        self._encoder = None
+
+    def read(self):
+        data = self.bed.read()
+        if not data:
+            return b""
+        if np is None:
+            return data
+        if self.overlays.idle and self.dsp.bypass:
+            # Opus packets aren't decoded just for this; the decoder starts afresh too
+            self.dsp.feed(None if self._opus else data)
+            return data
+        if self._opus:
+            if self._decoder is None:
+                self._decoder = discord.opus.Decoder()
+            data = self._decoder.decode(data)
+        frame = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        if len(frame) < FRAME_SAMPLES * 2:
+            frame = np.pad(frame, (0, FRAME_SAMPLES * 2 - len(frame)))
+        frame = frame.reshape(-1, 2)
+        if not self.overlays.idle:
+            self.overlays.mix(frame)
+        data = self.dsp.process(frame)
+        if self._opus:
+            if self._encoder is None:
+                self._encoder = discord.opus.Encoder()
+            data = self._encoder.encode(data, FRAME_SAMPLES)
+        return data
+
+    def is_opus(self):
+        return self._opus
+
+    def cleanup(self):
+        self.bed.cleanup()
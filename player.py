@@ -0,0 +1,248 @@
+"""Per-guild playback state. Every state transition runs in order on the player's own task."""
+
+import asyncio
+import collections
+import itertools
+import logging
+import time
+from dsp import DSPChain
+from mixer import Overlays
+
+logger = logging.getLogger(__name__)
+
+
+class FolderCursor:
+    """A folder queued with /play, expanded into tracks only as playback (or /queue) reaches them.
+
+    Holds the library's lazy walk of the folder, so queueing a folder of any size costs the same
+    in time and memory. `remaining` starts from the library's count for the folder; tracks added
+    or removed while it's queued are picked up or skipped as the walk reaches them.
+    """
+
+    __slots__ = ("folder", "remaining", "_tracks", "_lookahead")
+
+    def __init__(self, folder, tracks, count):
+        self.folder = folder
+        self.remaining = count
+        self._tracks = iter(tracks)
+        self._lookahead = collections.deque()  # tracks peeked at but not yet taken
+
+    def __len__(self):
+        return self.remaining
+
+    def peek(self, n):
+        """Return up to the next n tracks without taking them."""
+        while len(self._lookahead) < n:
+            track = next(self._tracks, None)
+            if track is None:
+                self.remaining = len(self._lookahead)
+                break
+            self._lookahead.append(track)
+        return list(itertools.islice(self._lookahead, n))
+
+    def take(self):
+        """Return the next track, or None once the folder is exhausted."""
+        if not self.peek(1):
+            return None
+        self.remaining = max(self.remaining - 1, len(self._lookahead) - 1)
+        return self._lookahead.popleft()
+
+
+class GuildPlayer:
+    """Queue, loop flag, current track and timestamp state for one guild.
+
+    The queue is a deque, so appending, popping, clearing, rotating and extending are all O(1)
+    (extend is O(k) in the number of new entries). Entries are track paths or FolderCursors;
+    pop_track(), peek_track() and upcoming() expand cursors as they reach them. Transitions are posted to an inbox and run one
+    at a time by the player's task: the voice thread posts with submit(), coroutines use call().
+    Reads (e.g. for /queue) can access attributes directly.
+    """
+
+    __slots__ = (
+        "guild_id", "queue", "looping", "current_track", "skip_requested", "next_start_offset",
+        "total_duration", "start_offset", "playback_start", "accumulated_pause", "pause_start",
+        "prefetched", "prefetch_task", "opening", "track_ended_at", "channel", "overlays", "dsp", "play_id", "_loop", "_inbox", "_task", "_closed",
+    )
+
+    def __init__(self, guild_id, loop):
+        self.guild_id = guild_id
+        self.queue = collections.deque()
+        self.looping = False
+        self.current_track = None  # full path of the playing track
+        self.skip_requested = False
+        self.next_start_offset = 0
+        self.total_duration = None
+        self.start_offset = 0
+        self.playback_start = None
+        self.accumulated_pause = 0
+        self.pause_start = None
+        self.prefetched = None  # (relative path, primed source) for the head of the queue
+        self.prefetch_task = None
+        self.opening = None  # task opening the track to play next off the player's task; None drops its result
+        self.track_ended_at = None  # perf_counter() when the last track ended, for transition gap metrics
+        self.channel = None  # text channel of the last /play, for status messages
+        self.overlays = Overlays()  # mixed over whatever track is playing
+        self.dsp = DSPChain()  # /volume and /eq
+        self.play_id = 0  # bumped each time a track starts, so a late after callback can be told apart
+        self._loop = loop
+        self._inbox = collections.deque()
+        self._task = None
+        self._closed = False
+
+    # --- Actor ---
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on the player's task without waiting. Safe to call from any thread."""
+        self._loop.call_soon_threadsafe(self._post, fn, args, None)
+
+    async def call(self, fn, *args):
+        """Run fn(*args) on the player's task and return its result. Must not be awaited from a transition."""
+        future = self._loop.create_future()
+        self._post(fn, args, future)
+        return await future
+
+    def _post(self, fn, args, future):
+        if self._closed:
+            # Late callbacks (e.g. the voice thread's after callback on disconnect) are dropped
+            if future is not None and not future.done():
+                future.cancel()
+            return
+        self._inbox.append((fn, args, future))
+        if self._task is None or self._task.done():
+            self._task = self._loop.create_task(self._run())
+
+    async def _run(self):
+        # Drain the inbox, then exit; _post starts a new task when more work arrives
+        while self._inbox:
+            fn, args, future = self._inbox.popleft()
+            try:
+                result = fn(*args)
+                if asyncio.iscoroutine(result):
+                    result = await result
+            except Exception as e:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+                else:
+                    logger.exception("Player transition %s failed: %s", getattr(fn, "__name__", fn), e, extra={"guild_id": self.guild_id})
+            else:
+                if future is not None and not future.done():
+                    future.set_result(result)
+
+    @property
+    def busy(self):
+        """Whether any transitions are queued or running, or a track is being opened."""
+        return bool(self._inbox) or (self._task is not None and not self._task.done()) or self.opening is not None
+
+    def close(self):
+        """Cancel pending work, drop any prefetched source and ignore anything posted afterwards."""
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+        for _fn, _args, future in self._inbox:
+            if future is not None and not future.done():
+                future.cancel()
+        self._inbox.clear()
+        self.opening = None
+        self.cancel_prefetch()
+        self.overlays.clear()
+
+    # --- Eviction ---
+
+    def snapshot(self):
+        """Settings worth restoring if the guild comes back soon after its player is evicted."""
+        return {"looping": self.looping, "dsp": self.dsp.snapshot()}
+
+    def restore(self, snapshot):
+        self.looping = snapshot.get("looping", False)
+        self.dsp.restore(snapshot.get("dsp", {}))
+
+    # --- Queue ---
+
+    def pop_track(self):
+        """Remove and return the next track in the queue, or None if it's empty."""
+        while self.queue:
+            head = self.queue[0]
+            if not isinstance(head, FolderCursor):
+                return self.queue.popleft()
+            track = head.take()
+            if not head.peek(1):
+                self.queue.popleft()
+            if track is not None:
+                return track
+        return None
+
+    def peek_track(self):
+        """Return the next track in the queue without removing it, or None."""
+        tracks = self.upcoming(1)
+        return tracks[0] if tracks else None
+
+    def upcoming(self, n):
+        """Return up to the next n tracks in the queue."""
+        tracks = []
+        for entry in self.queue:
+            if len(tracks) >= n:
+                break
+            if isinstance(entry, FolderCursor):
+                tracks.extend(entry.peek(n - len(tracks)))
+            else:
+                tracks.append(entry)
+        return tracks
+
+    def queue_length(self):
+        """Number of tracks queued, counting every track in queued folders."""
+        return sum(len(entry) if isinstance(entry, FolderCursor) else 1 for entry in self.queue)
+
+    # --- Prefetch ---
+
+    def cancel_prefetch(self):
+        """Drop any prefetched track; call whenever the head of the queue changes."""
+        if self.prefetch_task is not None:
+            self.prefetch_task.cancel()
+            self.prefetch_task = None
+        if self.prefetched is not None:
+            self.prefetched[1].cleanup()
+            self.prefetched = None
+
+    def take_prefetched(self, filename):
+        """Return the prefetched source if it's for this track, else None."""
+        if self.prefetched is None or self.prefetched[0] != filename:
+            return None
+        source = self.prefetched[1]
+        self.prefetched = None
+        if self.prefetch_task is not None:
+            self.prefetch_task.cancel()
+            self.prefetch_task = None
+        return source
+
+    # --- Timestamps ---
+
+    def reset_clock(self, offset=0, paused=False):
+        """Anchor elapsed time at `offset` seconds into the track, starting now."""
+        now = time.monotonic()
+        self.start_offset = offset
+        self.playback_start = now
+        self.accumulated_pause = 0
+        self.pause_start = now if paused else None
+
+    def pause_clock(self):
+        self.pause_start = time.monotonic()
+
+    def resume_clock(self):
+        if self.pause_start is not None:
+            self.accumulated_pause += time.monotonic() - self.pause_start
+            self.pause_start = None
+
+    def elapsed(self):
+        """Return current playback position in seconds (including start offset), or None."""
+        if self.playback_start is None:
+            return None
+        end = self.pause_start if self.pause_start is not None else time.monotonic()
+        return self.start_offset + end - self.playback_start - self.accumulated_pause
+
+    def clear_timestamps(self):
+        self.playback_start = None
+        self.total_duration = None
+        self.accumulated_pause = 0
+        self.pause_start = None
+        self.start_offset = 0
+        self.next_start_offset = 0
@@ -0,0 +1,270 @@
+"""Central bookkeeping for the ffmpeg and ffprobe processes the bot runs.
+
+Every decoder and probe takes a slot from the shared scheduler before it is spawned, so a burst
+of /play and /skipto across many guilds can't start more processes than the host can run. Work
+someone is waiting on (playback, seeks, lookups for the playing track) is admitted ahead of
+decoders opened early for the next track, and both ahead of background work (metadata warm-up),
+which also runs at a lower CPU priority. Each process is
+recorded against its guild for CPU and memory accounting, and anything still running when a
+guild stops or the bot exits is killed.
+"""
+
+import atexit
+import logging
+import os
+import subprocess
+import threading
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PLAYBACK = "playback"
+PREFETCH = "prefetch"  # a decoder for the next track; it plays at playback priority once admitted
+BACKGROUND = "background"
+
+try:
+    _CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _CLOCK_TICKS = _PAGE_SIZE = None
+
+
+class ProcessLimitError(RuntimeError):
+    """Raised when no process slot frees up in time."""
+
+
+def parse_cpus(spec):
+    """Parse a CPU list like "0-3,6" into a set of CPU numbers (None if empty)."""
+    cpus = set()
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus or None
+
+
+def _proc_usage(pid):
+    """Return (cpu seconds, rss bytes) for a live process from /proc, or None where unavailable."""
+    if _CLOCK_TICKS is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces, so split after its closing parenthesis
+    fields = stat[stat.rfind(b")") + 2:].split()
+    try:
+        return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS, int(fields[21]) * _PAGE_SIZE
+    except (IndexError, ValueError):
+        return None
+
+
+class Slot:
+    """One admitted process. attach() it once spawned; release() it (any number of times) once done."""
+
+    __slots__ = ("scheduler", "kind", "guild_id", "process", "cpu_seen", "rss", "_released")
+
+    def __init__(self, scheduler, kind, guild_id):
+        self.scheduler = scheduler
+        self.kind = kind
+        self.guild_id = guild_id
+        self.process = None
+        self.cpu_seen = 0.0  # CPU seconds already added to the guild's counter
+        self.rss = 0
+        self._released = False
+
+    def attach(self, process):
+        """Record the spawned process (None for stand-ins without one) and apply priority and affinity."""
+        self.process = process
+        if process is not None:
+            self.scheduler._tune(process.pid, self.kind)
+
+    def sample(self):
+        """Add CPU time used since the last sample to the guild's counter and refresh RSS."""
+        if self.process is None:
+            return
+        usage = _proc_usage(self.process.pid)
+        if usage is None:
+            return
+        cpu, self.rss = usage
+        if self.guild_id is not None and cpu > self.cpu_seen:
+            metrics.ffmpeg_cpu_seconds.inc(cpu - self.cpu_seen, guild=self.guild_id)
+        self.cpu_seen = max(cpu, self.cpu_seen)
+
+    def kill(self):
+        """Kill the process if it's still running. The owner (or release()) reaps it."""
+        process = self.process
+        if process is not None and process.poll() is None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def release(self, kill=False):
+        if self._released:
+            return
+        self._released = True
+        # Sample before the process is reaped, while /proc still has its final CPU time
+        self.sample()
+        if kill:
+            self.kill()
+            try:
+                if self.process is not None:
+                    self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                logger.warning("Process %s didn't exit after being killed.", self.process.pid)
+        self.scheduler._release(self)
+
+
+class ProcessScheduler:
+    """Admits decoders and probes up to global and background caps, playback first.
+
+    acquire() blocks, so call it off the event loop. Playback is admitted whenever fewer than
+    max_processes are running; prefetch additionally needs no playback waiting, and background
+    work a free background slot and no playback or prefetch waiting.
+    """
+
+    # Give up on a playback (or prefetch) slot after this long rather than leave a guild hanging
+    PLAYBACK_WAIT_SECONDS = 30
+
+    def __init__(self):
+        cpus = os.cpu_count() or 1
+        self.max_processes = cpus * 8
+        self.max_background = max(1, cpus // 2)
+        self.playback_nice = 0
+        self.background_nice = 10
+        self.cpus = None
+        self._slots = set()
+        self._waiting = {PLAYBACK: 0, PREFETCH: 0, BACKGROUND: 0}
+        self._cond = threading.Condition()
+
+    def configure(self, max_processes=None, max_background=None, playback_nice=None, background_nice=None, cpus=None):
+        with self._cond:
+            if max_processes:
+                self.max_processes = max(1, max_processes)
+            if max_background:
+                self.max_background = max(1, max_background)
+            if playback_nice is not None:
+                self.playback_nice = playback_nice
+            if background_nice is not None:
+                self.background_nice = background_nice
+            if cpus is not None:
+                self.cpus = cpus
+            self._cond.notify_all()
+
+    def _count(self, kind=None):
+        return sum(1 for slot in self._slots if kind is None or slot.kind == kind)
+
+    def _admissible(self, kind):
+        if self._count() >= self.max_processes:
+            return False
+        if kind == BACKGROUND:
+            return not self._waiting[PLAYBACK] and not self._waiting[PREFETCH] and self._count(BACKGROUND) < self.max_background
+        if kind == PREFETCH:
+            return not self._waiting[PLAYBACK]
+        return True
+
+    def acquire(self, kind=PLAYBACK, guild_id=None, timeout=None):
+        """Wait for a slot and return it. Raises ProcessLimitError if playback or prefetch waits longer than PLAYBACK_WAIT_SECONDS."""
+        if timeout is None and kind != BACKGROUND:
+            timeout = self.PLAYBACK_WAIT_SECONDS
+        started = time.perf_counter()
+        with self._cond:
+            self._waiting[kind] += 1
+            try:
+                if not self._cond.wait_for(lambda: self._admissible(kind), timeout):
+                    raise ProcessLimitError(f"No {kind} process slot free after {timeout:.0f}s")
+                slot = Slot(self, kind, guild_id)
+                self._slots.add(slot)
+            finally:
+                self._waiting[kind] -= 1
+                # A playback or prefetch waiter leaving may unblock lower-priority work
+                self._cond.notify_all()
+        metrics.process_wait.observe(time.perf_counter() - started, kind=kind)
+        return slot
+
+    def _release(self, slot):
+        with self._cond:
+            self._slots.discard(slot)
+            self._cond.notify_all()
+
+    def _tune(self, pid, kind):
+        nice = self.background_nice if kind == BACKGROUND else self.playback_nice
+        try:
+            if nice and hasattr(os, "setpriority"):
+                os.setpriority(os.PRIO_PROCESS, pid, nice)
+            if self.cpus and hasattr(os, "sched_setaffinity"):
+                os.sched_setaffinity(pid, self.cpus)
+        except OSError as e:
+            # e.g. the process already exited, or a negative nice without permission
+            logger.debug("Couldn't set priority/affinity of process %s: %s", pid, e)
+
+    def run(self, args, kind=BACKGROUND, guild_id=None, timeout=None):
+        """subprocess.run() equivalent (text output captured) that runs inside a slot."""
+        slot = self.acquire(kind, guild_id)
+        try:
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            slot.attach(process)
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                raise
+            return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+        finally:
+            slot.release()
+
+    def guild_slots(self, guild_id):
+        """Slots currently held for a guild."""
+        with self._cond:
+            return [slot for slot in self._slots if slot.guild_id == guild_id]
+
+    def kill(self, slots):
+        """Kill and release the given slots' processes. Blocking; run off the event loop."""
+        for slot in slots:
+            slot.release(kill=True)
+
+    def kill_guild(self, guild_id):
+        """Kill every process still running for a guild. Returns how many there were."""
+        slots = self.guild_slots(guild_id)
+        self.kill(slots)
+        if slots:
+            logger.debug("Killed %d leftover process(es)", len(slots), extra={"guild_id": guild_id})
+        return len(slots)
+
+    def shutdown(self):
+        """Kill every managed process, e.g. when the bot exits."""
+        with self._cond:
+            slots = list(self._slots)
+        for slot in slots:
+            slot.release(kill=True)
+
+    def usage(self):
+        """Sample every live process; return {guild ID: (processes, rss bytes)} for playback."""
+        with self._cond:
+            slots = list(self._slots)
+        by_guild = {}
+        for slot in slots:
+            slot.sample()
+            if slot.guild_id is None:
+                continue
+            count, rss = by_guild.get(slot.guild_id, (0, 0))
+            by_guild[slot.guild_id] = (count + 1, rss + slot.rss)
+        return by_guild
+
+    def counts(self):
+        with self._cond:
+            return {kind: self._count(kind) for kind in (PLAYBACK, PREFETCH, BACKGROUND)}
+
+
+scheduler = ProcessScheduler()
+atexit.register(scheduler.shutdown)
+
+# Sampling for the RSS gauge also brings the per-guild CPU counters up to date
+metrics.ffmpeg_rss_bytes.callback = lambda: {(guild_id,): rss for guild_id, (_, rss) in scheduler.usage().items()}
+metrics.ffmpeg_processes.callback = lambda: {(kind,): n for kind, n in scheduler.counts().items()}
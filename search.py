@@ -0,0 +1,128 @@
+"""Prefix and fuzzy (trigram) search over relative audio paths, used for autocomplete."""
+
+import array
+import bisect
+import collections
+import posixpath
+import re
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _search_text(path):
+    # Extensions are shared by most entries, so they'd only add noise to fuzzy matches;
+    # separators are folded to spaces so "rain loop" matches "rain_loop"
+    return re.sub(r"[\W_]+", " ", posixpath.splitext(path)[0].lower()).strip()
+
+
+class SearchIndex:
+    """Ranked path search: basename prefix, then full-path prefix, then trigram similarity.
+
+    Prefix lookups bisect two sorted key lists (a flattened trie with the same O(log n + k)
+    lookups and far less memory). Trigram postings are compact arrays of integer ids; removed
+    paths leave a tombstone until the next rebuild().
+    """
+
+    def __init__(self):
+        self._names = []  # sorted (lowercase basename, path)
+        self._paths = []  # sorted (lowercase path, path)
+        self._ids = {}  # path -> id
+        self._by_id = []  # id -> path, or None once removed
+        self._postings = collections.defaultdict(lambda: array.array("I"))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def rebuild(self, paths):
+        """Replace the index contents with `paths`."""
+        self._names = []
+        self._paths = []
+        self._ids = {}
+        self._by_id = []
+        self._postings = collections.defaultdict(lambda: array.array("I"))
+        for path in paths:
+            self._index(path)
+        self._names.sort()
+        self._paths.sort()
+
+    def add(self, path):
+        if path in self._ids:
+            return
+        self._index(path, insort=True)
+
+    def remove(self, path):
+        path_id = self._ids.pop(path, None)
+        if path_id is None:
+            return
+        self._by_id[path_id] = None
+        for keys, key in ((self._names, (posixpath.basename(path).lower(), path)), (self._paths, (path.lower(), path))):
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def _index(self, path, insort=False):
+        path_id = len(self._by_id)
+        self._by_id.append(path)
+        self._ids[path] = path_id
+        name_key = (posixpath.basename(path).lower(), path)
+        path_key = (path.lower(), path)
+        if insort:
+            bisect.insort(self._names, name_key)
+            bisect.insort(self._paths, path_key)
+        else:
+            self._names.append(name_key)
+            self._paths.append(path_key)
+        for trigram in _trigrams(_search_text(path)):
+            self._postings[trigram].append(path_id)
+
+    def search(self, query, limit=25):
+        """Return up to `limit` paths ranked by how well they match `query` (case-insensitive)."""
+        query = query.strip().replace("\\", "/").lower()
+        if not query:
+            return [path for _key, path in self._paths[:limit]]
+        results = []
+        seen = set()
+
+        def _take(paths):
+            for path in paths:
+                if path not in seen:
+                    seen.add(path)
+                    results.append(path)
+                    if len(results) >= limit:
+                        return True
+            return False
+
+        if _take(self._prefix(self._names, query)) or _take(self._prefix(self._paths, query)):
+            return results
+        _take(self._fuzzy(query, limit))
+        return results
+
+    @staticmethod
+    def _prefix(keys, prefix):
+        i = bisect.bisect_left(keys, (prefix,))
+        while i < len(keys) and keys[i][0].startswith(prefix):
+            yield keys[i][1]
+            i += 1
+
+    def _fuzzy(self, query, limit):
+        query_trigrams = _trigrams(_search_text(query))
+        counts = collections.Counter()
+        for trigram in query_trigrams:
+            postings = self._postings.get(trigram)
+            if postings:
+                counts.update(postings)
+        # Require at least a third of the query's trigrams so unrelated paths aren't suggested
+        threshold = len(query_trigrams) / 3
+        scored = []
+        for path_id, shared in counts.most_common(limit * 8):
+            path = self._by_id[path_id]
+            if path is None or shared < threshold:
+                continue
+            # Jaccard similarity of trigram sets; path trigram count follows from its length
+            path_count = len(_search_text(path)) + 1
+            scored.append((shared / (len(query_trigrams) + path_count - shared), path))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [path for _score, path in scored[:limit]]
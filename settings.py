@@ -0,0 +1,212 @@
+"""Bot settings stored in settings.json, cached in memory with optional per-guild overrides."""
+
+import asyncio
+import contextlib
+import copy
+import json
+import logging
+import os
+import tempfile
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    # watchdog is optional; without it external edits are picked up by polling
+    Observer = None
+    FileSystemEventHandler = object
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """Hold an exclusive lock on `path` (created if missing) across processes."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _apply(data, guild_id, key, value):
+    if guild_id is None:
+        data[key] = value
+    else:
+        data.setdefault("guilds", {}).setdefault(str(guild_id), {})[key] = value
+
+
+class Settings:
+    """In-memory view of settings.json.
+
+    Top-level keys are global settings; the "guilds" key maps guild IDs to overrides. Reads never
+    touch disk. Changes are written by a single background save, debounced so a burst of updates
+    becomes one write, and written atomically (temp file + rename) so the file is never half-written.
+    Saves apply only this process's changes on top of the file as it is on disk, so cluster workers
+    sharing one settings.json don't overwrite each other. External edits to the file are reloaded.
+    """
+
+    DEFAULTS = {"results_default": 12}
+    POLL_SECONDS = 5
+
+    def __init__(self, path, debounce_seconds=1.0):
+        self.path = os.path.abspath(path)
+        self.debounce_seconds = debounce_seconds
+        self._data = {}
+        self._lock = threading.Lock()
+        self._pending = {}  # (guild_id or None, key) -> value, changed since the last save
+        self._save_task = None
+        self._watch_task = None
+        self._observer = None
+        self._last_mtime = None
+
+    def load(self):
+        """Read settings.json into memory. Blocking, but the file is tiny; a missing or invalid file keeps the current values."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            mtime = os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Failed to load %s; keeping current settings: %s", os.path.basename(self.path), e)
+            return
+        if not isinstance(data, dict):
+            logger.warning("%s isn't a JSON object; keeping current settings.", os.path.basename(self.path))
+            return
+        with self._lock:
+            self._data = data
+            self._last_mtime = mtime
+
+    def get(self, key, guild_id=None):
+        """Return the guild's override if set, else the global value, else the built-in default."""
+        data = self._data
+        if guild_id is not None:
+            guild = data.get("guilds", {}).get(str(guild_id), {})
+            if key in guild:
+                return guild[key]
+        return data.get(key, self.DEFAULTS.get(key))
+
+    def set(self, key, value, guild_id=None):
+        """Update a setting (for one guild if guild_id is given) and schedule a save. Call from the event loop."""
+        with self._lock:
+            data = copy.deepcopy(self._data)
+            _apply(data, guild_id, key, value)
+            self._data = data
+            self._pending[(guild_id, key)] = value
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.debounce_seconds)
+        await self.flush()
+
+    async def flush(self):
+        """Write pending changes now, off the event loop."""
+        with self._lock:
+            if not self._pending:
+                return
+            changes = self._pending
+            self._pending = {}
+        try:
+            await asyncio.to_thread(self._write, changes)
+        except OSError as e:
+            logger.warning("Failed to save %s: %s", os.path.basename(self.path), e)
+            with self._lock:
+                # Keep anything set again while this save was in flight
+                self._pending = {**changes, **self._pending}
+
+    def _write(self, changes):
+        with _file_lock(f"{self.path}.lock"):
+            self._merge_and_write(changes)
+
+    def _merge_and_write(self, changes):
+        # Start from the file on disk so changes saved by other processes are kept
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except (OSError, ValueError):
+            data = None
+        if not isinstance(data, dict):
+            data = copy.deepcopy(self._data)
+        for (guild_id, key), value in changes.items():
+            _apply(data, guild_id, key, value)
+        # Unique temp name, since other processes may be saving the same file
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=os.path.dirname(self.path))
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            # Re-apply anything set while writing so it isn't lost from memory before the next save
+            for (guild_id, key), value in self._pending.items():
+                _apply(data, guild_id, key, value)
+            self._data = data
+            self._last_mtime = os.path.getmtime(self.path)
+
+    def _reload_if_changed(self):
+        # Skip our own writes, and don't clobber changes that haven't been saved yet
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        with self._lock:
+            if mtime == self._last_mtime or self._pending:
+                return
+        logger.info("%s changed on disk; reloading.", os.path.basename(self.path))
+        self.load()
+
+    def start_watching(self):
+        """Reload on external edits: via watchdog if installed, else by polling the file's mtime."""
+        if Observer is not None:
+            observer = Observer()
+            observer.schedule(_SettingsEventHandler(self), os.path.dirname(self.path), recursive=False)
+            observer.daemon = True
+            observer.start()
+            self._observer = observer
+        else:
+            self._watch_task = asyncio.create_task(self._poll())
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.POLL_SECONDS)
+            await asyncio.to_thread(self._reload_if_changed)
+
+    async def close(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+        await self.flush()
+
+
+class _SettingsEventHandler(FileSystemEventHandler):
+    def __init__(self, settings):
+        super().__init__()
+        self.settings = settings
+
+    def on_any_event(self, event):
+        paths = (getattr(event, "src_path", None), getattr(event, "dest_path", None))
+        if any(p and os.path.abspath(os.fsdecode(p)) == self.settings.path for p in paths):
+            self.settings._reload_if_changed()
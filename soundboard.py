@@ -0,0 +1,179 @@
+"""Sound effects held in memory as Opus packets, for /sfx."""
+
+import array
+import collections
+import itertools
+import os
+import tempfile
+import threading
+import discord
+import metrics
+import processes
+from sources import FRAME_LENGTH, OggOpusReader
+from transcode import OpusCache, transcode
+
+
+class Clip:
+    """A clip's Opus packets, stored end to end in one bytes object with their offsets."""
+
+    __slots__ = ("data", "offsets", "gain_db")
+
+    def __init__(self, packets, gain_db=0):
+        self.data = b"".join(packets)
+        self.offsets = array.array("I", itertools.accumulate(map(len, packets), initial=0))
+        self.gain_db = gain_db
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def duration(self):
+        return len(self) * FRAME_LENGTH
+
+    @property
+    def nbytes(self):
+        return len(self.data) + self.offsets.itemsize * len(self.offsets)
+
+    def packet(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]]
+
+
+def read_clip(file_path, gain_db=0, opus_path=None, max_seconds=None, kind=processes.BACKGROUND):
+    """Load a clip's packets from opus_path, or by transcoding file_path. Returns None if it fails or runs past max_seconds."""
+    tmp_path = None
+    if opus_path is None:
+        fd, tmp_path = tempfile.mkstemp(suffix=".opus")
+        os.close(fd)
+        if not transcode(file_path, tmp_path, gain_db, OpusCache.BITRATE, kind):
+            os.remove(tmp_path)
+            return None
+        opus_path = tmp_path
+    limit = int(max_seconds / FRAME_LENGTH) if max_seconds else None
+    try:
+        reader = OggOpusReader(opus_path)
+        try:
+            packets = list(itertools.islice(iter(reader.read, b""), limit + 1 if limit else None))
+        finally:
+            reader.cleanup()
+    except OSError:
+        return None
+    finally:
+        if tmp_path is not None:
+            os.remove(tmp_path)
+    if not packets or (limit and len(packets) > limit):
+        return None
+    return Clip(packets, gain_db)
+
+
+class ClipSource(discord.AudioSource):
+    """Plays a clip from memory: its Opus packets as they are, or decoded to PCM (e.g. to mix as an overlay)."""
+
+    def __init__(self, clip, decode=False):
+        self.clip = clip
+        self._index = 0
+        self._decoder = discord.opus.Decoder() if decode else None
+
+    def read(self):
+        if self._index >= len(self.clip):
+            return b""
+        packet = self.clip.packet(self._index)
+        self._index += 1
+        return self._decoder.decode(packet) if self._decoder else packet
+
+    def is_opus(self):
+        return self._decoder is None
+
+    def cleanup(self):
+        self._index = len(self.clip)
+
+
+class ClipCache:
+    """Clips from the sound effect folders, evicted least recently used first past max_bytes.
+
+    Clips are encoded once (or read from the Opus cache when it has them) at the track's
+    normalization gain; a clip cached at another gain counts as a miss and is reloaded. Clips
+    longer than MAX_CLIP_SECONDS aren't cached. get() only touches memory; load() and preload()
+    may run ffmpeg, so run them off the event loop.
+    """
+
+    MAX_CLIP_SECONDS = 30
+
+    def __init__(self, audio_folder, max_bytes, opus_cache=None):
+        self.audio_folder = audio_folder
+        self.max_bytes = max_bytes
+        self.opus_cache = opus_cache
+        self._clips = collections.OrderedDict()  # relative path -> Clip, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def get(self, rel, gain_db=0):
+        """Return the cached clip at this gain, or None."""
+        with self._lock:
+            clip = self._clips.get(rel)
+            if clip is not None and clip.gain_db == OpusCache.round_gain(gain_db):
+                self._clips.move_to_end(rel)
+            else:
+                clip = None
+        metrics.sfx_cache_lookups.inc(result="hit" if clip else "miss")
+        return clip
+
+    def load(self, rel, gain_db=0, kind=processes.BACKGROUND, evict=True):
+        """Encode a clip at this gain and cache it. Returns the clip, or None if it can't be used.
+
+        Without evict, a clip that doesn't fit in the space left isn't cached (but is still returned).
+        """
+        gain_db = OpusCache.round_gain(gain_db)
+        opus_path = self.opus_cache.lookup(rel, gain_db) if self.opus_cache else None
+        clip = read_clip(os.path.join(self.audio_folder, rel), gain_db, opus_path, self.MAX_CLIP_SECONDS, kind)
+        if clip is not None:
+            self._put(rel, clip, evict)
+        return clip
+
+    def preload(self, paths, gain_for):
+        """Load clips that aren't cached at their current gain until the cache is full. Returns how many were loaded.
+
+        Stops at max_bytes rather than evicting, so a folder bigger than the cache doesn't churn on every pass.
+        """
+        loaded = 0
+        for rel in paths:
+            gain_db = OpusCache.round_gain(gain_for(rel))
+            with self._lock:
+                cached = self._clips.get(rel)
+                if cached is not None and cached.gain_db == gain_db:
+                    continue
+            clip = self.load(rel, gain_db, evict=False)
+            if clip is None:
+                continue
+            if self._clips.get(rel) is not clip:
+                break  # full
+            loaded += 1
+        return loaded
+
+    def _put(self, rel, clip, evict=True):
+        with self._lock:
+            old = self._clips.pop(rel, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            if clip.nbytes > (self.max_bytes if evict else self.max_bytes - self._bytes):
+                return
+            self._clips[rel] = clip
+            self._bytes += clip.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._clips.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def prune(self, keep):
+        """Drop clips that are no longer in a sound effect folder."""
+        keep = set(keep)
+        with self._lock:
+            for rel in [rel for rel in self._clips if rel not in keep]:
+                self._bytes -= self._clips.pop(rel).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._clips.clear()
+            self._bytes = 0
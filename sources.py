@@ -0,0 +1,462 @@
+"""Audio sources used by the audio cog's player."""
+
+import collections
+import mmap
+import struct
+import tempfile
+import threading
+import time
+import discord
+import metrics
+import processes
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional; without it only 48 kHz 16-bit stereo WAVs skip ffmpeg
+    np = None
+
+# 20 ms of 48 kHz 16-bit stereo PCM, the unit discord.py reads from a source
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+FRAME_LENGTH = discord.opus.Encoder.FRAME_LENGTH / 1000
+# Samples per 20 ms Opus packet, as written by the transcode cache
+PACKET_SAMPLES = discord.opus.Encoder.SAMPLES_PER_FRAME
+SAMPLE_RATE = discord.opus.Encoder.SAMPLING_RATE
+
+_WAVE_PCM = 1
+_WAVE_FLOAT = 3
+_WAVE_EXTENSIBLE = 0xFFFE
+
+WavFormat = collections.namedtuple("WavFormat", ["tag", "channels", "rate", "width", "data_offset", "data_size"])
+
+
+def read_wav_format(file_path):
+    """Return the WavFormat of an integer or float PCM WAV file, or None if it isn't one."""
+    try:
+        with open(file_path, "rb") as f:
+            riff = f.read(12)
+            if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:] != b"WAVE":
+                return None
+            file_size = f.seek(0, 2)
+            offset = 12
+            fmt = None
+            while offset + 8 <= file_size:
+                f.seek(offset)
+                chunk_id, chunk_size = struct.unpack("<4sI", f.read(8))
+                if chunk_id == b"fmt ":
+                    fmt = f.read(min(chunk_size, 40))
+                elif chunk_id == b"data" and fmt is not None and len(fmt) >= 16:
+                    tag, channels, rate, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+                    if tag == _WAVE_EXTENSIBLE and len(fmt) >= 26:
+                        tag = struct.unpack("<H", fmt[24:26])[0]  # first two bytes of the subformat GUID
+                    width = bits // 8
+                    if not channels or not rate or bits % 8 or (tag, width) not in (
+                        (_WAVE_PCM, 1), (_WAVE_PCM, 2), (_WAVE_PCM, 3), (_WAVE_PCM, 4), (_WAVE_FLOAT, 4), (_WAVE_FLOAT, 8)
+                    ):
+                        return None
+                    # Streamed WAVs may leave the size unset; the data then runs to the end of the file
+                    size = min(chunk_size, file_size - offset - 8)
+                    return WavFormat(tag, channels, rate, width, offset + 8, size - size % (channels * width))
+                offset += 8 + chunk_size + chunk_size % 2
+    except (OSError, struct.error):
+        return None
+    return None
+
+
+class WavReader:
+    """Serves PCM frames straight from a WAV file through mmap, without ffmpeg.
+
+    A 48 kHz 16-bit stereo file at unity gain is sliced into frames as it is. Anything else (other
+    rates, sample formats or channel counts, or a gain) is converted a frame at a time with NumPy:
+    mono is doubled, surround keeps its front pair, and the rate is changed by linear interpolation. Seeking is
+    offset arithmetic, so starting anywhere in the file costs nothing.
+    Decoder interface (read/cleanup) matches discord.FFmpegPCMAudio.
+    """
+
+    def __init__(self, path, wav, offset=0, gain_db=0):
+        self.wav = wav
+        self._gain = 10 ** (gain_db / 20) if abs(gain_db) >= 0.1 else 1.0
+        self._native = (wav.tag, wav.channels, wav.rate, wav.width) == (_WAVE_PCM, 2, SAMPLE_RATE, 2) and self._gain == 1.0
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._block = wav.channels * wav.width
+        self._samples = wav.data_size // self._block
+        self._step = wav.rate / SAMPLE_RATE  # source samples per output sample
+        self._frame = round(offset / FRAME_LENGTH)  # next output frame
+
+    @staticmethod
+    def supported(wav, gain_db=0):
+        """Whether a file in this format can be played without ffmpeg (conversion needs numpy)."""
+        native = (wav.tag, wav.channels, wav.rate, wav.width) == (_WAVE_PCM, 2, SAMPLE_RATE, 2) and abs(gain_db) < 0.1
+        return native or np is not None
+
+    def read(self):
+        if self._map is None:
+            return b""
+        if self._native:
+            start = self.wav.data_offset + self._frame * FRAME_SIZE
+            end = self.wav.data_offset + self.wav.data_size
+            if start >= end:
+                return b""
+            self._frame += 1
+            data = self._map[start:min(start + FRAME_SIZE, end)]
+            return data if len(data) == FRAME_SIZE else data + b"\0" * (FRAME_SIZE - len(data))
+        return self._convert()
+
+    def _samples_at(self, first, count):
+        """Source samples [first, first + count) as float32 (count, channels) in 16-bit range."""
+        wav = self.wav
+        start = wav.data_offset + first * self._block
+        raw = memoryview(self._map)[start:start + count * self._block]
+        try:
+            if wav.tag == _WAVE_FLOAT:
+                samples = np.frombuffer(raw, dtype="<f4" if wav.width == 4 else "<f8").astype(np.float32) * 32767
+            elif wav.width == 1:
+                samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) * 256
+            elif wav.width == 3:
+                # Widen each 24-bit sample to the top of an int32, then scale back down
+                wide = np.zeros((len(raw) // 3, 4), dtype=np.uint8)
+                wide[:, 1:] = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+                samples = wide.view("<i4").ravel().astype(np.float32) / 65536
+            else:
+                samples = np.frombuffer(raw, dtype="<i2" if wav.width == 2 else "<i4").astype(np.float32)
+                if wav.width == 4:
+                    samples /= 65536
+        finally:
+            raw.release()
+        return samples.reshape(-1, wav.channels)
+
+    def _convert(self):
+        # Output sample n comes from source position n * step; frames are computed independently,
+        # so seeking and long tracks don't accumulate error
+        first = self._frame * PACKET_SAMPLES * self._step
+        if first >= self._samples:
+            return b""
+        self._frame += 1
+        positions = first + np.arange(PACKET_SAMPLES) * self._step
+        base = int(first)
+        count = min(int(positions[-1]) + 2, self._samples) - base
+        samples = self._samples_at(base, count)
+        if samples.shape[1] == 1:
+            samples = np.repeat(samples, 2, axis=1)
+        elif samples.shape[1] > 2:
+            samples = samples[:, :2]  # front left and right
+        if self._step != 1.0:
+            index = positions - base
+            low = np.minimum(index.astype(np.int64), count - 1)
+            high = np.minimum(low + 1, count - 1)
+            frac = (index - low).astype(np.float32)[:, None]
+            samples = samples[low] * (1 - frac) + samples[high] * frac
+            # Past the end of the data the last sample repeats; silence it instead
+            samples[positions >= self._samples] = 0
+        else:
+            samples = samples[:PACKET_SAMPLES]
+        if len(samples) < PACKET_SAMPLES:
+            samples = np.pad(samples, ((0, PACKET_SAMPLES - len(samples)), (0, 0)))
+        if self._gain != 1.0:
+            samples = samples * self._gain
+        return np.clip(samples, -32768, 32767).astype(np.int16).tobytes()
+
+    def cleanup(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+
+class OggOpusReader:
+    """Reads Opus packets straight from an Ogg Opus file, without ffmpeg.
+
+    Used for files from the transcode cache, whose packets are all 20 ms, so a packet is a frame.
+    Decoder interface (read/cleanup) matches discord.FFmpegOpusAudio.
+
+    Packets are passed on whole, so the encoder's pre-skip (OpusHead, ~6.5 ms) and the padding
+    trimmed by the final granule position are played rather than dropped as a decoder would, and
+    positions are off by that much compared with ffmpeg. Dropping them would mean decoding and
+    re-encoding the first packet of every play and seek.
+    """
+
+    def __init__(self, path, offset=0):
+        self._file = open(path, "rb")
+        self._packets = self._iter_packets(round(offset / FRAME_LENGTH) * PACKET_SAMPLES)
+
+    def _iter_packets(self, start_sample):
+        headers = 2  # OpusHead and OpusTags aren't audio
+        sample = 0
+        partial = b""
+        while self._file.read(4) == b"OggS":
+            page = discord.oggparse.OggPage(self._file)
+            # Whole pages before the start are skipped using their granule position
+            if not headers and not partial and page.gran_pos <= start_sample and page.segtable[-1:] != b"\xff":
+                sample = page.gran_pos
+                continue
+            for data, complete in page.iter_packets():
+                partial += data
+                if not complete:
+                    continue
+                packet, partial = partial, b""
+                if headers:
+                    headers -= 1
+                    continue
+                sample += PACKET_SAMPLES
+                if sample > start_sample:
+                    yield packet
+
+    def read(self):
+        return next(self._packets, b"")
+
+    def cleanup(self):
+        self._file.close()
+
+
+class TrackSource(discord.AudioSource):
+    """Source for one track: PCM decoded by ffmpeg or read from a WAV file, or Opus packets from the transcode cache.
+
+    The decoder is spawned on construction. prime() decodes the first frames ahead of time, so a
+    prefetched track can start on the very next frame once the previous one ends.
+
+    If should_loop() is true when playback starts from the beginning, decoded frames are also kept
+    in a buffer (in memory, spilling to disk past LOOP_MEMORY_BYTES). When the pass ends and
+    should_loop() is still true, the buffer is replayed without restarting ffmpeg, calling
+    on_loop() at the start of each repeat. Tracks longer than LOOP_MAX_BYTES aren't buffered and
+    end normally, so the caller streams the repeat as before.
+
+    seek() moves playback without replacing the source: the last HISTORY_SECONDS of played frames
+    are kept so short rewinds come from memory, short forward seeks decode ahead, and anything
+    further restarts ffmpeg with an input seek to the exact frame.
+
+    Each decoder runs in a process slot from the shared scheduler (see processes.py), so
+    constructing a source or seeking may block until one is free; do both off the event loop.
+    A source opened ahead of time passes kind=processes.PREFETCH so it waits for playback; its
+    later restarts (seeks, loops) are playback.
+
+    With opus_path (a file from transcode.OpusCache), packets are read from it directly and
+    passed to Discord as they are: no decode, no encode and no process. Otherwise PCM WAV files
+    are read in-process through WavReader. Either way seeks reopen the file, and loops restart
+    it in place instead of buffering.
+    """
+
+    LOOP_MEMORY_BYTES = 16 * 1024 * 1024  # ~1.5 minutes of PCM
+    LOOP_MAX_BYTES = 256 * 1024 * 1024  # ~23 minutes of PCM
+    HISTORY_SECONDS = 15
+    FORWARD_DECODE_SECONDS = 10
+
+    def __init__(self, file_path, start_offset=0, should_loop=None, on_loop=None, guild_id=None, gain_db=0, opus_path=None,
+                 kind=processes.PLAYBACK):
+        self.file_path = file_path
+        self.guild_id = guild_id
+        self.gain_db = gain_db
+        self.opus_path = opus_path
+        self.start_offset = start_offset
+        wav = read_wav_format(file_path) if not opus_path and file_path.lower().endswith(".wav") else None
+        self._wav = wav if wav is not None and WavReader.supported(wav, gain_db) else None
+        self._should_loop = should_loop or (lambda: False)
+        self._on_loop = on_loop
+        self._decoder = None
+        # Set before spawning, which may raise (e.g. no process slot), so cleanup() works on a half-made source
+        self._lock = threading.Lock()
+        self._buffer = None
+        self._closed = False
+        self._install(*self._spawn(start_offset, kind))
+        self._pending = collections.deque()  # decoded but not yet played
+        self._history = collections.deque(maxlen=int(self.HISTORY_SECONDS / FRAME_LENGTH))
+        self._frame = 0  # frames played since start_offset
+        self._started = False
+        self._replaying = False
+
+    def _spawn(self, offset, kind=processes.PLAYBACK):
+        """Start a decoder at offset. Returns (decoder, process slot or None); see _install()."""
+        if self.opus_path:
+            return OggOpusReader(self.opus_path, offset), None
+        if self._wav is not None:
+            return WavReader(self.file_path, self._wav, offset, self.gain_db), None
+        before_options = f"-ss {offset:.3f}" if offset else None
+        # Loudness normalization is a fixed gain (precomputed in metadata.py), far cheaper than loudnorm
+        options = f"-af volume={self.gain_db:.2f}dB" if abs(self.gain_db) >= 0.1 else None
+        slot = processes.scheduler.acquire(kind, self.guild_id)
+        try:
+            decoder = discord.FFmpegPCMAudio(self.file_path, executable="ffmpeg", before_options=before_options, options=options)
+        except BaseException:
+            slot.release()
+            raise
+        slot.attach(getattr(decoder, "_process", None))
+        metrics.ffmpeg_active.inc()
+        return decoder, slot
+
+    def _install(self, decoder, slot):
+        self._decoder = decoder
+        self._slot = slot
+        self._spawned_at = time.perf_counter() if slot is not None else None
+
+    @property
+    def _in_process(self):
+        """Whether the track is read without ffmpeg, so restarting it spawns nothing."""
+        return bool(self.opus_path) or self._wav is not None
+
+    @staticmethod
+    def _close(decoder, slot):
+        if slot is None:
+            decoder.cleanup()
+            return
+        # Sampled for CPU accounting before cleanup() kills and reaps the process
+        slot.sample()
+        decoder.cleanup()
+        slot.release()
+        metrics.ffmpeg_active.dec()
+
+    def _close_decoder(self):
+        # Each decoder is counted down exactly once, however many times cleanup runs
+        if self._decoder is not None:
+            self._close(self._decoder, self._slot)
+            self._decoder = None
+            self._slot = None
+
+    @property
+    def position(self):
+        """Current playback position in seconds from the start of the track."""
+        if self._replaying:
+            return self._buffer.tell() // FRAME_SIZE * FRAME_LENGTH
+        return self.start_offset + self._frame * FRAME_LENGTH
+
+    def prime(self, frames=50):
+        """Decode up to `frames` frames into memory. Blocking; run off the event loop."""
+        with self._lock:
+            for _ in range(frames - len(self._pending)):
+                data = self._decode()
+                if not data:
+                    break
+                self._pending.append(data)
+
+    def _decode(self):
+        if self._decoder is None:
+            return b''
+        data = self._decoder.read()
+        if data and self._spawned_at is not None:
+            metrics.ffmpeg_first_frame.observe(time.perf_counter() - self._spawned_at)
+            self._spawned_at = None
+        if data and self._buffer is not None:
+            self._record(data)
+        return data
+
+    def read(self):
+        with self._lock:
+            if self._replaying:
+                return self._read_buffer()
+            if not self._started:
+                self._started = True
+                if not self.start_offset and self._should_loop() and not self._in_process:
+                    self._buffer = tempfile.SpooledTemporaryFile(max_size=self.LOOP_MEMORY_BYTES)
+                    # Frames decoded by prime() came before the buffer existed; they start the pass
+                    for data in self._pending:
+                        self._record(data)
+            data = self._pending.popleft() if self._pending else self._decode()
+            if data:
+                self._history.append(data)
+                self._frame += 1
+                return data
+            # Decoder finished; reading in-process, reopening the file is as cheap as a buffer
+            if self._in_process and self._frame and self._should_loop():
+                self._close_decoder()
+                self._install(*self._spawn(0))
+                self.start_offset = 0
+                self._frame = 0
+                self._pending.clear()
+                self._history.clear()
+                if self._on_loop:
+                    self._on_loop()
+                data = self._decode()
+                if data:
+                    self._history.append(data)
+                    self._frame += 1
+                return data
+            # Decoder finished; replay the buffered pass if looping is (still) on
+            if self._buffer is not None and self._buffer.tell() and self._should_loop():
+                self._close_decoder()
+                self._replaying = True
+                self._pending.clear()
+                self._history.clear()
+                return self._restart_buffer()
+            return b''
+
+    def seek(self, seconds):
+        """Move playback to `seconds` from the start of the track. Blocking; run off the event loop."""
+        target = max(0, round(seconds / FRAME_LENGTH))
+        with self._lock:
+            if self._closed:
+                return
+            if self._replaying:
+                self._buffer.seek(0, 2)
+                self._buffer.seek(min(target * FRAME_SIZE, self._buffer.tell()))
+                return
+            current = round(self.start_offset / FRAME_LENGTH) + self._frame
+            if target < current and current - target <= len(self._history):
+                # Rewind from memory: played frames go back in front of the pending ones
+                for _ in range(current - target):
+                    self._pending.appendleft(self._history.pop())
+                self._frame -= current - target
+                return
+            if target > current and target - current <= self.FORWARD_DECODE_SECONDS / FRAME_LENGTH and not self._in_process:
+                # Short forward seek: decode ahead and discard
+                for _ in range(target - current):
+                    data = self._pending.popleft() if self._pending else self._decode()
+                    if not data:
+                        break
+                    self._history.append(data)
+                    self._frame += 1
+                return
+            if target == current:
+                return
+        # Restart the decoder at the exact frame. It's started outside the lock, since it may wait
+        # for a process slot, so the voice thread keeps playing the old one until it's swapped in
+        decoder, slot = self._spawn(target * FRAME_LENGTH)
+        with self._lock:
+            if self._closed or self._replaying:
+                # Stopped, or the track ended and is replaying from its buffer, in the meantime
+                old, replaying = (decoder, slot), self._replaying and not self._closed
+            else:
+                old, replaying = (self._decoder, self._slot), False
+                self._install(decoder, slot)
+                self.start_offset = target * FRAME_LENGTH
+                self._frame = 0
+                self._pending.clear()
+                self._history.clear()
+                # The loop buffer no longer matches the track
+                if self._buffer is not None:
+                    self._buffer.close()
+                    self._buffer = None
+        if old[0] is not None:
+            self._close(*old)
+        if replaying:
+            self.seek(seconds)
+
+    def _record(self, data):
+        if self._buffer.tell() + len(data) > self.LOOP_MAX_BYTES:
+            # Too long to keep; fall back to streaming each repeat
+            self._buffer.close()
+            self._buffer = None
+            return
+        self._buffer.write(data)
+
+    def _read_buffer(self):
+        data = self._buffer.read(FRAME_SIZE)
+        if len(data) == FRAME_SIZE:
+            return data
+        if self._should_loop():
+            return self._restart_buffer()
+        return b''
+
+    def _restart_buffer(self):
+        self._buffer.seek(0)
+        if self._on_loop:
+            self._on_loop()
+        return self._buffer.read(FRAME_SIZE)
+
+    def is_opus(self):
+        return bool(self.opus_path)
+
+    def cleanup(self):
+        with self._lock:
+            self._closed = True
+            self._close_decoder()
+            if self._buffer is not None:
+                self._buffer.close()
+                self._buffer = None
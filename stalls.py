@@ -0,0 +1,204 @@
+"""Detection of event loop stalls, with the stack and command that caused them.
+
+A heartbeat task ticks on the event loop and a watchdog thread checks that it keeps ticking. When
+the loop hasn't ticked for longer than the threshold, the thread captures the loop thread's stack
+(so it shows the call that is blocking, not where the loop resumed) and the guild and command of
+the task that was running; the report is logged once the loop recovers and the stall's full
+length is known.
+
+With debug on, well-known blocking calls (file and folder access, subprocesses, sleep) are also
+wrapped so that any call made on the loop thread is logged with where it came from, however short.
+"""
+
+import asyncio
+import builtins
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import weakref
+import metrics
+from logconfig import log_context
+
+logger = logging.getLogger(__name__)
+
+# (module, attribute) of calls reported by the blocking-call debug mode
+BLOCKING_CALLS = (
+    (builtins, "open"),
+    (os, "listdir"),
+    (os, "scandir"),
+    (os, "walk"),
+    (shutil, "copyfile"),
+    (sqlite3, "connect"),
+    (subprocess, "check_output"),
+    (subprocess, "run"),
+    (time, "sleep"),
+)
+
+
+class StallWatchdog:
+    """Watches one event loop for stalls longer than threshold seconds.
+
+    start() from the loop; stop() when shutting down. Installs a task factory (unless the loop has
+    one) that remembers each task's context, which is how a stall is attributed to a command.
+    """
+
+    STACK_FRAMES = 20
+
+    def __init__(self, threshold=0.25, interval=0.05, debug=False):
+        self.threshold = threshold
+        self.interval = interval
+        self.debug = debug
+        self._loop = None
+        self._loop_thread = None
+        self._beat = None
+        self._stall = None  # (beat it followed, stack, context) captured by the watchdog thread
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._contexts = weakref.WeakKeyDictionary()  # task -> its contextvars.Context
+        self._heartbeat_task = None
+        self._thread = None
+        self._patched = []
+        self._reported_sites = set()
+        self._blocking_depth = 0  # wrapped calls in progress on the loop thread, so nested ones aren't reported
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        if self._loop.get_task_factory() is None:
+            self._loop.set_task_factory(self._task_factory)
+        self._beat = time.monotonic()
+        self._heartbeat_task = self._loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="stall-watchdog", daemon=True)
+        self._thread.start()
+        if self.debug:
+            self._patch_blocking_calls()
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+        if self._loop is not None and self._loop.get_task_factory() == self._task_factory:
+            self._loop.set_task_factory(None)
+        for module, name, original in self._patched:
+            setattr(module, name, original)
+        self._patched = []
+
+    def _task_factory(self, loop, coro, context=None, **kwargs):
+        # Python 3.13.3+ passes every create_task() keyword (name=, eager_start=...) to the factory
+        if sys.version_info < (3, 11):
+            # Tasks only take a context from 3.11; until then each copies its own, and all that can be
+            # remembered is what it started with (so a command's own task is reported without it)
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+            self._contexts[task] = contextvars.copy_context()
+            return task
+        context = context if context is not None else contextvars.copy_context()
+        task = asyncio.Task(coro, loop=loop, context=context, **kwargs)
+        self._contexts[task] = context
+        return task
+
+    # --- Stalls ---
+
+    async def _heartbeat(self):
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                stall, self._stall = self._stall, None
+                beat, self._beat = self._beat, now
+            if stall is not None and stall[0] == beat:
+                self._report(now - beat - self.interval, stall[1], stall[2])
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                beat = self._beat
+                if self._stall is not None or time.monotonic() - beat - self.interval < self.threshold:
+                    continue
+            # Captured while the loop is still blocked, so the stack shows the culprit
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = traceback.format_stack(frame)[-self.STACK_FRAMES:] if frame is not None else []
+            task = asyncio.current_task(self._loop)
+            context = self._contexts.get(task) if task is not None else None
+            with self._lock:
+                if self._beat == beat:
+                    self._stall = (beat, stack, context.get(log_context, {}) if context is not None else {})
+
+    def _report(self, duration, stack, context):
+        command = context.get("command")
+        metrics.loop_stalls.inc(command=command or "")
+        metrics.loop_stall_seconds.observe(duration)
+        logger.warning(
+            "Event loop stalled for %.0f ms; stack when it passed %.0f ms:\n%s",
+            duration * 1000, self.threshold * 1000, "".join(stack).rstrip(),
+            extra={"guild_id": context.get("guild_id"), "command": command, "user_id": context.get("user_id")},
+        )
+
+    # --- Blocking calls (debug) ---
+
+    def _patch_blocking_calls(self):
+        for module, name in BLOCKING_CALLS:
+            original = getattr(module, name, None)
+            if original is None:
+                continue
+            setattr(module, name, self._wrap(f"{getattr(module, '__name__', module)}.{name}", original))
+            self._patched.append((module, name, original))
+
+    def _wrap(self, name, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if threading.get_ident() != self._loop_thread or self._blocking_depth:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            result = None
+            self._blocking_depth += 1
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                self._blocking_depth -= 1
+                spent = time.perf_counter() - started
+                if not inspect.isgenerator(result):
+                    self._blocking_call(name, spent)
+            if inspect.isgenerator(result):
+                # e.g. os.walk, which does its work as it's iterated
+                return self._timed_generator(name, result, spent)
+            return result
+        return wrapper
+
+    def _timed_generator(self, name, generator, spent):
+        try:
+            while True:
+                # Only time spent inside the generator counts, not the caller's work between items
+                started = time.perf_counter()
+                self._blocking_depth += 1
+                try:
+                    item = next(generator)
+                except StopIteration as e:
+                    return e.value
+                finally:
+                    self._blocking_depth -= 1
+                    spent += time.perf_counter() - started
+                yield item
+        finally:
+            self._blocking_call(name, spent)
+
+    def _blocking_call(self, name, duration):
+        metrics.blocking_calls.inc(call=name)
+        # The caller is the first frame outside this module; each call site is logged once
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_code.co_filename == __file__:
+            frame = frame.f_back
+        site = (name, frame.f_code.co_filename, frame.f_lineno) if frame is not None else (name, None, None)
+        if site in self._reported_sites:
+            return
+        self._reported_sites.add(site)
+        # Runs on the loop thread, so the record picks up the command's guild and name itself
+        logger.warning("Blocking call %s on the event loop (%.1f ms) at %s:%s", name, duration * 1000, site[1], site[2])
@@ -0,0 +1,298 @@
+"""Offline benchmarks for library lookups, /audio paging, timestamps, queue operations, DSP and track transitions.
+
+Runs without Discord or ffmpeg against a generated audio tree and writes the results as JSON, e.g.
+
+    python tools/benchmark.py --tracks 20000 --output bench.json
+    python tools/benchmark.py --output new.json --compare bench.json
+
+With --compare, any result more than --threshold slower than the baseline is reported and the
+exit code is 1, so a release can be checked against the previous one.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakes import StubBot, StubChannel, install_fakes, make_audio_tree
+
+import cogs.audio
+import dsp
+from library import AudioLibrary
+from metadata import MetadataStore
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _stats(samples):
+    """Summarize timings (seconds) in milliseconds."""
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "min_ms": ordered[0] * 1000,
+        "median_ms": statistics.median(ordered) * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def _time(fn, iterations):
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - started)
+    return _stats(samples)
+
+
+def _git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return out.stdout.strip() or None
+
+
+def bench_library(cog, paths, iterations):
+    results = {}
+    started = time.perf_counter()
+    cog.library.build()
+    results["library_build"] = _stats([time.perf_counter() - started])
+
+    basenames = [os.path.basename(p) for p in paths]
+    folders = sorted({os.path.dirname(p) for p in paths if os.path.dirname(p)})
+    results["find_audio_by_basename"] = _time(
+        lambda i: cog.find_audio_by_basename(basenames[i * 7919 % len(basenames)]), iterations)
+    results["find_audio_by_basename_under_path"] = _time(
+        lambda i: cog.find_audio_by_basename(basenames[i * 7919 % len(basenames)], under_path=folders[i % len(folders)]), iterations)
+    results["find_audio_by_basename_miss"] = _time(
+        lambda i: cog.find_audio_by_basename(f"missing_{i}.mp3"), iterations)
+    # Top-level folders hold a large share of the tree, so these time a realistic "/play folder"
+    top = sorted({p.split("/")[0] for p in folders})
+    results["collect_audio_from_folder_top"] = _time(
+        lambda i: sum(1 for _ in cog.collect_audio_from_folder(top[i % len(top)])), max(1, iterations // 10))
+    results["collect_audio_from_folder_leaf"] = _time(
+        lambda i: sum(1 for _ in cog.collect_audio_from_folder(folders[-1 - i % len(folders)])), iterations)
+    results["collect_audio_from_folder_root"] = _time(
+        lambda i: sum(1 for _ in cog.collect_audio_from_folder("")), max(1, iterations // 100))
+    results["search_tracks_prefix"] = _time(
+        lambda i: cog.library.search_tracks(basenames[i * 7919 % len(basenames)][:8]), iterations)
+    results["search_tracks_fuzzy"] = _time(
+        lambda i: cog.library.search_tracks(f"trak {i % 1000:03d}"), iterations)
+    return results
+
+
+def bench_audio_pages(cog, paths, iterations, page_size=5):
+    # Small pages so most folders span several and the page buttons are built too
+    folders = [""] + sorted({os.path.dirname(p) for p in paths if os.path.dirname(p)})
+    return {
+        "build_audio_page_first": _time(
+            lambda i: cog.build_audio_page(folders[i % len(folders)], 0, page_size), iterations),
+        "build_audio_page_last": _time(
+            lambda i: cog.build_audio_page(folders[i % len(folders)], 10 ** 6, page_size), iterations),
+    }
+
+
+def bench_timestamps(iterations):
+    inputs = ["75", "1:15", "1:15:30", "bad", ""]
+    return {
+        "parse_timestamp": _time(lambda i: cogs.audio.AudioCog.parse_timestamp(inputs[i % len(inputs)]), iterations),
+        "format_timestamp": _time(lambda i: cogs.audio.AudioCog.format_timestamp(i * 37.5), iterations),
+    }
+
+
+def bench_dsp(iterations):
+    """Time DSPChain.process() on one 20 ms frame (budget: 20 ms per guild, shared by every playing guild)."""
+    if dsp.np is None:
+        return {}
+    np = dsp.np
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(-20000, 20000, (960, 2)).astype(np.float32) for _ in range(16)]
+    results = {}
+    for name, volume, eq in (
+        ("volume", 1.5, {}),
+        ("eq", 1.0, {"bass": 6, "mid": -3, "treble": 4}),
+        ("volume_eq", 1.5, {"bass": 6, "mid": -3, "treble": 4}),
+    ):
+        chain = dsp.DSPChain()
+        chain.set_volume(volume)
+        if eq:
+            chain.set_eq(**eq)
+        results[f"dsp_{name}"] = _time(lambda i: chain.process(frames[i % len(frames)].copy()), iterations)
+    return results
+
+
+async def bench_queue(cog, paths, iterations, batch):
+    """Time _enqueue and _clear_queue on the player's task while a track is playing (so nothing is dequeued)."""
+    guild = cog.bot.add_guild(1, realtime=True)
+    channel = StubChannel()
+    player = cog.get_player(guild.id)
+    voice_client = guild.voice_client
+    voice_client._playing = True  # hold the queue; no track actually starts
+    entries = paths[:batch]
+    single, bulk, clear = [], [], []
+    for i in range(iterations):
+        started = time.perf_counter()
+        await player.call(cog._enqueue, player, channel, voice_client, [entries[i % len(entries)]])
+        single.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await player.call(cog._enqueue, player, channel, voice_client, entries)
+        bulk.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await player.call(cog._clear_queue, player)
+        clear.append(time.perf_counter() - started)
+    voice_client._playing = False
+    player.close()
+    del cog.players[guild.id]
+    return {
+        "enqueue_single": _stats(single),
+        f"enqueue_batch_{len(entries)}": _stats(bulk),
+        f"clear_queue_{len(entries) + 1}": _stats(clear),
+    }
+
+
+async def bench_transitions(cog, paths, transitions, realtime):
+    """Queue `transitions` + 1 tracks and measure the gap between each track ending and the next starting.
+
+    This is the real path: the voice thread's after callback posts _after_track to the player,
+    which calls _play_next and voice_client.play() with the prefetched (or a fresh) source.
+    """
+    guild = cog.bot.add_guild(2, realtime=realtime)
+    channel = StubChannel()
+    player = cog.get_player(guild.id)
+    voice_client = guild.voice_client
+    entries = paths[:transitions + 1]
+    started = time.perf_counter()
+    await player.call(cog._enqueue, player, channel, voice_client, entries)
+    deadline = started + 60 + len(entries) * 5
+    while (player.queue or voice_client.is_playing()) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    player.close()
+    del cog.players[guild.id]
+    result = {
+        "tracks_started": voice_client.started,
+        "total_seconds": elapsed,
+        "messages_sent": channel.sent,
+    }
+    if voice_client.gaps:
+        result["transition_gap"] = _stats(voice_client.gaps)
+    return result
+
+
+async def run(args):
+    install_fakes(frames=args.frames, spawn_delay=args.spawn_delay_ms / 1000)
+    workdir = tempfile.mkdtemp(prefix="woolwav-bench-")
+    try:
+        audio = os.path.join(workdir, "audio")
+        started = time.perf_counter()
+        paths = make_audio_tree(audio, args.tracks, depth=args.depth, fanout=args.fanout)
+        print(f"Generated {len(paths)} tracks in {time.perf_counter() - started:.1f}s.")
+
+        bot = StubBot()
+        cog = cogs.audio.AudioCog(bot)
+        cog.audio_folder = audio
+        cog.library = AudioLibrary(audio)
+        cog.metadata = MetadataStore(os.path.join(workdir, "metadata.db"), audio, workers=args.workers)
+        cog.metadata.load()
+
+        results = {}
+        results.update(bench_library(cog, paths, args.iterations))
+        started = time.perf_counter()
+        cog.metadata.warm(cog.library.files_under(""))
+        results["metadata_warm"] = _stats([time.perf_counter() - started])
+        results.update(bench_audio_pages(cog, paths, args.iterations))
+        results.update(bench_timestamps(args.iterations * 10))
+        results.update(bench_dsp(args.iterations))
+        results.update(await bench_queue(cog, paths, args.iterations, args.batch))
+        results["transitions"] = await bench_transitions(cog, paths, args.transitions, not args.no_realtime)
+        cog.metadata.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "revision": _git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "tracks": args.tracks, "depth": args.depth, "fanout": args.fanout, "iterations": args.iterations,
+            "batch": args.batch, "transitions": args.transitions, "frames": args.frames,
+            "spawn_delay_ms": args.spawn_delay_ms, "realtime": not args.no_realtime,
+        },
+        "results": results,
+    }
+
+
+def _flatten(results, prefix=""):
+    # {"a": {"median_ms": 1}, "t": {"transition_gap": {...}}} -> {"a": {...}, "t.transition_gap": {...}}
+    flat = {}
+    for name, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        if "median_ms" in value:
+            flat[prefix + name] = value
+        else:
+            flat.update(_flatten(value, f"{prefix}{name}."))
+    return flat
+
+
+def compare(report, baseline_path, threshold):
+    """Print median changes against a baseline report; return the names that regressed past threshold."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != report["config"]:
+        print("[WARN] Baseline was run with a different configuration; comparisons may not be meaningful.")
+    old = _flatten(baseline.get("results", {}))
+    regressions = []
+    for name, stats in _flatten(report["results"]).items():
+        if name not in old or not old[name]["median_ms"]:
+            continue
+        change = stats["median_ms"] / old[name]["median_ms"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:45} {old[name]['median_ms']:10.4f} -> {stats['median_ms']:10.4f} ms ({change:+.0%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=10000, help="number of tracks to generate")
+    parser.add_argument("--depth", type=int, default=3, help="folder nesting depth")
+    parser.add_argument("--fanout", type=int, default=6, help="subfolders per folder")
+    parser.add_argument("--iterations", type=int, default=1000, help="iterations per micro-benchmark")
+    parser.add_argument("--batch", type=int, default=500, help="tracks per batch enqueue")
+    parser.add_argument("--transitions", type=int, default=20, help="track transitions to measure")
+    parser.add_argument("--frames", type=int, default=25, help="length of each fake track in 20 ms frames")
+    parser.add_argument("--spawn-delay-ms", type=float, default=30.0, help="simulated ffmpeg startup time")
+    parser.add_argument("--workers", type=int, default=4, help="metadata warm-up workers")
+    parser.add_argument("--no-realtime", action="store_true", help="play fake tracks as fast as possible")
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare medians against an earlier report")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before flagging (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Wrote {args.output}")
+    else:
+        print(text)
+    if args.compare and compare(report, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""Stand-ins for Discord and ffmpeg so the audio cog can be exercised offline (see benchmark.py)."""
+
+import asyncio
+import functools
+import os
+import struct
+import sys
+import threading
+import time
+
+# Tools live one level below the bot's modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+import metadata
+from sources import FRAME_SIZE, FRAME_LENGTH
+
+SILENCE = b"\0" * FRAME_SIZE
+
+
+@functools.lru_cache(maxsize=None)
+def numbered_frame(index):
+    """A near-silent frame whose first sample holds `index`, so tests can tell frames apart.
+
+    Cached, so every track shares the same frame objects and the soak test's per-player footprint
+    measures the player's own state rather than copies of fake audio.
+    """
+    return struct.pack("<h", index % 32768) + SILENCE[2:]
+
+
+def frame_number(data):
+    return struct.unpack_from("<h", data)[0]
+
+
+def make_audio_tree(root, tracks, depth=3, fanout=8, duplicates=0.05):
+    """Create `tracks` empty audio files spread over a folder tree `depth` levels deep with `fanout`
+    subfolders per level. Roughly `duplicates` of the basenames repeat in another folder. Returns the
+    relative paths created."""
+    folders = [""]
+    level = [""]
+    for _ in range(depth):
+        level = [f"{parent}/dir{i:02d}".lstrip("/") for parent in level for i in range(fanout)]
+        folders.extend(level)
+    for folder in folders:
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    every = int(1 / duplicates) if duplicates else 0
+    paths = []
+    for i in range(tracks):
+        folder = folders[i % len(folders)]
+        name = f"track_{i // every:06d}.mp3" if every and i % every == 0 and i else f"track_{i:06d}.mp3"
+        rel = f"{folder}/{name}".lstrip("/")
+        open(os.path.join(root, rel), "wb").close()
+        paths.append(rel)
+    return paths
+
+
+class FakeFFmpeg:
+    """Replacement for discord.FFmpegPCMAudio that yields numbered, near-silent frames instead of running ffmpeg.
+
+    `spawn_delay` models process startup, paid before the first frame like the real decoder.
+    """
+
+    frames = 10
+    spawn_delay = 0.0
+    active = 0
+    _lock = threading.Lock()
+
+    def __init__(self, source, *, executable="ffmpeg", before_options=None, **_kwargs):
+        self.source = source
+        self._remaining = self.frames
+        self._started = False
+        self._closed = False
+        with FakeFFmpeg._lock:
+            FakeFFmpeg.active += 1
+
+    def read(self):
+        if not self._started:
+            self._started = True
+            if self.spawn_delay:
+                time.sleep(self.spawn_delay)
+        if self._remaining <= 0:
+            return b""
+        self._remaining -= 1
+        return numbered_frame(self.frames - self._remaining - 1)
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        if not self._closed:
+            self._closed = True
+            with FakeFFmpeg._lock:
+                FakeFFmpeg.active -= 1
+
+
+def fake_probe(duration):
+    """Return a metadata.probe replacement that reports every track as `duration` seconds long."""
+    def probe(_file_path, **_kwargs):
+        return metadata.TrackInfo(duration, "mp3", 48000, 2, {})
+    return probe
+
+
+class FakeOpusEncoder(discord.opus.Encoder):
+    """Replacement for discord.opus.Encoder that needs no libopus: a packet is the frame's first sample."""
+
+    def __init__(self, **_kwargs):
+        pass
+
+    def encode(self, pcm, frame_size):
+        if len(pcm) != frame_size * self.SAMPLE_SIZE:
+            raise ValueError(f"expected {frame_size * self.SAMPLE_SIZE} bytes of PCM, got {len(pcm)}")
+        return pcm[:2]
+
+
+class FakeOpusDecoder(discord.opus.Decoder):
+    """Replacement for discord.opus.Decoder that turns a FakeOpusEncoder packet back into a numbered frame."""
+
+    def __init__(self):
+        pass
+
+    def decode(self, data, *, fec=False):
+        return numbered_frame(struct.unpack_from("<h", data)[0]) if data else SILENCE
+
+
+def install_fakes(frames=10, spawn_delay=0.0):
+    """Patch ffmpeg, ffprobe and libopus out for this process. Tracks are `frames` 20 ms frames long."""
+    FakeFFmpeg.frames = frames
+    FakeFFmpeg.spawn_delay = spawn_delay
+    discord.FFmpegPCMAudio = FakeFFmpeg
+    discord.opus.Encoder = FakeOpusEncoder
+    discord.opus.Decoder = FakeOpusDecoder
+    metadata.probe = fake_probe(frames * FRAME_LENGTH)
+
+
+class StubVoiceClient:
+    """Plays sources on a thread like discord.py's AudioPlayer, pacing reads at one frame per 20 ms
+    (or as fast as possible with realtime=False). Records the gap between one source ending and the
+    next play() call.
+
+    Like discord.py, play() only creates an encoder if the source starts out as PCM, and every
+    frame the source reports as PCM goes through it. An error while playing ends the source and
+    is passed to `after`; all of them are kept in `errors`.
+    """
+
+    errors = []
+
+    def __init__(self, realtime=True, guild=None, channel=None):
+        self.realtime = realtime
+        self.guild = guild
+        self.channel = channel or type("Channel", (), {"name": "stub", "members": []})()
+        self.source = None
+        self.encoder = discord.utils.MISSING
+        self.gaps = []
+        self.started = 0
+        self._playing = False
+        self._stop = threading.Event()
+        self._paused = threading.Event()
+        self._ended_at = None
+        self._connected = True
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._playing and not self._paused.is_set()
+
+    def is_paused(self):
+        return self._paused.is_set()
+
+    def play(self, source, *, after=None):
+        if self._playing:
+            raise discord.ClientException("Already playing audio.")
+        now = time.perf_counter()
+        if self._ended_at is not None:
+            self.gaps.append(now - self._ended_at)
+            self._ended_at = None
+        self.started += 1
+        if not source.is_opus():
+            self.encoder = discord.opus.Encoder()
+        self.source = source
+        self._playing = True
+        self._paused.clear()
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, args=(source, after, self._stop), daemon=True).start()
+
+    def _run(self, source, after, stop):
+        next_frame = time.perf_counter()
+        error = None
+        try:
+            while not stop.is_set():
+                if self._paused.is_set():
+                    time.sleep(FRAME_LENGTH)
+                    next_frame = time.perf_counter()
+                    continue
+                data = source.read()
+                if not data:
+                    break
+                if not source.is_opus():
+                    self.encoder.encode(data, FRAME_SIZE // self.encoder.SAMPLE_SIZE)
+                if self.realtime:
+                    next_frame += FRAME_LENGTH
+                    delay = next_frame - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+        except Exception as e:
+            error = e
+            StubVoiceClient.errors.append(e)
+        source.cleanup()
+        # Like discord.py, the client stops reporting is_playing() before `after` runs
+        self._ended_at = time.perf_counter()
+        self._playing = False
+        if after is not None:
+            after(error)
+
+    def pause(self):
+        self._paused.set()
+
+    def resume(self):
+        self._paused.clear()
+
+    def stop(self):
+        self._stop.set()
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self._connected = False
+        if self.guild is not None and self.guild.voice_client is self:
+            self.guild.voice_client = None
+
+
+class StubChannel:
+    """Text channel that counts messages instead of sending them."""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, content=None, **_kwargs):
+        self.sent += 1
+
+
+class StubGuild:
+    def __init__(self, guild_id, voice_client=None):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.voice_client = voice_client
+
+
+class StubVoiceChannel:
+    """Voice channel whose connect() attaches a StubVoiceClient to the guild."""
+
+    def __init__(self, guild, realtime=True):
+        self.guild = guild
+        self.name = "stub"
+        self.realtime = realtime
+        self.members = []
+
+    async def connect(self, **_kwargs):
+        self.guild.voice_client = StubVoiceClient(self.realtime, self.guild, self)
+        return self.guild.voice_client
+
+
+class StubUser:
+    def __init__(self, user_id, voice_channel=None):
+        self.id = user_id
+        self.bot = False
+        self.roles = []
+        self.voice = type("VoiceState", (), {"channel": voice_channel})()
+
+    def __str__(self):
+        return f"user-{self.id}"
+
+
+class StubResponse:
+    def __init__(self):
+        self.messages = []
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, content=None, **kwargs):
+        if self._done:
+            raise discord.InteractionResponded(None)
+        self._done = True
+        self.messages.append(content if content is not None else kwargs.get("embed"))
+
+    async def defer(self, **_kwargs):
+        if self._done:
+            raise discord.InteractionResponded(None)
+        self._done = True
+
+    async def edit_message(self, **kwargs):
+        self._done = True
+        self.messages.append(kwargs.get("content") or kwargs.get("embed"))
+
+
+class StubInteraction:
+    """The parts of discord.Interaction the cogs use: guild, user, channel, response and followup."""
+
+    def __init__(self, bot, guild, user, channel):
+        self.client = bot
+        self.guild = guild
+        self.guild_id = guild.id if guild else None
+        self.user = user
+        self.channel = channel
+        self.response = StubResponse()
+        self.followup = channel
+        self.extras = {}
+
+
+class StubBot:
+    """Just enough of commands.Bot for AudioCog outside of Discord."""
+
+    def __init__(self, loop=None, settings=None):
+        self.loop = loop or asyncio.get_running_loop()
+        self.guilds = {}
+        self.settings = settings
+        self.metadata_workers = 4
+        self.allowed_roles = []
+        self.user = StubUser(0)
+
+    @property
+    def voice_clients(self):
+        return [g.voice_client for g in self.guilds.values() if g.voice_client is not None]
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def add_guild(self, guild_id, realtime=True):
+        guild = self.guilds[guild_id] = StubGuild(guild_id)
+        guild.voice_client = StubVoiceClient(realtime, guild)
+        return guild
+
+    def add_dynamic_items(self, *_items):
+        pass
+
+    def remove_dynamic_items(self, *_items):
+        pass
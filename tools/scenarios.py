@@ -0,0 +1,297 @@
+"""Playback scenarios checked frame by frame against the fakes (see fakes.py).
+
+Each scenario drives the real sources (or the audio cog's own playback methods, with stub voice
+clients) and checks what they produce.
+Run before a release alongside the soak test and benchmarks; the exit code is 1 if any fail:
+
+    python tools/scenarios.py
+"""
+
+import asyncio
+import inspect
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from fakes import FakeOpusEncoder, StubBot, StubChannel, StubVoiceClient, frame_number, install_fakes, make_audio_tree, numbered_frame
+
+import cogs.audio
+import mixer
+import processes
+from dsp import DSPChain
+from metadata import MetadataStore
+from mixer import MixerSource, Overlays
+from soundboard import Clip, ClipSource
+from sources import PACKET_SAMPLES, TrackSource
+
+SCENARIOS = []
+
+
+class Skipped(Exception):
+    """Raised by a scenario that can't run here, e.g. without NumPy."""
+
+
+def scenario(fn):
+    SCENARIOS.append(fn)
+    return fn
+
+
+def _read(source, frames):
+    return [frame_number(source.read()) for _ in range(frames)]
+
+
+def _opus_clip(frames):
+    """A clip of `frames` fake Opus packets, like one from the Opus cache."""
+    encoder = FakeOpusEncoder()
+    return Clip([encoder.encode(numbered_frame(i), PACKET_SAMPLES) for i in range(frames)])
+
+
+def _play(voice_client, source, timeout=5):
+    """Play source to the end on a stub voice client. Returns the error passed to `after`, if any."""
+    done = threading.Event()
+    errors = []
+    voice_client.play(source, after=lambda error: (errors.append(error), done.set()))
+    if not done.wait(timeout):
+        raise AssertionError(f"still playing after {timeout} s")
+    return errors[0]
+
+
+async def _stop(voice_client):
+    """Stop a stub voice client and let its after callback run while the event loop is still up.
+
+    Close the player first, so the callback doesn't start anything else.
+    """
+    voice_client.stop()
+    while voice_client.is_playing():
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+
+
+@scenario
+def primed_loop_repeats_whole_track():
+    """A looping track primed before playback (e.g. prefetched) repeats from its first frame."""
+    frames = 120
+    install_fakes(frames=frames)
+    source = TrackSource("track.mp3", should_loop=lambda: True)
+    try:
+        source.prime()
+        first = _read(source, frames)
+        second = _read(source, frames)
+    finally:
+        source.cleanup()
+    assert first == list(range(frames)), f"first pass played {first[:3]}...{first[-3:]}"
+    assert second == first, f"second pass starts at frame {second[0]}, not {first[0]}"
+
+
+@scenario
+def seek_restart_keeps_playing_while_decoder_starts():
+    """A seek that restarts the decoder doesn't hold up reads while the new one waits for a process slot."""
+    install_fakes(frames=2000)
+    source = TrackSource("track.mp3")
+    acquire = processes.scheduler.acquire
+
+    def slow_acquire(*args, **kwargs):
+        time.sleep(0.3)
+        return acquire(*args, **kwargs)
+
+    processes.scheduler.acquire = slow_acquire
+    try:
+        _read(source, 10)
+        seeking = threading.Thread(target=source.seek, args=(30,))
+        seeking.start()
+        time.sleep(0.05)
+        started = time.perf_counter()
+        during = _read(source, 5)
+        waited = time.perf_counter() - started
+        seeking.join()
+        after = _read(source, 1)
+    finally:
+        processes.scheduler.acquire = acquire
+        source.cleanup()
+    assert waited < 0.1, f"reads waited {waited * 1000:.0f} ms for the seek"
+    assert during == list(range(10, 15)), f"played {during} while seeking"
+    # The fake decoder numbers its frames from 0 wherever it starts
+    assert after == [0] and source.position == 30.02, f"after the seek, at {source.position} s"
+
+
+@scenario
+def opus_track_with_volume_and_overlay():
+    """An Opus track plays to the end when /volume and an overlay mean its frames are decoded and mixed."""
+    if mixer.np is None:
+        raise Skipped("needs NumPy")
+    install_fakes()
+    clip = _opus_clip(50)
+    overlays = Overlays()
+    chain = DSPChain()
+    chain.set_volume(0.5)
+    overlays.add(ClipSource(_opus_clip(10), decode=True))
+    source = MixerSource(ClipSource(clip), overlays, chain)
+    error = _play(StubVoiceClient(realtime=False), source)
+    assert error is None, f"playback failed: {error!r}"
+    assert source.is_opus(), "an Opus track should stay Opus for the whole stream"
+
+
+@scenario
+def eq_switched_on_and_off_mid_track_doesnt_click():
+    """Turning the EQ on while frames pass through untouched, then off again, keeps the waveform continuous."""
+    if mixer.np is None:
+        raise Skipped("needs NumPy")
+    np = mixer.np
+    # A 137 Hz tone (out of phase with the frames); samples in a row are at most ~180 apart, ~260 boosted
+    t = np.arange(48000 * 2) / 48000
+    tone = np.repeat(10000 * np.sin(2 * np.pi * 137 * t), 2).astype(np.int16).tobytes()
+
+    class Tone:
+        def __init__(self):
+            self.offset = 0
+
+        def read(self):
+            self.offset += mixer.FRAME_SIZE
+            return tone[self.offset - mixer.FRAME_SIZE:self.offset]
+
+        def is_opus(self):
+            return False
+
+        def cleanup(self):
+            pass
+
+    chain = DSPChain()
+    source = MixerSource(Tone(), Overlays(), chain)
+    out = []
+    for settings in ({}, {"bass": 6}, {"bass": 0}):
+        chain.set_eq(**settings)
+        out.extend(source.read() for _ in range(10))
+    samples = np.frombuffer(b"".join(out), dtype=np.int16)[::2].astype(np.int32)
+    jump = int(np.abs(np.diff(samples)).max())
+    assert jump < 450, f"the waveform jumps by {jump} at frame {int(np.abs(np.diff(samples)).argmax()) // mixer.FRAME_SAMPLES}"
+
+
+@scenario
+async def overlay_over_lone_clip():
+    """A second /sfx mixed over a clip playing on its own (no track) plays both to the end."""
+    if mixer.np is None:
+        raise Skipped("needs NumPy")
+    install_fakes()
+    bot = StubBot()
+    cog = cogs.audio.AudioCog(bot)
+    voice_client = bot.add_guild(1).voice_client
+    player = cog.get_player(1)
+    errors = len(StubVoiceClient.errors)
+    assert cog._play_clip(player, StubChannel(), voice_client, "sfx/first.ogg", _opus_clip(25))
+    await asyncio.sleep(0.1)
+    assert voice_client.is_playing(), "the first clip should still be playing"
+    assert cog._play_clip(player, StubChannel(), voice_client, "sfx/second.ogg", _opus_clip(10))
+    assert player.overlays.names() == ["sfx/second.ogg"], "the second clip should be mixed over the first"
+    deadline = time.monotonic() + 5
+    while voice_client.is_playing() and time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+    assert not voice_client.is_playing(), "the clips never finished"
+    assert StubVoiceClient.errors[errors:] == [], f"playback failed: {StubVoiceClient.errors[errors:]!r}"
+    assert player.overlays.idle, "the overlay should have finished with the clip"
+    player.close()
+
+
+@scenario
+async def looping_track_ending_under_lone_clip_repeats():
+    """A looping track whose end is handled while a /sfx clip plays on its own repeats once the clip ends."""
+    install_fakes(frames=10)
+    workdir = tempfile.mkdtemp(prefix="woolwav-scenario-")
+    try:
+        bot = StubBot()
+        cog = cogs.audio.AudioCog(bot)
+        cog.audio_folder = os.path.join(workdir, "audio")
+        first, second = make_audio_tree(cog.audio_folder, 2, depth=0)
+        cog.metadata = MetadataStore(os.path.join(workdir, "metadata.db"), cog.audio_folder)
+        voice_client = bot.add_guild(1).voice_client
+        player = cog.get_player(1)
+        channel = StubChannel()
+        # The first track has just ended, and a clip got in before its after callback ran
+        player.looping = True
+        player.current_track = cog.resolve_audio_path(first)
+        player.queue.append(second)
+        await player.call(cog._play_clip, player, channel, voice_client, "sfx/clip.ogg", _opus_clip(10))
+        await player.call(cog._after_track, player, channel, voice_client, None, player.play_id)
+        deadline = time.monotonic() + 5
+        while not isinstance(getattr(voice_client.source, "bed", None), TrackSource) and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+        bed = getattr(voice_client.source, "bed", None)
+        assert isinstance(bed, TrackSource), "nothing played after the clip"
+        assert bed.file_path == cog.resolve_audio_path(first), f"played {bed.file_path} instead of repeating {first}"
+        assert list(player.queue) == [second], "the queue shouldn't move while looping"
+        player.close()
+        await _stop(voice_client)
+        cog.metadata.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@scenario
+async def player_answers_while_next_track_waits_for_a_slot():
+    """Commands queued on a player don't wait for the next track's decoder to get a process slot."""
+    install_fakes(frames=50)
+    workdir = tempfile.mkdtemp(prefix="woolwav-scenario-")
+    acquire = processes.scheduler.acquire
+
+    def slow_acquire(*args, **kwargs):
+        time.sleep(0.5)
+        return acquire(*args, **kwargs)
+
+    processes.scheduler.acquire = slow_acquire
+    try:
+        bot = StubBot()
+        cog = cogs.audio.AudioCog(bot)
+        cog.audio_folder = os.path.join(workdir, "audio")
+        first, second = make_audio_tree(cog.audio_folder, 2, depth=0)
+        cog.metadata = MetadataStore(os.path.join(workdir, "metadata.db"), cog.audio_folder)
+        voice_client = bot.add_guild(1).voice_client
+        player = cog.get_player(1)
+        channel = StubChannel()
+        player.submit(cog._enqueue, player, channel, voice_client, [first])
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        assert await player.call(cog._toggle_loop, player), "looping should now be on"
+        waited = time.perf_counter() - started
+        # Queued while the first track opens: it mustn't start a second decoder alongside
+        await player.call(cog._enqueue, player, channel, voice_client, [second])
+        deadline = time.monotonic() + 5
+        while not voice_client.is_playing() and time.monotonic() < deadline:
+            await asyncio.sleep(0.02)
+        bed = getattr(voice_client.source, "bed", None)
+        assert waited < 0.1, f"/loop waited {waited * 1000:.0f} ms for the track to open"
+        assert bed is not None and bed.file_path == cog.resolve_audio_path(first), "the first track never started"
+        assert list(player.queue) == [second], f"queue is {list(player.queue)}"
+        player.close()
+        await _stop(voice_client)
+        cog.metadata.close()
+    finally:
+        processes.scheduler.acquire = acquire
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    failed = skipped = 0
+    for fn in SCENARIOS:
+        try:
+            if inspect.iscoroutinefunction(fn):
+                asyncio.run(fn())
+            else:
+                fn()
+        except Skipped as e:
+            skipped += 1
+            print(f"skip {fn.__name__}: {e}")
+        except Exception:
+            failed += 1
+            print(f"FAIL {fn.__name__}\n{traceback.format_exc()}")
+        else:
+            print(f"ok   {fn.__name__}")
+    print(f"{len(SCENARIOS) - failed - skipped} passed, {failed} failed, {skipped} skipped")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
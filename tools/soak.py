@@ -0,0 +1,332 @@
+"""Headless multi-guild soak test for the audio cog.
+
+Simulates many guilds issuing a random mix of /play, /skip, /skipto, /loop, /audio, /queue, /overlay, /volume, /eq and /stop
+against the real command callbacks, with stub interactions and voice clients and a fake ffmpeg
+(see fakes.py). Reports event loop lag percentiles, memory growth (overall via tracemalloc, and
+per guild as the size of the state each player holds), and any tasks, decoders or threads still
+alive once every guild has stopped, e.g.
+
+    python tools/soak.py --guilds 50 --duration 600 --output soak.json
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import shutil
+import threading
+import time
+import tracemalloc
+
+from fakes import FakeFFmpeg, StubBot, StubChannel, StubGuild, StubInteraction, StubUser, StubVoiceChannel, StubVoiceClient, install_fakes, make_audio_tree
+
+import cogs.audio
+from library import AudioLibrary
+from metadata import MetadataStore
+from settings import Settings
+
+# Relative weights of each simulated command
+COMMAND_MIX = {
+    "play_track": 30,
+    "play_folder": 5,
+    "skip": 15,
+    "skipto": 10,
+    "loop": 5,
+    "audio": 20,
+    "queue": 10,
+    "overlay": 5,
+    "volume": 3,
+    "eq": 3,
+    "stop": 5,
+}
+
+
+def _percentiles(samples, points=(50, 90, 99, 99.9)):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {f"p{p:g}_ms": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000 for p in points} | {
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def _deep_size(obj, seen=None):
+    """Approximate bytes reachable from obj, not counting modules, classes or functions."""
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, (type, type(sys), type(_deep_size))):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item, 0)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)) or type(item).__name__ == "deque":
+            stack.extend(item)
+        else:
+            for name in getattr(type(item), "__slots__", ()):
+                if hasattr(item, name):
+                    stack.append(getattr(item, name))
+            if hasattr(item, "__dict__"):
+                stack.append(item.__dict__)
+    return size
+
+
+def player_footprint(cog, guild):
+    """Bytes held by one guild's player: queue, clock state and any prefetched or playing source."""
+    player = cog.players.get(guild.id)
+    if player is None:
+        return 0
+    # Skip the shared loop and cog; the player's task is counted separately as a live task
+    seen = {id(player._loop), id(cog), id(player._task)}
+    size = _deep_size(player, seen)
+    source = getattr(guild.voice_client, "source", None)
+    if source is not None:
+        size += _deep_size(source, seen)
+    return size
+
+
+class Simulator:
+    def __init__(self, cog, bot, paths, args):
+        self.cog = cog
+        self.bot = bot
+        self.args = args
+        self.paths = paths
+        self.folders = sorted({os.path.dirname(p) for p in paths if os.path.dirname(p)})
+        self.rng = random.Random(args.seed)
+        self.counts = {name: 0 for name in COMMAND_MIX}
+        self.errors = {}
+        self.latencies = {name: [] for name in COMMAND_MIX}
+        self.lag = []
+        self.guilds = []
+
+    async def monitor_lag(self, interval=0.05):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            self.lag.append(max(0.0, loop.time() - expected))
+
+    def _interaction(self, guild, channel, voice_channel):
+        user = StubUser(self.rng.randrange(1, 1000), voice_channel)
+        return StubInteraction(self.bot, guild, user, channel)
+
+    async def run_command(self, name, guild, channel, voice_channel):
+        cog = self.cog
+        interaction = self._interaction(guild, channel, voice_channel)
+        rng = self.rng
+        if name == "play_track":
+            call = cog.play.callback(cog, interaction, rng.choice(self.paths))
+        elif name == "play_folder":
+            call = cog.play.callback(cog, interaction, rng.choice(self.folders))
+        elif name == "skip":
+            call = cog.skip.callback(cog, interaction)
+        elif name == "skipto":
+            duration = int(FakeFFmpeg.frames * 0.02)
+            call = cog.skipto.callback(cog, interaction, str(rng.randrange(max(duration, 1))))
+        elif name == "loop":
+            call = cog.loop.callback(cog, interaction)
+        elif name == "audio":
+            call = cog.audio.callback(cog, interaction, rng.choice([None] + self.folders))
+        elif name == "queue":
+            call = cog.queue.callback(cog, interaction)
+        elif name == "overlay":
+            call = cog.overlay.callback(cog, interaction, rng.choice(self.paths), 100)
+        elif name == "volume":
+            call = cog.volume.callback(cog, interaction, rng.randrange(50, 151))
+        elif name == "eq":
+            call = cog.eq.callback(cog, interaction, rng.uniform(-6, 6), rng.uniform(-6, 6), rng.uniform(-6, 6), rng.random() < 0.2)
+        else:
+            call = cog.stop.callback(cog, interaction)
+        started = time.perf_counter()
+        try:
+            await call
+        except Exception as e:
+            key = f"{name}: {type(e).__name__}: {e}"
+            self.errors[key] = self.errors.get(key, 0) + 1
+        self.latencies[name].append(time.perf_counter() - started)
+        self.counts[name] += 1
+
+    async def guild_worker(self, guild, deadline):
+        channel = StubChannel()
+        voice_channel = StubVoiceChannel(guild, realtime=True)
+        voice_channel.members.append(StubUser(guild.id, voice_channel))
+        names = list(COMMAND_MIX)
+        weights = list(COMMAND_MIX.values())
+        # Every guild starts by queueing something, like a real session
+        await self.run_command("play_track", guild, channel, voice_channel)
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(self.rng.expovariate(1 / self.args.interval))
+            await self.run_command(self.rng.choices(names, weights)[0], guild, channel, voice_channel)
+        await self.run_command("stop", guild, channel, voice_channel)
+
+    def sample(self, started):
+        traced, peak = tracemalloc.get_traced_memory()
+        footprints = [player_footprint(self.cog, g) for g in self.guilds]
+        return {
+            "t": round(time.perf_counter() - started, 1),
+            "traced_bytes": traced,
+            "traced_peak_bytes": peak,
+            "players": len(self.cog.players),
+            "queued": sum(p.queue_length() for p in self.cog.players.values()),
+            "decoders": FakeFFmpeg.active,
+            "tasks": len(asyncio.all_tasks()),
+            "threads": threading.active_count(),
+            "player_bytes_mean": sum(footprints) / len(footprints) if footprints else 0,
+            "player_bytes_max": max(footprints, default=0),
+            "commands": sum(self.counts.values()),
+            "lag_p99_ms": _percentiles(self.lag[-2000:]).get("p99_ms", 0),
+        }
+
+    async def reporter(self, started, samples):
+        while True:
+            await asyncio.sleep(self.args.report_every)
+            sample = self.sample(started)
+            samples.append(sample)
+            print(
+                f"[{sample['t']:7.1f}s] commands={sample['commands']} players={sample['players']} "
+                f"queued={sample['queued']} decoders={sample['decoders']} tasks={sample['tasks']} "
+                f"threads={sample['threads']} traced={sample['traced_bytes'] / 1e6:.1f}MB "
+                f"player~{sample['player_bytes_mean'] / 1e3:.1f}KB lag_p99={sample['lag_p99_ms']:.1f}ms"
+            )
+
+    async def run(self):
+        args = self.args
+        baseline_tasks = asyncio.all_tasks()
+        baseline_threads = set(threading.enumerate())
+        lag_task = asyncio.create_task(self.monitor_lag())
+        started = time.perf_counter()
+        samples = []
+        report_task = asyncio.create_task(self.reporter(started, samples))
+
+        gc.collect()
+        first = tracemalloc.take_snapshot()
+        self.guilds = [StubGuild(1000 + i) for i in range(args.guilds)]
+        for guild in self.guilds:
+            self.bot.guilds[guild.id] = guild
+        deadline = started + args.duration
+        await asyncio.gather(*(self.guild_worker(g, deadline) for g in self.guilds))
+
+        # Let stopped tracks wind down and their after callbacks run
+        settle = time.perf_counter() + 5
+        while time.perf_counter() < settle and any(
+                g.voice_client and g.voice_client.is_playing() for g in self.guilds):
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.5)
+        # Errors raised while playing (e.g. by a source) end the track rather than the command
+        for e in StubVoiceClient.errors:
+            key = f"playback: {type(e).__name__}: {e}"
+            self.errors[key] = self.errors.get(key, 0) + 1
+        final_sample = self.sample(started)
+        report_task.cancel()
+        lag_task.cancel()
+        gc.collect()
+        last = tracemalloc.take_snapshot()
+
+        per_guild = {str(g.id): player_footprint(self.cog, g) for g in self.guilds}
+        await asyncio.sleep(0)
+        leaked_tasks = [
+            repr(t.get_coro()) for t in asyncio.all_tasks() - baseline_tasks
+            if t is not asyncio.current_task() and not t.done() and t not in (report_task, lag_task)
+        ]
+        # Idle workers of the loop's default executor (used by asyncio.to_thread) and the cog's decoder pool are kept on purpose
+        leaked_threads = [
+            t.name for t in threading.enumerate()
+            if t not in baseline_threads and t.is_alive() and not t.name.startswith(("asyncio_", "decoder"))
+        ]
+        growth = [
+            {"where": str(stat.traceback[0]), "size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+            for stat in last.compare_to(first, "lineno")[:args.top]
+        ]
+        return {
+            "config": vars(args),
+            "commands": self.counts,
+            "command_latency": {name: _percentiles(values) for name, values in self.latencies.items()},
+            "errors": self.errors,
+            "event_loop_lag": _percentiles(self.lag),
+            "samples": samples + [final_sample],
+            "memory": {
+                "traced_bytes": final_sample["traced_bytes"],
+                "traced_peak_bytes": final_sample["traced_peak_bytes"],
+                "per_guild_player_bytes": per_guild,
+                "top_growth": growth,
+            },
+            "leaks": {
+                "players": len(self.cog.players),
+                "queued_entries": final_sample["queued"],
+                "open_decoders": FakeFFmpeg.active,
+                "tasks": leaked_tasks,
+                "threads": leaked_threads,
+            },
+        }
+
+
+async def main_async(args):
+    install_fakes(frames=int(args.track_seconds / 0.02), spawn_delay=args.spawn_delay_ms / 1000)
+    workdir = tempfile.mkdtemp(prefix="woolwav-soak-")
+    try:
+        audio = os.path.join(workdir, "audio")
+        paths = make_audio_tree(audio, args.tracks, depth=2, fanout=5)
+        settings = Settings(os.path.join(workdir, "settings.json"))
+        bot = StubBot(settings=settings)
+        cog = cogs.audio.AudioCog(bot)
+        cog.audio_folder = audio
+        cog.library = AudioLibrary(audio)
+        cog.library.build()
+        cog.library_ready.set()
+        cog.metadata = MetadataStore(os.path.join(workdir, "metadata.db"), audio)
+        cog.metadata.load()
+        cog.metadata.warm(cog.library.files_under(""))
+        if args.idle_seconds:
+            # Exercise idle disconnects and eviction/restore of player state
+            bot.idle_disconnect_seconds = args.idle_seconds
+            cog.IDLE_CHECK_SECONDS = min(cog.IDLE_CHECK_SECONDS, max(0.5, args.idle_seconds / 4))
+            cog._idle_task = asyncio.create_task(cog._idle_sweep())
+
+        tracemalloc.start(args.frames)
+        report = await Simulator(cog, bot, paths, args).run()
+        tracemalloc.stop()
+        await cog.cog_unload()
+        return report
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=20, help="concurrent simulated guilds")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run")
+    parser.add_argument("--interval", type=float, default=2.0, help="mean seconds between commands per guild")
+    parser.add_argument("--tracks", type=int, default=2000, help="tracks in the generated audio folder")
+    parser.add_argument("--track-seconds", type=float, default=8.0, help="length of each fake track")
+    parser.add_argument("--spawn-delay-ms", type=float, default=30.0, help="simulated ffmpeg startup time")
+    parser.add_argument("--report-every", type=float, default=10.0, help="seconds between progress lines")
+    parser.add_argument("--frames", type=int, default=5, help="traceback depth kept by tracemalloc")
+    parser.add_argument("--top", type=int, default=15, help="allocation sites to list in the growth report")
+    parser.add_argument("--idle-seconds", type=float, default=0, help="idle disconnect timeout to exercise (0 disables)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the command mix")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    leaks = report["leaks"]
+    print(f"Event loop lag: {json.dumps(report['event_loop_lag'])}")
+    print(f"Leaks: players={leaks['players']} queued={leaks['queued_entries']} decoders={leaks['open_decoders']} "
+          f"tasks={len(leaks['tasks'])} threads={len(leaks['threads'])}")
+    if report["errors"]:
+        print(f"Errors: {json.dumps(report['errors'], indent=2)}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
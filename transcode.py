@@ -0,0 +1,205 @@
+"""Cache of library tracks transcoded to 48 kHz Opus, so playback can skip decoding and re-encoding."""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+import metrics
+import processes
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    digest TEXT NOT NULL
+)
+"""
+
+
+def file_digest(file_path):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def transcode(file_path, out_path, gain_db=0, bitrate=128, kind=processes.BACKGROUND):
+    """Encode a track to Ogg Opus with 20 ms packets (one per Discord frame). Returns whether it succeeded."""
+    args = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", file_path, "-map", "0:a:0", "-map_metadata", "-1"]
+    if gain_db:
+        args += ["-af", f"volume={gain_db:.1f}dB"]
+    args += ["-c:a", "libopus", "-b:a", f"{bitrate}k", "-ar", "48000", "-ac", "2",
+             "-frame_duration", "20", "-application", "audio", "-f", "ogg", out_path]
+    try:
+        out = processes.scheduler.run(args, kind=kind, timeout=1800)
+    except (FileNotFoundError, subprocess.TimeoutExpired, processes.ProcessLimitError):
+        return False
+    return out.returncode == 0 and os.path.exists(out_path)
+
+
+class OpusCache:
+    """Content-addressed Opus files for library tracks, evicted least recently used first past max_bytes.
+
+    Entries are named after the SHA-256 of the source file plus the gain baked into them, so renamed
+    or duplicated tracks share an entry and a changed loudness target re-encodes. Which digest each
+    library path has is kept in an index (by mtime and size, like MetadataStore) so lookups never
+    hash files. Using an entry touches its mtime, which is what eviction orders by.
+
+    lookup() is cheap but touches the disk; it, ingest() and evict() are blocking, so run them off the event loop.
+    """
+
+    BITRATE = 128
+
+    def __init__(self, cache_dir, audio_folder, max_bytes, workers=2):
+        self.cache_dir = cache_dir
+        self.audio_folder = audio_folder
+        self.max_bytes = max_bytes
+        self.workers = max(1, workers)
+        self._sources = {}  # relative path -> (mtime, size, digest)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._closed = threading.Event()
+
+    def load(self):
+        """Open (or create) the index and read it into memory."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.cache_dir, "index.db"), check_same_thread=False)
+        conn.execute(_SCHEMA)
+        conn.commit()
+        sources = {path: (mtime, size, digest) for path, mtime, size, digest in conn.execute("SELECT * FROM sources")}
+        with self._lock:
+            self._conn = conn
+            self._sources = sources
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _entry_path(self, digest, gain_db):
+        return os.path.join(self.cache_dir, f"{digest}_{gain_db:+.1f}.opus")
+
+    @staticmethod
+    def round_gain(gain_db):
+        # Half-dB steps, so small changes in the analysis don't re-encode a track
+        return round(gain_db * 2) / 2
+
+    def lookup(self, rel, gain_db=0):
+        """Return the cached Opus file for a track at this gain, or None if it isn't (or is no longer) cached."""
+        entry = self._sources.get(rel)
+        path = None
+        if entry is not None:
+            try:
+                st = os.stat(os.path.join(self.audio_folder, rel))
+                if (st.st_mtime, st.st_size) == entry[:2]:
+                    path = self._entry_path(entry[2], self.round_gain(gain_db))
+                    os.utime(path)
+            except OSError:
+                path = None
+        metrics.opus_cache_lookups.inc(result="hit" if path else "miss")
+        return path
+
+    def ingest(self, paths, gain_for, fill=True):
+        """Transcode every track not cached at its current gain. Returns how many were transcoded.
+
+        gain_for(rel) returns the gain in dB, or None to skip the track for now (e.g. loudness not
+        analyzed yet). With fill, stop adding entries once the cache is full rather than evicting
+        others for them, so a library bigger than the cache doesn't churn on every pass.
+        """
+        budget = [self.max_bytes - self._total_bytes()]
+
+        def _ingest_one(rel):
+            if self._closed.is_set() or (fill and budget[0] <= 0):
+                return False
+            gain_db = gain_for(rel)
+            if gain_db is None:
+                return False
+            source_path = os.path.join(self.audio_folder, rel)
+            try:
+                st = os.stat(source_path)
+                entry = self._sources.get(rel)
+                if entry is None or entry[:2] != (st.st_mtime, st.st_size):
+                    entry = (st.st_mtime, st.st_size, file_digest(source_path))
+                    self._store(rel, entry)
+            except OSError:
+                return False
+            out_path = self._entry_path(entry[2], self.round_gain(gain_db))
+            if os.path.exists(out_path):
+                return False
+            tmp_path = f"{out_path}.{threading.get_ident()}.tmp"
+            if not transcode(source_path, tmp_path, self.round_gain(gain_db), self.BITRATE):
+                logger.debug("Transcoding failed", extra={"track": rel})
+                self._remove(tmp_path)
+                return False
+            os.replace(tmp_path, out_path)
+            with self._lock:
+                budget[0] -= os.path.getsize(out_path)
+            return True
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="opus") as pool:
+            transcoded = sum(pool.map(_ingest_one, list(paths)))
+        self.evict()
+        return transcoded
+
+    def prune(self, keep):
+        """Forget index rows for tracks that are no longer in the library; their files age out via evict()."""
+        keep = set(keep)
+        with self._lock:
+            stale = [p for p in self._sources if p not in keep]
+            for p in stale:
+                del self._sources[p]
+            if self._conn is not None and stale:
+                self._conn.executemany("DELETE FROM sources WHERE path = ?", [(p,) for p in stale])
+                self._conn.commit()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes. Returns the bytes freed."""
+        entries = []
+        now = time.time()
+        with os.scandir(self.cache_dir) as it:
+            for item in it:
+                if item.name.endswith(".tmp") and now - item.stat().st_mtime > 3600:
+                    # Left behind by a transcode that was interrupted
+                    self._remove(item.path)
+                elif item.name.endswith(".opus"):
+                    st = item.stat()
+                    entries.append((st.st_mtime, st.st_size, item.path))
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for _, size, path in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            self._remove(path)
+            freed += size
+        if freed:
+            logger.info("Evicted %.1f MB from the Opus cache.", freed / 1e6)
+        return freed
+
+    def _total_bytes(self):
+        with os.scandir(self.cache_dir) as it:
+            return sum(item.stat().st_size for item in it if item.name.endswith(".opus"))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _store(self, rel, entry):
+        with self._lock:
+            self._sources[rel] = entry
+            if self._conn is not None:
+                self._conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)", (rel, *entry))
+                self._conn.commit()